@@ -0,0 +1,84 @@
+"""Benchmark: métricas de fermentación escalares vs. vectorizadas.
+
+Calcula las cinco columnas derivadas (peso_esp, gaf, alcohol_peso,
+alcohol_volumen, extracto_real) con main.derivar_fermentacion documento a
+documento y con main.calcular_metricas_fermentacion_lote sobre columnas
+completas, y comprueba que los resultados son idénticos (incluidos vacíos,
+textos no numéricos, ceros y NaN).
+
+Uso: python benchmarks/bench_metrics.py [lecturas]
+"""
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main
+
+METRICAS = ['peso_esp', 'gaf', 'alcohol_peso', 'alcohol_volumen', 'extracto_real']
+EO = 'Extrácto original [%] p/p (Ej: 16.0)'
+EA = 'Extrácto aparente [%] p/p (Ej: 2.70)'
+
+# Casos límite: vacíos, texto, cero, signo, NaN/inf, números ya convertidos
+ESPECIALES = ['', None, 'abc', '0', '0.0', '-0', 0, 0.0, 'nan', 'inf', '-3.5', ' 2.7 ', '2,7', 16, 2.7]
+
+
+def valor_aleatorio(rng, low, high):
+    if rng.random() < 0.05:
+        return rng.choice(ESPECIALES)
+    return f'{rng.uniform(low, high):.2f}'
+
+
+def iguales(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return a == b or (math.isnan(a) and math.isnan(b))
+    return type(a) is type(b) and a == b
+
+
+def main_bench(n):
+    rng = random.Random(7)
+    originales = [valor_aleatorio(rng, 8, 20) for _ in range(n)]
+    aparentes = [valor_aleatorio(rng, 0.5, 6) for _ in range(n)]
+    # Todas las combinaciones de casos límite
+    for eo in ESPECIALES:
+        for ea in ESPECIALES:
+            originales.append(eo)
+            aparentes.append(ea)
+    total = len(originales)
+    print(f'📏 Métricas de fermentación para {total:,} lecturas')
+    
+    start = time.perf_counter()
+    escalares = [main.derivar_fermentacion({EO: eo, EA: ea}) for eo, ea in zip(originales, aparentes)]
+    escalar = time.perf_counter() - start
+    print(f'  escalar    {total / escalar:>12,.0f} lecturas/s  ({escalar * 1000:.1f} ms)')
+    
+    start = time.perf_counter()
+    lote = main.calcular_metricas_fermentacion_lote(originales, aparentes)
+    vectorizado = time.perf_counter() - start
+    print(f'  lote       {total / vectorizado:>12,.0f} lecturas/s  ({vectorizado * 1000:.1f} ms)')
+    
+    # Columnas ya numéricas (p. ej. recálculo desde un histórico cargado como arrays)
+    import numpy as np
+    eo_num = np.array([rng.uniform(8, 20) for _ in range(n)])
+    ea_num = np.array([rng.uniform(0.5, 6) for _ in range(n)])
+    start = time.perf_counter()
+    lote_num = main.calcular_metricas_fermentacion_lote(eo_num, ea_num)
+    numerico = time.perf_counter() - start
+    print(f'  lote float {n / numerico:>12,.0f} lecturas/s  ({numerico * 1000:.1f} ms)')
+    
+    for metrica in METRICAS:
+        celdas = main.celdas_metricas(lote[metrica])
+        for i, (esperado, obtenido) in enumerate(zip((fila[metrica] for fila in escalares), celdas)):
+            assert iguales(esperado, obtenido), (metrica, originales[i], aparentes[i], esperado, obtenido)
+        celdas = main.celdas_metricas(lote_num[metrica])
+        for i in range(0, n, max(1, n // 1000)):
+            esperado = main.derivar_fermentacion({EO: float(eo_num[i]), EA: float(ea_num[i])})[metrica]
+            assert iguales(esperado, celdas[i]), (metrica, eo_num[i], ea_num[i], esperado, celdas[i])
+    print('✅ Resultados idénticos a las funciones escalares')
+
+
+if __name__ == '__main__':
+    main_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
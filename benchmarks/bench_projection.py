@@ -0,0 +1,247 @@
+"""Micro-benchmark: proyección documento -> fila de la hoja.
+
+Compara la cadena if/elif original (copiada abajo tal cual) con los
+proyectores compilados de main.SHEET_SCHEMAS sobre una colección sintética,
+y comprueba que ambas producen las mismas filas (salvo el alcohol final de
+tanque_presion, que ahora sale del índice de alcohol por tanque y fecha).
+
+Uso: python benchmarks/bench_projection.py [documentos]
+"""
+import contextlib
+import gc
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('SYNC_STATE_DB', ':memory:')
+
+import main
+from main import (calcular_peso_esp, calcular_gaf, calcular_alcohol_peso,
+                  calcular_alcohol_volumen, calcular_extracto_real)
+
+# Diccionario de alcohol por tanque de la versión original
+tanques_alcohol = {}
+
+
+# Cadena if/elif original de sync_collection (antes del esquema declarativo)
+def legacy_row(collection_name, doc_id, data):
+    fecha = data.get('date', '')
+    
+    if collection_name == 'cocimiento':
+        # COCIMIENTO - desde fila 6
+        row = [''] * 13
+        row[0] = doc_id  # Columna A: ID oculto
+        row[1] = fecha  # Columna B: Fecha
+        row[2] = data.get('Tipo (Ej: Judas) holi', '')
+        row[3] = data.get('N° Cocimiento (Ej: 102)', '')  # Columna D
+        row[4] = data.get('A Tq N° (Ej: 4)', '')  # Columna E
+        row[5] = data.get('pH (Mosto Macerado) (Ej: 5.4)', '')  # Columna F
+        row[6] = ''  # Columna G (vacía)
+        row[7] = data.get('Extracto original [%] p/p (Primer Mosto) (Ej: 18.5)', '')  # Columna H
+        row[8] = ''  # Columna I (vacía)
+        row[9] = data.get('Extracto original [%] p/p (Mosto Frío) (Ej: 16.5)', '')  # Columna J
+        row[10] = data.get('pH(Mosto Frío) (Ej: 5.43)', '')  # Columna K
+        row[11] = data.get('Color [EBC] (Mosto Frío) (Ej: 8.5)', '')  # Columna L
+        row[12] = data.get('Observaciones (Ej: Sin muestra frío)', '')  # Columna M
+
+        return row
+
+    elif collection_name == 'fermentacion':
+        # FERMENTACIÓN - desde fila 6 (columnas B, C, E, F, G, H, I, J)
+        extracto_aparente = data.get('Extrácto aparente [%] p/p (Ej: 2.70)', '')
+        extracto_original = data.get('Extrácto original [%] p/p (Ej: 16.0)', '')
+
+        # Realizar cálculos
+        peso_esp = calcular_peso_esp(extracto_aparente) if extracto_aparente else ""
+        gaf = calcular_gaf(extracto_original, extracto_aparente) if extracto_original and extracto_aparente else ""
+        alcohol_peso = calcular_alcohol_peso(extracto_original, extracto_aparente) if extracto_original and extracto_aparente else ""
+        alcohol_volumen = calcular_alcohol_volumen(alcohol_peso, peso_esp) if alcohol_peso and peso_esp else ""
+        extracto_real = calcular_extracto_real(extracto_original, alcohol_peso) if extracto_original and alcohol_peso else ""
+
+        # Guardar en diccionario para uso en tanque de presión
+        numero_tanque = data.get('Tq N°(Ej: 7)', '')
+        if numero_tanque and alcohol_volumen:
+            # Guardar solo el valor más reciente por tanque
+            tanques_alcohol[numero_tanque] = {
+                'alcohol': alcohol_volumen,
+                'fecha': fecha,
+                'cocimiento': data.get('N° Cocimiento (Ej: 341-342-343)', '')
+            }
+            print(f"✅ Tanque {numero_tanque} actualizado: {alcohol_volumen}%")
+
+        row = [''] * 15  # A-O (15 columnas para incluir cálculos)
+        row[0] = doc_id  # Columna A: ID oculto
+        row[1] = fecha  # Columna B: Fecha
+        row[2] = data.get('Tipo (Ej: Autentica)', '')  # Columna C: Tipo
+        row[3] = data.get('N° Cocimiento (Ej: 341-342-343)', '')  # Columna D
+        row[4] = data.get('Tq N°(Ej: 7)', '')  # Columna E: Tq N°
+        row[5] = data.get('pH (Ej: 4.36)', '')  # Columna F: pH
+        row[6] = data.get('Color [EBC] (Ej: 9.5)', '')  # Columna G: Color
+        row[7] = data.get('Turbidez [EBC] (Ej: 18.92)', '')  # Columna H: Turbidez
+        row[8] = extracto_aparente  # Columna I: Ext. Aparente
+        row[9] = extracto_original  # Columna J: Ext. Original
+        row[10] = extracto_real  # Columna K: Extracto Real
+        row[11] = alcohol_peso  # Columna L: Alcohol Peso
+        row[12] = alcohol_volumen  # Columna M: Alcohol Volumen
+        row[13] = peso_esp  # Columna N: Peso Esp
+        row[14] = gaf  # Columna O: GAF
+
+        return row
+
+    elif collection_name == 'tanque_presion':
+        end_col = 'U'  # Ahora va hasta la columna U por el alcohol final
+        # TANQUE DE PRESIÓN - desde fila 5
+        alcohol_final = ""
+
+        # Calcular alcohol final si hay datos de tanques
+        try:
+            volumen_total = float(data.get('Volumen total [L] (Ej: 6650)', 0))
+            if volumen_total > 0:
+                alcohol_total = 0
+                volumen_cerveza_total = 0
+
+                # Para cada tanque (A, B, C)
+                for tanque in ['A', 'B', 'C']:
+                    num_tanque = data.get(f'Tanque {tanque} (Ej: 1)', '')
+                    volumen_str = data.get(f'Volumen total del Tanque {tanque} [L] (Ej: 2650)', '')
+
+                    if num_tanque and volumen_str and num_tanque in tanques_alcohol:
+                        try:
+                            volumen = float(volumen_str)
+                            alcohol_data = tanques_alcohol[num_tanque]
+                            alcohol_vol = float(alcohol_data['alcohol'])
+
+                            alcohol_total += volumen * alcohol_vol
+                            volumen_cerveza_total += volumen
+
+                            print(f"✅ Usando tanque {num_tanque}: {alcohol_vol}% (de {alcohol_data['fecha']})")
+                        except ValueError:
+                            continue
+
+                # Calcular alcohol final considerando el agua añadida
+                if volumen_cerveza_total > 0:
+                    alcohol_final = (alcohol_total / volumen_total) * 100
+        except (ValueError, TypeError):
+            alcohol_final = ""
+
+        row = [''] * 21  # A-U (21 columnas, añadiendo columna U para alcohol final)
+        row[0] = doc_id  # Columna A: ID oculto
+        row[1] = fecha  # Columna B: Fecha
+        row[2] = data.get('Tipo (Ej: Trimalta )', '')  # Columna C: Tipo
+        row[3] = data.get('N° Cocimiento (Ej:125-126)', '')  # Columna D: N° Cocimiento
+        row[4] = data.get('Tp N° (Ej: 2)', '')  # Columna E: Tp N°
+        row[5] = data.get('Tq N° (Ej: 9-7-6)', '')  # Columna F: Tq N°
+        # Columna G vacía
+        row[7] = data.get('Sedimentos (0/S/SS/SSS) (EJ: S)', '')  # Columna H: Sedimentos
+        row[8] = data.get('Color [EBC] (Ej: 7.5)', '')  # Columna I: Color
+        row[9] = data.get('Extrácto aparente [%] p/p (Ej: 2.06)', '')  # Columna J: Ext. Aparente
+        row[10] = data.get('Volumen total [L] (Ej: 6650)', '')  # Columna K: Volumen total
+        row[11] = data.get('Volumen H2O [L] (Ej: 1850)', '')  # Columna L: Volumen H2O
+        row[12] = data.get('Tanque A (Ej: 1)', '')  # Columna M: Tanque A
+        row[13] = data.get('Volumen total del Tanque A [L] (Ej: 2650)', '')  # Columna N: Volumen Tanque A
+        row[14] = data.get('Tanque B (Ej: 14)', '')  # Columna O: Tanque B
+        row[15] = data.get('Volumen total del Tanque B [L] (Ej: 1950)', '')  # Columna P: Volumen Tanque B
+        row[16] = data.get('Tanque C (Ej: 9)', '')  # Columna Q: Tanque C
+        row[17] = data.get('Volumen total del Tanque C [L] (Ej: 200)', '')  # Columna R: Volumen Tanque C
+        row[18] = data.get('Observaciones', '')  # Columna S: Observaciones
+        # Columna T vacía
+        row[20] = alcohol_final  # Columna U: Alcohol final de la mezcla
+
+        return row
+
+    elif collection_name == 'envasado':
+        # ENVASADO - desde fila 6
+        row = [''] * 15  # A-O (15 columnas)
+        row[0] = doc_id  # Columna A: ID oculto
+        row[1] = fecha  # Columna B: Fecha
+        row[2] = data.get('Tipo (Ej: Occidental)', '')  # Columna C: Tipo
+        row[3] = data.get('Calibre [ml] (Ej: 620)', '')  # Columna D: Calibre
+        row[4] = data.get('Tq N° (Ej: 10-12)', '')  # Columna E: Tq N°
+        row[5] = data.get('Tp N° (Ej: 1)', '')  # Columna F: Tp N°
+        row[6] = data.get('N° Cocimiento (Ej: 91-92-95-96)', '')  # Columna G: N° Cocimiento
+        row[7] = data.get('Turbidez [EBC] (Ej: 0.3)', '')  # Columna H: Turbidez
+        row[8] = data.get('Degustación (OK ; no OK)', '')  # Columna I: Degustación
+        row[9] = data.get('Sedimentos (0/S/SS/SSS) (Ej: 0)', '')  # Columna J: Sedimentos
+        row[10] = data.get('T set [°C] (Pasteurizadora) (Ej: 69)', '')  # Columna K: T set
+        row[11] = data.get('T max [°C] (Pasteurizadora) (Ej: 69.1)', '')  # Columna L: T max
+        row[12] = data.get('UP', '')  # Columna M: UP
+        row[13] = data.get('NaOH [%] (Lavadora) (Ej: 0.48)', '')  # Columna N: NaOH
+        row[14] = data.get('Observaciones (Ej: Adición 1/2 bolsa soda)', '')  # Columna O: Observaciones
+
+        return row
+
+    elif collection_name == 'producto_terminado':
+        # PRODUCTO TERMINADO - desde fila 5
+        row = [''] * 15  # A-O (15 columnas)
+        row[0] = doc_id  # Columna A: ID oculto
+        row[1] = fecha  # Columna B: Fecha
+        row[2] = data.get('Código (Envasado/Vencimiento) (Ej: L = 150-00438 / V = 30-5-26)', '')  # Columna C: Código
+        row[3] = data.get('Tipo (Ej: Trimalta Quinua)', '')  # Columna D: Tipo
+        row[4] = data.get('Calibre [ml] (Ej: 300)', '')  # Columna E: Calibre
+        row[5] = data.get('Tq N° (Ej: 1-10)', '')  # Columna F: Tq N°
+        row[6] = data.get('Tp N° (Ej: 2)', '')  # Columna G: Tp N°
+        row[7] = data.get('N° Cocimiento (Ej: 63-64)', '')  # Columna H: N° Cocimiento
+        row[8] = data.get('pH (Ej: 4.67)', '')  # Columna I: pH
+        row[9] = data.get('Color [EBC] (Ej: 150)', '')  # Columna J: Color
+        row[10] = data.get('Extrácto aparente [%] p/p (Ej: 11.2)', '')  # Columna K: Ext. Aparente
+        row[11] = data.get('Espuma [seg] (123)', '')  # Columna L: Espuma
+        row[12] = data.get('Sedimentos 0°C (0/S/SS/SSS) (Ej: S)', '')  # Columna M: Sedimentos 0°C
+        row[13] = data.get('Sedimentos 20°C (0/S/SS/SSS) (Ej: SS)', '')  # Columna N: Sedimentos 20°C
+        row[14] = data.get('Observaciones', '')  # Columna O: Observaciones
+
+        return row
+
+
+# Documento sintético con los campos reales del esquema
+def synthetic_doc(collection_name, i, rng):
+    data = {'date': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'}
+    for _, key, *kind in main.SHEET_SCHEMAS[collection_name]['columns']:
+        if key is main.DOC_ID or kind or key == 'date' or rng.random() < 0.1:
+            continue  # ~10% de campos ausentes
+        data[key] = str(rng.randint(1, 20))
+    if collection_name == 'fermentacion':
+        data['Extrácto original [%] p/p (Ej: 16.0)'] = f'{rng.uniform(10, 20):.1f}'
+        data['Extrácto aparente [%] p/p (Ej: 2.70)'] = f'{rng.uniform(1, 5):.2f}'
+    return f'{collection_name}-{i:06d}', data
+
+
+def run(label, project, docs, repeat=3):
+    # Mejor de varias pasadas, sin GC, para reducir ruido
+    best = None
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                rows = [project(doc_id, data) for doc_id, data in docs]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    print(f'  {label:<10} {len(docs) / best:>12,.0f} docs/s  ({best * 1000:.1f} ms)')
+    return rows
+
+
+def main_bench(n):
+    rng = random.Random(42)
+    print(f'📏 Proyección de {n:,} documentos por colección')
+    for collection_name in main.SHEET_SCHEMAS:
+        docs = [synthetic_doc(collection_name, i, rng) for i in range(n)]
+        print(f'{collection_name}:')
+        before = run('if/elif', lambda doc_id, data: legacy_row(collection_name, doc_id, data), docs)
+        after = run('esquema', main.PROJECTORS[collection_name], docs)
+        if collection_name == 'fermentacion':
+            with contextlib.redirect_stdout(io.StringIO()):
+                for doc_id, data in docs:
+                    main.indexar_alcohol_tanque(doc_id, data)
+        if collection_name == 'tanque_presion':
+            before = [row[:-1] for row in before]
+            after = [row[:-1] for row in after]
+        assert before == after, f'Filas distintas en {collection_name}'
+
+
+if __name__ == '__main__':
+    main_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,112 @@
+"""Benchmark del arranque en frío: cuánto tarda /health en responder.
+
+Lanza `main.serve()` en un proceso nuevo con STARTUP_MODE=blocking (primera
+sincronización antes de abrir el puerto, como antes) y con STARTUP_MODE=fast
+(puerto primero, sincronización en segundo plano) y mide, desde que se lanza
+el proceso, el primer 200 de /health y el momento en que /health informa que
+la primera sincronización terminó.
+
+Los clientes de Firestore y Sheets son los backends en memoria de
+benchmarks/fakes.py, pero se crean importando antes los SDK reales
+(firebase_admin, gspread) para que el costo de esas importaciones siga en
+la primera sincronización.
+
+Uso: python benchmarks/bench_startup.py [--docs N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = ['blocking', 'fast']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_health(port):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as response:
+            return json.load(response)
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+
+def run_child(docs):
+    sys.path[:0] = [BENCH_DIR, os.path.join(BENCH_DIR, '..')]
+    import main
+
+    def setup_firebase(key_file=None):
+        import firebase_admin.firestore  # noqa: F401 (costo real de importación)
+        import fakes
+        return fakes.synthetic_database(docs)
+
+    def setup_sheets(key_file=None):
+        import gspread  # noqa: F401
+        import google.oauth2.service_account  # noqa: F401
+        import fakes
+        return fakes.FakeSheetsClient(fakes.synthetic_spreadsheet())
+
+    main.setup_firebase = setup_firebase
+    main.setup_sheets = setup_sheets
+    main.serve()
+
+
+def measure(mode, docs, timeout=120):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = dict(os.environ, STARTUP_MODE=mode, PORT=str(port), SYNC_TRIGGER='poll',
+                   RENDER_URL=f'http://127.0.0.1:{port}',
+                   SYNC_STATE_DB=os.path.join(state_dir, 'sync-state.db'),
+                   SYNC_CHECKPOINT_FILE=os.path.join(state_dir, 'sync-checkpoint.json'),
+                   SHEETS_READS_PER_MINUTE='1000000000', SHEETS_WRITES_PER_MINUTE='1000000000')
+        started = time.perf_counter()
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', '--docs', str(docs)],
+                                 env=env, cwd=state_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            health = ready = None
+            while time.perf_counter() - started < timeout:
+                status = get_health(port)
+                if status is not None:
+                    health = health or time.perf_counter() - started
+                    if status.get('startup') == 'ready':
+                        ready = time.perf_counter() - started
+                        break
+                time.sleep(0.01)
+            return health, ready
+        finally:
+            child.kill()
+            child.wait()
+
+
+def main_bench(docs, repeat):
+    print(f'{docs:,} documentos, mediana de {repeat} arranques')
+    print(f'{"modo":<9} {"/health":>9} {"1ª sync":>9}')
+    for mode in MODES:
+        runs = [measure(mode, docs) for _ in range(repeat)]
+        health = statistics.median(run[0] for run in runs)
+        ready = statistics.median(run[1] for run in runs)
+        print(f'{mode:<9} {health:>8.2f}s {ready:>8.2f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.docs)
+    else:
+        main_bench(args.docs, args.repeat)
@@ -0,0 +1,118 @@
+"""Benchmark de un ciclo completo de sync_data, sin red.
+
+Usa los backends en memoria de benchmarks/fakes.py con colecciones
+sintéticas (etiquetas reales) de 1k, 10k y 100k documentos en total, y mide
+dos ciclos seguidos: el inicial (hojas vacías, se escribe todo) y el estable
+(sin documentos nuevos). Para cada uno informa tiempo, documentos por
+segundo, llamadas a Firestore y Sheets, bytes transferidos y memoria pico.
+
+Cada tamaño corre en un proceso nuevo (estado local limpio) y dos veces: una
+para medir tiempo y otra con tracemalloc para la memoria pico, porque
+tracemalloc ralentiza la ejecución.
+
+Uso: python benchmarks/bench_sync.py [tamaños...]
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+CYCLES = ['inicial', 'estable']
+
+
+# Entorno aislado para el proceso hijo: estado local temporal y sin límite de cuota
+def child_environment(state_dir):
+    env = dict(os.environ)
+    env.update({
+        'SYNC_STATE_DB': os.path.join(state_dir, 'sync-state.db'),
+        'SYNC_CHECKPOINT_FILE': os.path.join(state_dir, 'sync-checkpoint.json'),
+        'SHEETS_READS_PER_MINUTE': '1000000000',
+        'SHEETS_WRITES_PER_MINUTE': '1000000000',
+    })
+    return env
+
+
+def run_child(size, trace_memory):
+    import fakes
+    import main
+
+    db = fakes.synthetic_database(size)
+    spreadsheet = fakes.synthetic_spreadsheet()
+    main.install_clients(db, fakes.FakeSheetsClient(spreadsheet))
+
+    results = []
+    for cycle in CYCLES:
+        db.stats.reset()
+        spreadsheet.stats.reset()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            main.sync_data()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+
+        calls = db.stats.calls
+        results.append({
+            'cycle': cycle,
+            'seconds': elapsed,
+            'docs_read': sum(count for call, count in calls.items() if call.endswith('.read')),
+            'firestore_calls': sum(count for call, count in calls.items() if call.endswith('.stream')),
+            'sheets_calls': spreadsheet.stats.total_calls('sheets.'),
+            'bytes': db.stats.bytes_received + spreadsheet.stats.bytes_sent + spreadsheet.stats.bytes_received,
+            'peak_bytes': peak,
+        })
+    print(json.dumps(results))
+
+
+def measure(size):
+    measured = {}
+    for trace_memory in (False, True):
+        with tempfile.TemporaryDirectory() as state_dir:
+            command = [sys.executable, os.path.abspath(__file__), '--child', str(size)]
+            if trace_memory:
+                command.append('--memory')
+            output = subprocess.run(command, env=child_environment(state_dir), cwd=state_dir,
+                                    check=True, capture_output=True, text=True).stdout
+            for result in json.loads(output.strip().splitlines()[-1]):
+                current = measured.setdefault(result['cycle'], result)
+                if trace_memory:
+                    current['peak_bytes'] = result['peak_bytes']
+    return [measured[cycle] for cycle in CYCLES]
+
+
+def megabytes(value):
+    return f'{value / 1e6:,.1f} MB'
+
+
+def main_bench(sizes):
+    print(f'{"docs":>8} {"ciclo":<8} {"tiempo":>9} {"docs/s":>10} {"Firestore":>9} {"Sheets":>7} {"bytes":>10} {"memoria":>10}')
+    for size in sizes:
+        for result in measure(size):
+            rate = result['docs_read'] / result['seconds'] if result['seconds'] else 0
+            print(f'{size:>8,} {result["cycle"]:<8} {result["seconds"]:>8.2f}s {rate:>10,.0f} '
+                  f'{result["firestore_calls"]:>9} {result["sheets_calls"]:>7} '
+                  f'{megabytes(result["bytes"]):>10} {megabytes(result["peak_bytes"]):>10}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--memory', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        sys.path.insert(0, BENCH_DIR)
+        run_child(args.child, args.memory)
+    else:
+        main_bench(args.sizes)
@@ -0,0 +1,366 @@
+"""Backends en memoria para medir la sincronización sin red.
+
+FakeFirestore imita lo que main.py usa del cliente de Firestore
+(collection, order_by por campo o por ID, start_at/start_after, limit, stream,
+on_snapshot) y FakeSheetsClient / FakeSpreadsheet / FakeWorksheet lo que usa
+de gspread (open, worksheets, worksheet, get, update, batch_update,
+col_values, get_all_values). Ambos cuentan llamadas y bytes transferidos
+(tamaño JSON de lo enviado y recibido) en un ApiStats.
+
+synthetic_database() genera colecciones con las etiquetas reales de los
+formularios y synthetic_spreadsheet() las hojas vacías con sus encabezados.
+"""
+import json
+import random
+import re
+import threading
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import gspread
+
+import main
+
+
+class ApiStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def record(self, call, sent=None, received=None):
+        with self.lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+            if sent is not None:
+                self.bytes_sent += payload_size(sent)
+            if received is not None:
+                self.bytes_received += payload_size(received)
+
+    def total_calls(self, prefix=''):
+        return sum(count for call, count in self.calls.items() if call.startswith(prefix))
+
+
+def payload_size(value):
+    return len(json.dumps(value, default=str, ensure_ascii=False).encode('utf-8'))
+
+
+# --- Firestore -------------------------------------------------------------
+
+class FakeDocument:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeQuery:
+    def __init__(self, db, collection_name, order=None, start=None, inclusive=True, limit=None):
+        self.db = db
+        self.collection_name = collection_name
+        self.order = order
+        self.start = start
+        self.inclusive = inclusive
+        self.limit_count = limit
+
+    def _copy(self, **changes):
+        values = dict(order=self.order, start=self.start, inclusive=self.inclusive, limit=self.limit_count)
+        values.update(changes)
+        return FakeQuery(self.db, self.collection_name, **values)
+
+    def order_by(self, field, direction=None):
+        return self._copy(order=field)
+
+    def start_at(self, values):
+        return self._copy(start=values[self.order], inclusive=True)
+
+    def start_after(self, values):
+        return self._copy(start=values[self.order], inclusive=False)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def _documents(self):
+        docs = self.db.collections.get(self.collection_name, [])
+        if self.order == main.DOCUMENT_ID_FIELD:
+            field = lambda doc: doc.id
+        elif self.order:
+            field = lambda doc: doc._data[self.order]
+            # Como en Firestore, order_by excluye documentos sin el campo
+            docs = [doc for doc in docs if self.order in doc._data]
+        if self.order:
+            docs = sorted(docs, key=lambda doc: (field(doc), doc.id))
+            if self.start is not None:
+                if self.inclusive:
+                    docs = [doc for doc in docs if field(doc) >= self.start]
+                else:
+                    docs = [doc for doc in docs if field(doc) > self.start]
+        if self.limit_count is not None:
+            docs = docs[:self.limit_count]
+        return docs
+
+    def stream(self):
+        self.db.stats.record(f'firestore.{self.collection_name}.stream')
+        for doc in self._documents():
+            self.db.stats.record(f'firestore.{self.collection_name}.read', received=doc._data)
+            yield doc
+
+    # Listener: primera instantánea con lo existente y luego cada documento añadido o editado
+    def on_snapshot(self, callback):
+        docs = self._documents()
+        callback(docs, [snapshot_change('ADDED', doc) for doc in docs], None)
+        listener = (self, callback)
+        self.db.listeners.append(listener)
+        return SimpleNamespace(unsubscribe=lambda: self.db.listeners.remove(listener))
+
+
+def snapshot_change(kind, doc):
+    return SimpleNamespace(type=SimpleNamespace(name=kind), document=doc)
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.collections = {}
+        self.listeners = []
+        self.stats = ApiStats()
+
+    def collection(self, name):
+        return FakeQuery(self, name)
+
+    def add_document(self, collection_name, doc_id, data):
+        doc = FakeDocument(doc_id, data)
+        self.collections.setdefault(collection_name, []).append(doc)
+        self._notify(collection_name, 'ADDED', doc)
+        return doc
+
+    # Reemplazar los campos de un documento existente (cambio MODIFIED para los listeners)
+    def update_document(self, collection_name, doc_id, data):
+        for doc in self.collections[collection_name]:
+            if doc.id == doc_id:
+                doc._data = data
+                self._notify(collection_name, 'MODIFIED', doc)
+                return doc
+        raise KeyError(doc_id)
+
+    # Borrar un documento (cambio REMOVED para los listeners)
+    def delete_document(self, collection_name, doc_id):
+        docs = self.collections[collection_name]
+        for i, doc in enumerate(docs):
+            if doc.id == doc_id:
+                del docs[i]
+                self._notify(collection_name, 'REMOVED', doc)
+                return doc
+        raise KeyError(doc_id)
+
+    def _notify(self, collection_name, kind, doc):
+        for query, callback in list(self.listeners):
+            if query.collection_name == collection_name:
+                callback([doc], [snapshot_change(kind, doc)], None)
+
+
+# --- Google Sheets ---------------------------------------------------------
+
+A1_RANGE = re.compile(r'^([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$')
+
+
+def parse_range(range_name):
+    match = A1_RANGE.match(range_name)
+    if not match:
+        raise ValueError(f'Rango no soportado: {range_name}')
+    first_col, first_row, last_col, last_row = match.groups()
+    if last_col is None and first_row:  # Una sola celda: 'A8'
+        return main.col_index(first_col), int(first_row), main.col_index(first_col), int(first_row)
+    first_row = int(first_row) if first_row else 1
+    last_col = last_col or first_col
+    last_row = int(last_row) if last_row else None
+    return main.col_index(first_col), first_row, main.col_index(last_col), last_row
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.rows = []
+        self.lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return self.spreadsheet.stats
+
+    def _set_cell(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        if len(cells) <= col:
+            cells.extend([''] * (col + 1 - len(cells)))
+        cells[col] = value
+
+    def _write(self, range_name, values):
+        first_col, first_row, _, _ = parse_range(range_name)
+        with self.lock:
+            for i, row in enumerate(values):
+                for j, value in enumerate(row):
+                    self._set_cell(first_row + i, first_col + j, value)
+
+    def _read(self, range_name):
+        first_col, first_row, last_col, last_row = parse_range(range_name)
+        with self.lock:
+            last_row = last_row or len(self.rows)
+            values = []
+            for row in self.rows[first_row - 1:last_row]:
+                cells = row[first_col:last_col + 1]
+                while cells and cells[-1] == '':
+                    cells = cells[:-1]
+                values.append(cells)
+            while values and not values[-1]:
+                values.pop()
+            return values
+
+    def get(self, range_name=None, **kwargs):
+        values = self._read(range_name or 'A1:ZZ')
+        self.stats.record('sheets.get', received=values)
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        values = [self._read(range_name) for range_name in ranges]
+        self.stats.record('sheets.batch_get', received=values)
+        return values
+
+    def col_values(self, col, **kwargs):
+        values = [row[0] if row else '' for row in self._read(f'{main.col_letter(col - 1)}1:{main.col_letter(col - 1)}')]
+        self.stats.record('sheets.col_values', received=values)
+        return values
+
+    def get_all_values(self, **kwargs):
+        with self.lock:
+            width = max((len(row) for row in self.rows), default=0)
+            values = [row + [''] * (width - len(row)) for row in self.rows]
+        self.stats.record('sheets.get_all_values', received=values)
+        return values
+
+    def update(self, range_name, values=None, **kwargs):
+        self._write(range_name, values)
+        self.stats.record('sheets.update', sent=values)
+        return {'updatedRange': range_name}
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            self._write(item['range'], item['values'])
+        self.stats.record('sheets.batch_update', sent=data)
+        return {'totalUpdatedCells': sum(len(row) for item in data for row in item['values'])}
+
+
+class FakeSpreadsheet:
+    def __init__(self, title, spreadsheet_id='fake-spreadsheet', stats=None):
+        self.title = title
+        self.id = spreadsheet_id
+        self.stats = stats or ApiStats()
+        self._worksheets = []
+
+    def add_worksheet(self, title, rows=1000, cols=26):
+        worksheet = FakeWorksheet(self, len(self._worksheets) + 1, title)
+        self._worksheets.append(worksheet)
+        return worksheet
+
+    def del_worksheet(self, worksheet):
+        self._worksheets.remove(worksheet)
+
+    def worksheets(self):
+        self.stats.record('sheets.worksheets', received=[ws.title for ws in self._worksheets])
+        return list(self._worksheets)
+
+    def worksheet(self, title):
+        self.stats.record('sheets.worksheet')
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+
+class FakeSheetsClient:
+    def __init__(self, *spreadsheets):
+        self.spreadsheets = {spreadsheet.title: spreadsheet for spreadsheet in spreadsheets}
+
+    def open(self, title):
+        spreadsheet = self.spreadsheets[title]
+        spreadsheet.stats.record('sheets.open')
+        return spreadsheet
+
+
+# --- Datos sintéticos ------------------------------------------------------
+
+TIPOS = ['Autentica', 'Judas', 'Trimalta', 'Trimalta Quinua', 'Occidental']
+OBSERVACIONES = ['', '', '', 'Sin muestra frío', 'Adición 1/2 bolsa soda',
+                 'Se repitió la medición de pH por lectura inestable del equipo; '
+                 'revisar calibración antes del próximo cocimiento y anotar lote de buffer.']
+SEDIMENTOS = ['0', 'S', 'SS', 'SSS']
+
+
+# Valor verosímil según la etiqueta del formulario
+def synthetic_value(label, rng):
+    if 'Extrácto original' in label or 'Extracto original' in label:
+        return f'{rng.uniform(14, 18.5):.1f}'
+    if 'aparente' in label:
+        return f'{rng.uniform(1.5, 4):.2f}'
+    if label.startswith('pH'):
+        return f'{rng.uniform(4.1, 5.6):.2f}'
+    if 'Color' in label:
+        return f'{rng.uniform(5, 12):.1f}'
+    if 'Turbidez' in label:
+        return f'{rng.uniform(0.2, 20):.2f}'
+    if 'Sedimentos' in label:
+        return rng.choice(SEDIMENTOS)
+    if 'Volumen' in label:
+        return str(rng.randrange(200, 7000, 50))
+    if label.startswith('Tanque') or label.startswith('A Tq'):
+        return str(rng.randint(1, 14))
+    if label.startswith('Tq') or label.startswith('Tp'):
+        return '-'.join(str(rng.randint(1, 14)) for _ in range(rng.randint(1, 3)))
+    if 'Cocimiento' in label:
+        first = rng.randint(1, 400)
+        return '-'.join(str(first + i) for i in range(rng.randint(1, 3)))
+    if label.startswith('Tipo'):
+        return rng.choice(TIPOS)
+    if label.startswith('Observaciones'):
+        return rng.choice(OBSERVACIONES)
+    return str(rng.randint(1, 700))
+
+
+def synthetic_documents(collection_name, count, rng, first_day=date(2023, 1, 1)):
+    labels = [key for _, key, *kind in main.SHEET_SCHEMAS[collection_name]['columns']
+              if key is not main.DOC_ID and not kind and key != 'date']
+    for i in range(count):
+        data = {'date': (first_day + timedelta(days=i * 365 // max(count, 1))).isoformat()}
+        for label in labels:
+            if rng.random() < 0.05:
+                continue  # Campos ausentes
+            data[label] = synthetic_value(label, rng)
+        yield f'{collection_name}-{i:07d}', data
+
+
+# `total_docs` documentos repartidos entre las cinco colecciones
+def synthetic_database(total_docs, seed=0):
+    rng = random.Random(seed)
+    db = FakeFirestore()
+    names = list(main.SHEET_SCHEMAS)
+    for position, collection_name in enumerate(names):
+        count = total_docs // len(names) + (1 if position < total_docs % len(names) else 0)
+        db.collections[collection_name] = [FakeDocument(doc_id, data)
+                                           for doc_id, data in synthetic_documents(collection_name, count, rng)]
+    return db
+
+
+# Hoja de cálculo con una hoja por colección y sus filas de encabezado
+def synthetic_spreadsheet(title=None, stats=None):
+    spreadsheet = FakeSpreadsheet(title or main.SPREADSHEET_NAME, stats=stats)
+    for collection_name, schema in main.SHEET_SCHEMAS.items():
+        worksheet = spreadsheet.add_worksheet(schema['sheet'])
+        for row in range(1, schema['header_rows'] + 1):
+            worksheet._set_cell(row, 1, f'Encabezado {row}')
+    return spreadsheet
@@ -0,0 +1,171 @@
+"""Reproducir sin red un ciclo grabado con SYNC_TRACE_DIR y perfilarlo.
+
+Carga una grabación (trace-*.jsonl.gz) en los backends en memoria de
+benchmarks/fakes.py: los documentos que vio el ciclo en un FakeFirestore por
+destino, y el estado que leyó (checkpoint, índice local de cada hoja con sus
+hashes, lecturas de alcohol por tanque) en un estado local temporal con las
+hojas correspondientes. Luego ejecuta sync_data con la misma configuración de
+destinos e informa tiempo, llamadas a las API falsas y las funciones más
+costosas según cProfile.
+
+cProfile mide un solo hilo, así que el pool corre con un hilo y se perfila
+cada colección por separado (sumando los resultados): el informe refleja el
+costo de CPU de cada función, no la concurrencia del ciclo real.
+
+Las filas que seguían en la cola de salida y las celdas guardadas de cada fila
+no se graban: en la reproducción esas filas cuentan como nuevas y una edición
+reescribe la fila completa.
+
+Uso: python benchmarks/replay_trace.py TRAZA [--top N] [--sort tottime|cumulative] [--verbose]
+"""
+import argparse
+import contextlib
+import cProfile
+import gzip
+import json
+import os
+import pstats
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Fechas grabadas como {'datetime': ...}, igual que los cursores del checkpoint
+def decode_dates(value):
+    if len(value) == 1 and 'datetime' in value:
+        return datetime.fromisoformat(value['datetime'])
+    return value
+
+
+def read_trace(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line, object_hook=decode_dates) for line in f if line.strip()]
+
+
+# Entorno del ciclo grabado; se fija antes de importar main (SYNC_TARGETS se lee al importar)
+def configure_environment(cycle, state_dir):
+    os.environ.update({
+        'SYNC_STATE_DB': os.path.join(state_dir, 'sync-state.db'),
+        'SYNC_CHECKPOINT_FILE': os.path.join(state_dir, 'sync-checkpoint.json'),
+        'SHEETS_READS_PER_MINUTE': '1000000000',
+        'SHEETS_WRITES_PER_MINUTE': '1000000000',
+        'SYNC_WORKERS': '1',
+        'SYNC_MODE': cycle['sync_mode'],
+        'SYNC_CURSOR_FIELD': cycle['cursor_field'],
+        'SYNC_TARGETS': json.dumps(cycle['targets']),
+    })
+    for name in ('SYNC_TRACE_DIR', 'SYNC_SEGMENTS_DIR'):
+        os.environ.pop(name, None)
+
+
+# Backends en memoria y estado local con lo que leyó el ciclo grabado
+def load_replay(records):
+    import fakes
+    import main
+
+    cycle = records[0]
+    main.checkpoint.update(cycle['checkpoint'])
+    db = main.get_state_db()
+    with db:
+        db.executemany('INSERT OR REPLACE INTO tank_alcohol VALUES (?, ?, ?, ?, ?, ?)', cycle['tank_alcohol'])
+
+    backends = {}
+    for target in main.SYNC_TARGETS.values():
+        firestore = fakes.FakeFirestore()
+        spreadsheet = fakes.FakeSpreadsheet(target['spreadsheet'], spreadsheet_id=f"replay-{target['name']}",
+                                            stats=firestore.stats)
+        worksheets = {}
+        for name in target['collections']:
+            worksheet = spreadsheet.add_worksheet(main.sheet_title(target, name))
+            for row in range(1, main.SHEET_SCHEMAS[name]['header_rows'] + 1):
+                worksheet._set_cell(row, 1, f'Encabezado {row}')
+            worksheets[name] = worksheet
+        main.install_clients(firestore, fakes.FakeSheetsClient(spreadsheet), target=target)
+        backends[target['name']] = (firestore, spreadsheet, worksheets, {})
+
+    indexed = []
+    for record in records[1:]:
+        firestore, _, worksheets, documents = backends[record['target']]
+        worksheet = worksheets.get(record.get('collection'))
+        if record['type'] == 'docs':
+            for doc_id, data in record['docs']:
+                documents.setdefault(record['collection'], {})[doc_id] = data
+        elif record['type'] == 'sheet':
+            key = main.sheet_key(worksheet)
+            db.execute('INSERT OR REPLACE INTO sheet_meta VALUES (?, ?, ?)', (key, record['next_row'], time.time()))
+            main.verified_sheets.add(key)
+        elif record['type'] == 'index':
+            key = main.sheet_key(worksheet)
+            for doc_id, row, digest in record['rows']:
+                if row is not None:  # Las filas en la cola de salida no se graban
+                    worksheet._set_cell(row, 0, doc_id)
+                    indexed.append((key, doc_id, row, digest))
+    with db:
+        db.executemany('INSERT OR REPLACE INTO sheet_rows (sheet, doc_id, row, hash) VALUES (?, ?, ?, ?)', indexed)
+
+    for firestore, _, _, documents in backends.values():
+        for name, docs in documents.items():
+            firestore.collections[name] = [fakes.FakeDocument(doc_id, data) for doc_id, data in docs.items()]
+    return cycle, backends
+
+
+# Perfilar cada sync_sheet en el hilo del pool que la ejecuta
+def profile_sheets(main, profiles):
+    sync_sheet = main.sync_sheet
+
+    def profiled(*args, **kwargs):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return sync_sheet(*args, **kwargs)
+        finally:
+            profiler.disable()
+            profiles.append(profiler)
+
+    main.sync_sheet = profiled
+
+
+def replay(path, top, sort, verbose):
+    sys.path[:0] = [BENCH_DIR, os.path.join(BENCH_DIR, '..')]
+    records = read_trace(path)
+    with tempfile.TemporaryDirectory() as state_dir:
+        configure_environment(records[0], state_dir)
+        os.chdir(state_dir)
+        import main
+        cycle, backends = load_replay(records)
+
+        docs = sum(len(docs) for _, _, _, documents in backends.values() for docs in documents.values())
+        print(f"{path}: {docs:,} documentos en {len(backends)} destino(s), "
+              f"{'reconciliación' if cycle['reconcile'] else cycle['sync_mode']}")
+
+        profiles = []
+        profile_sheets(main, profiles)
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+        started = time.perf_counter()
+        with output:
+            new_rows = main.sync_data(reconcile=cycle['reconcile'])
+        elapsed = time.perf_counter() - started
+
+        print(f"{elapsed:.2f}s, {new_rows:,} filas nuevas")
+        for name, (firestore, _, _, _) in backends.items():
+            calls = firestore.stats.calls
+            print(f"  {name}: {sum(n for call, n in calls.items() if call.endswith('.stream'))} consultas a Firestore, "
+                  f"{firestore.stats.total_calls('sheets.')} llamadas a Sheets")
+        print()
+        if profiles:
+            stats = pstats.Stats(*profiles)
+            stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace')
+    parser.add_argument('--top', type=int, default=25, help='funciones en el informe')
+    parser.add_argument('--sort', default='tottime', choices=['tottime', 'cumulative', 'ncalls'])
+    parser.add_argument('--verbose', action='store_true', help='mostrar la salida de sync_data')
+    args = parser.parse_args()
+    replay(os.path.abspath(args.trace), args.top, args.sort, args.verbose)
@@ -1,84 +1,240 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-import gspread
-from google.oauth2.service_account import Credentials
+# firebase_admin, gspread, google-auth y requests se importan al usarlos por
+# primera vez: cargarlos cuesta ~0,5 s y retrasaría la apertura del puerto
 import schedule
 import time
+PROCESS_STARTED = time.time()
 from datetime import datetime
 import os
 import json
-from flask import Flask
-import requests
+import sqlite3
+import csv
+import mmap
+import gzip
+from flask import Flask, Response, request
 import threading
+import bisect
+import functools
+import contextlib
+import hashlib
+import random
+from concurrent.futures import Future, as_completed
+from itertools import chain, islice
 
 # ✅ URL CORRECTA de tu app en Render
-RENDER_URL = "https://firebase-to-sheets.onrender.com"
+RENDER_URL = os.environ.get('RENDER_URL', "https://firebase-to-sheets.onrender.com")
+
+# Hoja de cálculo destino
+SPREADSHEET_NAME = "CCB Registros Proceso"
 
 # Configurar archivos desde variables de entorno
 def setup_environment():
     print("🔧 Configurando entorno...")
     
-    if 'FIREBASE_KEY' in os.environ:
-        try:
-            firebase_config = json.loads(os.environ['FIREBASE_KEY'])
-            with open('firebase-key.json', 'w') as f:
-                json.dump(firebase_config, f)
-            print("✅ Archivo Firebase creado")
-        except Exception as e:
-            print(f"❌ Error con Firebase key: {str(e)}")
+    write_key_file('FIREBASE_KEY', 'firebase-key.json', 'Firebase')
+    write_key_file('GOOGLE_SHEETS_KEY', 'google-sheets-key.json', 'Google Sheets')
     
-    if 'GOOGLE_SHEETS_KEY' in os.environ:
-        try:
-            sheets_config = json.loads(os.environ['GOOGLE_SHEETS_KEY'])
-            with open('google-sheets-key.json', 'w') as f:
-                json.dump(sheets_config, f)
-            print("✅ Archivo Google Sheets creado")
-        except Exception as e:
-            print(f"❌ Error con Google Sheets key: {str(e)}")
+    # Destinos con credenciales propias: {"firebase_key_env": "...", "sheets_key_env": "..."}
+    for target in SYNC_TARGETS.values():
+        if target.get('firebase_key_env'):
+            write_key_file(target['firebase_key_env'], target['firebase_key'], f"Firebase ({target['name']})")
+        if target.get('sheets_key_env'):
+            write_key_file(target['sheets_key_env'], target['sheets_key'], f"Google Sheets ({target['name']})")
 
-# Configurar Firebase
-def setup_firebase():
+def write_key_file(env_name, path, label):
+    if env_name not in os.environ:
+        return
     try:
-        if os.path.exists('firebase-key.json'):
-            cred = credentials.Certificate('firebase-key.json')
-            if not firebase_admin._apps:
-                firebase_admin.initialize_app(cred)
-            print("✅ Firebase configurado")
-            return firestore.client()
+        config = json.loads(os.environ[env_name])
+        with open(path, 'w') as f:
+            json.dump(config, f)
+        print(f"✅ Archivo {label} creado")
+    except Exception as e:
+        print(f"❌ Error con {label} key: {str(e)}")
+
+# Configurar Firebase (una app de firebase_admin por archivo de credenciales)
+def setup_firebase(key_file='firebase-key.json'):
+    try:
+        if os.path.exists(key_file):
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+            cred = credentials.Certificate(key_file)
+            app_name = '[DEFAULT]' if key_file == 'firebase-key.json' else key_file
+            if app_name not in firebase_admin._apps:
+                firebase_admin.initialize_app(cred, name=app_name)
+            print(f"✅ Firebase configurado ({key_file})")
+            return firestore.client(firebase_admin.get_app(app_name))
         else:
-            print("❌ No se encontró firebase-key.json")
+            print(f"❌ No se encontró {key_file}")
             return None
     except Exception as e:
         print(f"❌ Error Firebase: {str(e)}")
         return None
 
 # Configurar Google Sheets
-def setup_sheets():
+def setup_sheets(key_file='google-sheets-key.json'):
     try:
-        if os.path.exists('google-sheets-key.json'):
+        if os.path.exists(key_file):
+            import gspread
+            from google.oauth2.service_account import Credentials
+            
             SCOPES = [
                 'https://www.googleapis.com/auth/spreadsheets',
                 'https://www.googleapis.com/auth/drive'
             ]
             
             creds = Credentials.from_service_account_file(
-                'google-sheets-key.json', 
+                key_file, 
                 scopes=SCOPES
             )
             
             client = gspread.authorize(creds)
-            print("✅ Google Sheets configurado")
+            print(f"✅ Google Sheets configurado ({key_file})")
             return client
         else:
-            print("❌ No se encontró google-sheets-key.json")
+            print(f"❌ No se encontró {key_file}")
             return None
     except Exception as e:
         print(f"❌ Error Google Sheets: {str(e)}")
         return None
 
+# Destino en curso del hilo (ver SYNC_TARGETS): las funciones de clientes,
+# cuota, progreso y métricas lo usan sin tener que recibirlo como parámetro
+sync_context = threading.local()
+
+def current_target():
+    target = getattr(sync_context, 'target', None)
+    return target or next(iter(SYNC_TARGETS.values()))
+
+@contextlib.contextmanager
+def using_target(target):
+    previous = getattr(sync_context, 'target', None)
+    sync_context.target = target
+    try:
+        yield target
+    finally:
+        sync_context.target = previous
+
+# Clave con el nombre del destino delante; el destino por defecto conserva las
+# claves de siempre (checkpoint, índice de tanques) para no perder el estado
+def target_scoped(value, target=None):
+    name = (target or current_target())['name']
+    return value if name == DEFAULT_TARGET else f'{name}/{value}'
+
+# Registro de clientes de larga duración, compartido por todos los destinos: se
+# crean una vez por archivo de credenciales y solo se recrean si el archivo
+# cambia. Los tokens OAuth los renueva google-auth automáticamente cuando
+# expiran, sin volver a leer el archivo.
+clients_lock = threading.RLock()
+clients = {}  # (tipo, archivo de credenciales) -> (mtime del archivo, cliente)
+worksheets = {}  # ID de la hoja de cálculo -> {título: worksheet}
+worksheets_loaded_at = {}  # ID de la hoja de cálculo -> epoch de la última carga
+WORKSHEET_CACHE_SECONDS = int(os.environ.get('WORKSHEET_CACHE_SECONDS', 3600))
+
+# Marca de clientes instalados a mano (p. ej. backends falsos de benchmarks)
+PINNED = 'pinned'
+
+def key_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def get_firestore_client(target=None):
+    key_file = (target or current_target())['firebase_key']
+    with clients_lock:
+        mtime = key_mtime(key_file)
+        cached = clients.get(('firestore', key_file))
+        if cached and cached[0] in (mtime, PINNED):
+            return cached[1]
+        if cached:
+            # Credenciales nuevas: reiniciar la app de Firebase
+            import firebase_admin
+            app_name = '[DEFAULT]' if key_file == 'firebase-key.json' else key_file
+            if app_name in firebase_admin._apps:
+                firebase_admin.delete_app(firebase_admin.get_app(app_name))
+        db = setup_firebase(key_file)
+        if db:
+            clients[('firestore', key_file)] = (mtime, db)
+        return db
+
+def get_sheets_client(target=None):
+    key_file = (target or current_target())['sheets_key']
+    with clients_lock:
+        mtime = key_mtime(key_file)
+        cached = clients.get(('sheets', key_file))
+        if cached and cached[0] in (mtime, PINNED):
+            return cached[1]
+        invalidate_sheets_cache()
+        client = setup_sheets(key_file)
+        if client:
+            clients[('sheets', key_file)] = (mtime, client)
+        return client
+
+# Instalar clientes propios en el registro (no se recrean al cambiar las credenciales)
+def install_clients(firestore_client=None, sheets_client=None, target=None):
+    target = target or current_target()
+    with clients_lock:
+        if firestore_client is not None:
+            clients[('firestore', target['firebase_key'])] = (PINNED, firestore_client)
+        if sheets_client is not None:
+            invalidate_sheets_cache()
+            clients[('sheets', target['sheets_key'])] = (PINNED, sheets_client)
+
+def get_spreadsheet(target=None):
+    target = target or current_target()
+    with clients_lock:
+        client = get_sheets_client(target)
+        if not client:
+            return None
+        key = ('spreadsheet', target['sheets_key'], target['spreadsheet'])
+        if key not in clients:
+            with using_target(target):
+                clients[key] = sheets_call('spreadsheet', 'read', client.open, target['spreadsheet'])
+        return clients[key]
+
+# Abrir la hoja de cálculo de un destino sin propagar errores (no encontrada,
+# sin permisos, error de la API): un destino roto no detiene a los demás
+def open_target_spreadsheet(target):
+    try:
+        spreadsheet = get_spreadsheet(target)
+    except Exception as e:
+        print(f"❌ No se pudo abrir {target['spreadsheet']} ({target['name']}): {str(e)}")
+        spreadsheet = None
+    if not spreadsheet:
+        with using_target(target):
+            metrics.inc('sync_errors_total', collection='spreadsheet')
+    return spreadsheet
+
+# Obtener una hoja por título; una sola llamada de metadatos trae todas las hojas
+def get_worksheet(spreadsheet, title):
+    with clients_lock:
+        cache = worksheets.setdefault(spreadsheet.id, {})
+        age = time.time() - worksheets_loaded_at.get(spreadsheet.id, 0)
+        # Recargar al caducar la caché, o si falta el título (como mucho una vez por minuto)
+        if age > WORKSHEET_CACHE_SECONDS or (title not in cache and age > 60):
+            cache.clear()
+            for ws in sheets_call('spreadsheet', 'read', spreadsheet.worksheets):
+                cache[ws.title] = ws
+            worksheets_loaded_at[spreadsheet.id] = time.time()
+        return cache.get(title)
+
+# Descartar una hoja de la caché (renombrada, borrada o con errores)
+def invalidate_worksheet(spreadsheet, title):
+    with clients_lock:
+        worksheets.get(spreadsheet.id, {}).pop(title, None)
+        worksheets_loaded_at.pop(spreadsheet.id, None)
+
+def invalidate_sheets_cache():
+    with clients_lock:
+        for key in [key for key in clients if key[0] == 'spreadsheet']:
+            del clients[key]
+        worksheets.clear()
+        worksheets_loaded_at.clear()
+
 # Función keep-alive mejorada para mantener Render despierto
 def keep_alive():
     try:
+        import requests
         # ✅ URL CORRECTA con endpoint específico
         response = requests.get(f"{RENDER_URL}/keep-alive", timeout=10)
         print(f"✅ Keep-alive exitoso: {response.status_code} - {datetime.now().strftime('%H:%M:%S')}")
@@ -129,350 +285,2224 @@ def calcular_extracto_real(extracto_original, alcohol_peso):
     except:
         return ""
 
-# Diccionario global para almacenar alcohol por volumen por tanque y fecha
-tanques_alcohol = {}
+# Cálculo vectorizado de las métricas de fermentación (recálculos y cargas históricas).
+# Aplica las mismas condiciones que derivar_fermentacion documento a documento:
+# cada resultado queda enmascarado donde la versión escalar devuelve "".
+def columna_numerica(valores):
+    """Devuelve (números, máscara de valores presentes y numéricos)"""
+    import numpy as np
+    
+    if isinstance(valores, np.ndarray) and valores.dtype.kind in 'fiu':
+        numeros = np.ma.getdata(valores).astype(float)
+        return numeros, ~np.ma.getmaskarray(valores) & (numeros != 0)
+    
+    valores = list(valores)
+    # Mismo criterio que "if extracto_aparente" en la versión escalar
+    presentes = np.fromiter(map(bool, valores), dtype=bool, count=len(valores))
+    try:
+        # Conversión en bloque; None y vacíos pasan a NaN (quedan fuera por "presentes")
+        return np.array([valor if valor else np.nan for valor in valores], dtype=float), presentes
+    except (TypeError, ValueError):
+        pass  # Hay texto no numérico: conversión valor a valor
+    
+    numeros = np.zeros(len(valores))
+    for i, valor in enumerate(valores):
+        try:
+            numeros[i] = float(valor)
+        except (TypeError, ValueError):
+            presentes[i] = False
+    return numeros, presentes
+
+def calcular_metricas_fermentacion_lote(extractos_originales, extractos_aparentes):
+    """Calcula peso_esp, gaf, alcohol_peso, alcohol_volumen y extracto_real en una pasada"""
+    import numpy as np
+    
+    eo, eo_presente = columna_numerica(extractos_originales)
+    ea, ea_presente = columna_numerica(extractos_aparentes)
+    ambos = eo_presente & ea_presente
+    
+    with np.errstate(all='ignore'):
+        peso_esp = 0.99995121 + 0.00392802 * ea
+        gaf = ((eo - ea) / eo) * 100
+        denominador = 100 * 2.5233 - eo * 1.1266
+        alcohol_peso = (100 * (eo - ea)) / denominador
+        alcohol_volumen = alcohol_peso * peso_esp / 0.791
+        extracto_real = ((eo * (1.0665 * alcohol_peso + 100)) / 100) - 2.0665 * alcohol_peso
+    
+    # Máscaras: entradas vacías o no numéricas, divisiones por cero y
+    # resultados intermedios vacíos o 0 (que la versión escalar trata como falsos)
+    peso_esp_ok = ea_presente
+    gaf_ok = ambos & (eo != 0)
+    alcohol_peso_ok = ambos & (denominador != 0)
+    alcohol_peso_verdadero = alcohol_peso_ok & (alcohol_peso != 0)
+    alcohol_volumen_ok = alcohol_peso_verdadero & peso_esp_ok & (peso_esp != 0)
+    extracto_real_ok = eo_presente & alcohol_peso_verdadero
+    
+    return {
+        'peso_esp': np.ma.array(peso_esp, mask=~peso_esp_ok),
+        'gaf': np.ma.array(gaf, mask=~gaf_ok),
+        'alcohol_peso': np.ma.array(alcohol_peso, mask=~alcohol_peso_ok),
+        'alcohol_volumen': np.ma.array(alcohol_volumen, mask=~alcohol_volumen_ok),
+        'extracto_real': np.ma.array(extracto_real, mask=~extracto_real_ok)
+    }
 
-# Sincronizar una colección específica
-def sync_collection(collection_name, worksheet, existing_ids):
-    db = setup_firebase()
-    if not db:
-        return 0
+# Convertir una columna enmascarada a valores de celda ("" donde está enmascarada)
+def celdas_metricas(columna):
+    import numpy as np
+    
+    mascara = np.ma.getmaskarray(columna)
+    return ["" if vacio else float(valor) for valor, vacio in zip(np.ma.getdata(columna).tolist(), mascara.tolist())]
+
+# Lectura incremental: cursor por colección guardado en un archivo local
+SYNC_MODE = os.environ.get('SYNC_MODE', 'incremental')  # 'incremental' o 'full'
+CURSOR_FIELD = os.environ.get('SYNC_CURSOR_FIELD', 'date')  # Campo ordenable (fecha o timestamp del servidor)
+CHECKPOINT_FILE = os.environ.get('SYNC_CHECKPOINT_FILE', 'sync-checkpoint.json')
+RECONCILE_MINUTES = int(os.environ.get('SYNC_RECONCILE_MINUTES', 60))
+STREAM_PAGE_SIZE = int(os.environ.get('SYNC_STREAM_PAGE_SIZE', 1000))  # Documentos por página en la carga completa
+DOCUMENT_ID_FIELD = '__name__'  # Equivale a firestore.FieldPath.document_id()
+
+# Estado persistido: {'cursors': {colección: valor},
+#                     'backfill': {colección: {'after': último ID escrito, 'cursor': valor}}}
+checkpoint = {'cursors': {}, 'backfill': {}}
+checkpoint_lock = threading.Lock()  # Las colecciones guardan su progreso desde varios hilos
+
+def encode_cursor(value):
+    if isinstance(value, datetime):
+        return {'datetime': value.isoformat()}
+    return value
+
+def decode_cursor(value):
+    if isinstance(value, dict) and 'datetime' in value:
+        return datetime.fromisoformat(value['datetime'])
+    return value
+
+def load_checkpoint():
+    global checkpoint
+    try:
+        if os.path.exists(CHECKPOINT_FILE):
+            with open(CHECKPOINT_FILE) as f:
+                data = json.load(f)
+            checkpoint = {'cursors': data.get('cursors', {}), 'backfill': data.get('backfill', {})}
+            print(f"✅ Checkpoint cargado: {list(checkpoint['cursors'].keys())}")
+            if checkpoint['backfill']:
+                print(f"↩️ Cargas completas a medio terminar: {list(checkpoint['backfill'].keys())}")
+    except Exception as e:
+        print(f"⚠️ No se pudo leer el checkpoint: {str(e)}")
+    return checkpoint
+
+def save_checkpoint():
+    try:
+        with checkpoint_lock:
+            tmp_file = CHECKPOINT_FILE + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(checkpoint, f, default=str)
+            os.replace(tmp_file, CHECKPOINT_FILE)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el checkpoint: {str(e)}")
+
+# Registrar el progreso de una colección: cursor incremental y/o posición de la
+# carga completa (None la da por terminada). Con persist=True se guarda ya.
+def commit_progress(collection_name, cursor=None, backfill=False, persist=False):
+    with checkpoint_lock:
+        if cursor is not None:
+            checkpoint['cursors'][collection_name] = encode_cursor(cursor)
+        if backfill is None:
+            checkpoint['backfill'].pop(collection_name, None)
+        elif backfill:
+            checkpoint['backfill'][collection_name] = backfill
+    if persist:
+        save_checkpoint()
+
+# Tipo de un valor de cursor que Firestore ordena igual que el tiempo:
+# 'timestamp' (Timestamp de Firestore) o 'iso' (texto aaaa-mm-dd...). Con
+# dd/mm/aaaa el orden de texto no es cronológico (01/11 < 31/10) y los
+# documentos sin el campo no aparecen en order_by: entonces devuelve None y la
+# colección se lee completa en cada ciclo. Para una lectura incremental fiable
+# conviene un campo escrito por el servidor (SYNC_CURSOR_FIELD).
+def cursor_kind(value):
+    if isinstance(value, datetime):
+        return 'timestamp'
+    if isinstance(value, str):
+        return cursor_kind_texto(value)
+    return None
+
+@functools.lru_cache(maxsize=4096)
+def cursor_kind_texto(value):
+    if len(value) < 10 or value[4] != '-':
+        return None
+    try:
+        datetime.fromisoformat(value)
+        return 'iso'
+    except ValueError:
+        return None
+
+# Un cursor sirve si todos los valores vistos son del mismo tipo ordenable
+def cursor_consistent(kinds):
+    return None not in kinds and len(kinds) <= 1
+
+cursor_warnings = set()  # Colecciones ya avisadas (una vez por proceso)
+
+def warn_cursor(collection_name):
+    if collection_name not in cursor_warnings:
+        cursor_warnings.add(collection_name)
+        print(f"⚠️ {collection_name}: hay valores de {CURSOR_FIELD} que faltan o no son Timestamp ni fecha ISO; "
+              f"se lee la colección completa en cada ciclo")
+
+def drop_cursor(collection_name):
+    with checkpoint_lock:
+        checkpoint['cursors'].pop(collection_name, None)
+
+# Devuelve el mayor de dos valores de cursor (ignora tipos no comparables)
+def max_cursor(current, value):
+    if value is None or value == '':
+        return current
+    if current is None:
+        return value
+    try:
+        return value if value > current else current
+    except TypeError:
+        return current
+
+# Índice local persistente (SQLite): ID de Firestore -> fila de la hoja, y
+# siguiente fila libre por hoja. Evita descargar las hojas completas cada ciclo.
+STATE_DB_FILE = os.environ.get('SYNC_STATE_DB', 'sync-state.db')
+INDEX_VERIFY_SECONDS = int(os.environ.get('INDEX_VERIFY_SECONDS', 3600))
+state_lock = threading.RLock()
+state_db = None
+verified_sheets = set()  # Hojas verificadas desde que arrancó el proceso
+
+def get_state_db():
+    global state_db
+    with state_lock:
+        if state_db is None:
+            state_db = sqlite3.connect(STATE_DB_FILE, check_same_thread=False)
+            state_db.executescript('''
+                CREATE TABLE IF NOT EXISTS sheet_rows (
+                    sheet TEXT, doc_id TEXT, row INTEGER, hash TEXT, cells TEXT,
+                    PRIMARY KEY (sheet, doc_id)
+                );
+                CREATE TABLE IF NOT EXISTS sheet_meta (
+                    sheet TEXT PRIMARY KEY, next_row INTEGER, verified_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS tank_alcohol (
+                    doc_id TEXT PRIMARY KEY, tank TEXT, fecha_orden TEXT,
+                    fecha TEXT, alcohol REAL, cocimiento TEXT
+                );
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, sheet TEXT, doc_id TEXT,
+                    row TEXT, attempts INTEGER DEFAULT 0, last_error TEXT, hash TEXT,
+                    UNIQUE (sheet, doc_id)
+                );
+                CREATE TABLE IF NOT EXISTS segment_rows (
+                    path TEXT, doc_id TEXT, hash TEXT,
+                    PRIMARY KEY (path, doc_id)
+                );
+            ''')
+            # Columnas añadidas después de crear las tablas en versiones anteriores
+            for table, column in [('sheet_rows', 'hash TEXT'), ('sheet_rows', 'cells TEXT'), ('outbox', 'hash TEXT')]:
+                try:
+                    state_db.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+                except sqlite3.OperationalError:
+                    pass  # Ya existe
+        return state_db
+
+# Clave estable de una hoja (no cambia si se renombra)
+def sheet_key(worksheet):
+    return f'{worksheet.spreadsheet.id}:{worksheet.id}'
+
+# Reconstruir el índice leyendo solo la columna A (lectura por rango). Los IDs
+# que siguen en la hoja conservan su hash y celdas (aunque cambien de fila).
+def rebuild_sheet_index(worksheet, start_row, collection_name=None):
+    key = sheet_key(worksheet)
+    values = sheets_call(collection_name or worksheet.title.lower(), 'read', worksheet.get, f'A{start_row}:A')
+    
+    rows = [(row[0], start_row + i) for i, row in enumerate(values) if row and row[0]]
+    next_row = start_row + len(values)
     
+    with state_lock:
+        db = get_state_db()
+        with db:
+            db.execute('CREATE TEMP TABLE IF NOT EXISTS sheet_scan (doc_id TEXT PRIMARY KEY, row INTEGER)')
+            db.execute('DELETE FROM sheet_scan')
+            db.executemany('INSERT OR REPLACE INTO sheet_scan VALUES (?, ?)', rows)
+            db.execute('DELETE FROM sheet_rows WHERE sheet = ? AND doc_id NOT IN (SELECT doc_id FROM sheet_scan)', (key,))
+            db.execute('INSERT INTO sheet_rows (sheet, doc_id, row) SELECT ?, doc_id, row FROM sheet_scan WHERE true '
+                       'ON CONFLICT (sheet, doc_id) DO UPDATE SET row = excluded.row', (key,))
+            db.execute('DELETE FROM sheet_scan')
+            db.execute('INSERT OR REPLACE INTO sheet_meta VALUES (?, ?, ?)', (key, next_row, time.time()))
+        verified_sheets.add(key)
+    print(f"🗂️ Índice de {worksheet.title} reconstruido: {len(rows)} IDs, siguiente fila {next_row}")
+    return next_row
+
+# Devuelve la siguiente fila libre; el índice se verifica contra la hoja al
+# arrancar el proceso, cada INDEX_VERIFY_SECONDS o si se fuerza
+def load_sheet_index(worksheet, start_row, force=False, collection_name=None):
+    key = sheet_key(worksheet)
+    with state_lock:
+        db = get_state_db()
+        meta = db.execute('SELECT next_row, verified_at FROM sheet_meta WHERE sheet = ?', (key,)).fetchone()
+        if force or meta is None or key not in verified_sheets or time.time() - meta[1] > INDEX_VERIFY_SECONDS:
+            next_row = rebuild_sheet_index(worksheet, start_row, collection_name)
+        else:
+            next_row = meta[0]
+    return max(next_row, start_row)
+
+# Huella del contenido de una fila (su JSON); detecta documentos editados sin leer la hoja
+def row_cells(row):
+    return json.dumps(row, default=str)
+
+def row_hash(cells):
+    return hashlib.blake2b(cells.encode('utf-8'), digest_size=8).hexdigest()
+
+# Para los IDs de `doc_ids` que ya están en la hoja o en la cola de salida,
+# {doc_id: (fila, hash)}; la fila es None si aún está en la cola. Se consulta
+# por lotes (no se cargan en memoria todos los IDs de la hoja).
+def indexed_ids(worksheet, doc_ids, batch_size=500):
+    key = sheet_key(worksheet)
+    found = {}
+    with state_lock:
+        db = get_state_db()
+        for offset in range(0, len(doc_ids), batch_size):
+            batch = doc_ids[offset:offset + batch_size]
+            placeholders = ', '.join('?' * len(batch))
+            for doc_id, digest in db.execute(
+                    f'SELECT doc_id, hash FROM outbox WHERE sheet = ? AND doc_id IN ({placeholders})', (key, *batch)):
+                found[doc_id] = (None, digest)
+            for doc_id, row, digest in db.execute(
+                    f'SELECT doc_id, row, hash FROM sheet_rows WHERE sheet = ? AND doc_id IN ({placeholders})', (key, *batch)):
+                found[doc_id] = (row, digest)
+    return found
+
+# Registrar filas recién escritas en el índice, con su hash y celdas (y sacarlas
+# de la cola de salida en la misma transacción)
+def record_sheet_rows(worksheet, first_row, rows, outbox_ids=()):
+    key = sheet_key(worksheet)
+    entries = []
+    for i, row in enumerate(rows):
+        cells = row_cells(row)
+        entries.append((key, row[0], first_row + i, row_hash(cells), cells))
+    with state_lock:
+        db = get_state_db()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO sheet_rows (sheet, doc_id, row, hash, cells) VALUES (?, ?, ?, ?, ?)',
+                           entries)
+            db.execute('UPDATE sheet_meta SET next_row = ? WHERE sheet = ?', (first_row + len(rows), key))
+            db.executemany('DELETE FROM outbox WHERE id = ?', [(outbox_id,) for outbox_id in outbox_ids])
+
+# Forzar la verificación del índice en el próximo ciclo (p. ej. tras un error de escritura)
+def mark_index_stale(worksheet):
+    with state_lock:
+        verified_sheets.discard(sheet_key(worksheet))
+
+# Índice persistente de lecturas de alcohol por tanque, ordenado por fecha.
+# Se mantiene incrementalmente desde fermentación y responde "alcohol del
+# tanque N a la fecha D" con búsqueda binaria, sin volver a leer fermentación.
+tank_index = None  # tanque -> {'keys': [(fecha_orden, doc_id)], 'entries': [...]}
+tank_by_doc = {}  # doc_id -> (tanque, clave) para mover/actualizar lecturas
+
+FORMATOS_FECHA = ['%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d']
+
+# Clave de orden de una fecha (ISO); Timestamp de Firestore, ISO o dd/mm/aaaa
+def fecha_orden(fecha):
+    if isinstance(fecha, datetime):
+        return fecha.replace(tzinfo=None).isoformat()
+    return fecha_orden_texto(str(fecha or '').strip())
+
+@functools.lru_cache(maxsize=4096)
+def fecha_orden_texto(fecha):
     try:
-        collection_ref = db.collection(collection_name)
-        docs = collection_ref.stream()
+        return datetime.fromisoformat(fecha).replace(tzinfo=None).isoformat()
+    except ValueError:
+        pass
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(fecha, formato).isoformat()
+        except ValueError:
+            continue
+    return fecha
+
+def get_tank_index():
+    global tank_index
+    with state_lock:
+        if tank_index is None:
+            tank_index = {}
+            rows = get_state_db().execute(
+                'SELECT doc_id, tank, fecha_orden, fecha, alcohol, cocimiento FROM tank_alcohol ORDER BY tank, fecha_orden, doc_id')
+            for doc_id, tank, orden, fecha, alcohol, cocimiento in rows:
+                lecturas = tank_index.setdefault(tank, {'keys': [], 'entries': []})
+                lecturas['keys'].append((orden, doc_id))
+                lecturas['entries'].append({'alcohol': alcohol, 'fecha': fecha, 'cocimiento': cocimiento})
+                tank_by_doc[doc_id] = (tank, (orden, doc_id))
+        return tank_index
+
+# Insertar o actualizar una lectura (idempotente por ID de documento)
+def record_tank_alcohol(doc_id, tank, fecha, alcohol, cocimiento=''):
+    tank = str(tank)
+    key = (fecha_orden(fecha), doc_id)
+    entry = {'alcohol': alcohol, 'fecha': str(fecha), 'cocimiento': cocimiento}
+    with state_lock:
+        index = get_tank_index()
+        previous = tank_by_doc.get(doc_id)
+        if previous == (tank, key) and index[tank]['entries'][bisect.bisect_left(index[tank]['keys'], key)] == entry:
+            return False  # Sin cambios
+        if previous:
+            old = index[previous[0]]
+            position = bisect.bisect_left(old['keys'], previous[1])
+            del old['keys'][position]
+            del old['entries'][position]
+        lecturas = index.setdefault(tank, {'keys': [], 'entries': []})
+        position = bisect.bisect_left(lecturas['keys'], key)
+        lecturas['keys'].insert(position, key)
+        lecturas['entries'].insert(position, entry)
+        tank_by_doc[doc_id] = (tank, key)
         
-        new_rows = []
+        db = get_state_db()
+        with db:
+            db.execute('INSERT OR REPLACE INTO tank_alcohol VALUES (?, ?, ?, ?, ?, ?)',
+                       (doc_id, tank, key[0], entry['fecha'], alcohol, cocimiento))
+    return True
+
+# Quitar la lectura de un documento (borrado o que ya no tiene tanque o alcohol)
+def forget_tank_alcohol(doc_id):
+    with state_lock:
+        index = get_tank_index()
+        previous = tank_by_doc.pop(doc_id, None)
+        if previous is None:
+            return False
+        lecturas = index[previous[0]]
+        position = bisect.bisect_left(lecturas['keys'], previous[1])
+        del lecturas['keys'][position]
+        del lecturas['entries'][position]
+        if not lecturas['keys']:
+            del index[previous[0]]
+        db = get_state_db()
+        with db:
+            db.execute('DELETE FROM tank_alcohol WHERE doc_id = ?', (doc_id,))
+    return True
+
+# Última lectura del tanque con fecha <= `fecha` (o la más reciente si no hay fecha)
+def alcohol_tanque(tank, fecha=None):
+    with state_lock:
+        lecturas = (tank_index if tank_index is not None else get_tank_index()).get(str(tank))
+        if not lecturas:
+            return None
+        if not fecha:
+            return lecturas['entries'][-1]
+        position = bisect.bisect_right(lecturas['keys'], (fecha_orden(fecha), '\uffff'))
+        return lecturas['entries'][position - 1] if position else None
+
+# Máximo de filas por llamada a la API de Sheets (cuota de escritura por minuto)
+SHEETS_WRITE_CHUNK = int(os.environ.get('SHEETS_WRITE_CHUNK', 500))
+
+# Métricas en memoria para /metrics (Prometheus) y /stats (JSON). Registrar
+# cuesta unas operaciones de diccionario; el texto solo se genera al consultar.
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+METRIC_HELP = {
+    'sync_stage_seconds': ('histogram', 'Duración de cada etapa de la sincronización por colección'),
+    'sync_cycle_seconds': ('histogram', 'Duración de un ciclo completo de sync_data'),
+    'docs_scanned_total': ('counter', 'Documentos leídos de Firestore'),
+    'docs_written_total': ('counter', 'Filas nuevas escritas en Sheets'),
+    'firestore_calls_total': ('counter', 'Consultas a Firestore'),
+    'sheets_calls_total': ('counter', 'Llamadas a la API de Sheets'),
+    'sheets_errors_total': ('counter', 'Errores de la API de Sheets por código HTTP'),
+    'sheets_retries_total': ('counter', 'Reintentos tras errores 429 de Sheets'),
+    'sync_errors_total': ('counter', 'Colecciones que fallaron en un ciclo'),
+    'last_success_timestamp_seconds': ('gauge', 'Última sincronización correcta (epoch)'),
+    'docs_changed_total': ('counter', 'Documentos ya escritos cuyo contenido cambió en Firestore'),
+    'cells_updated_total': ('counter', 'Celdas reescritas en Sheets por documentos editados'),
+    'outbox_pending': ('gauge', 'Filas en la cola de salida pendientes de escribir en Sheets'),
+    'outbox_write_failures_total': ('counter', 'Intentos fallidos de escribir un bloque de la cola de salida'),
+    'outbox_parked': ('gauge', 'Filas apartadas de la cola de salida tras agotar sus intentos'),
+    'outbox_parked_total': ('counter', 'Filas apartadas de la cola de salida tras agotar sus intentos'),
+    'startup_seconds': ('gauge', 'Segundos desde el arranque del proceso hasta cada fase (port, first_sync)'),
+    'segment_rows_total': ('counter', 'Filas nuevas o editadas añadidas a los segmentos locales'),
+}
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # (nombre, etiquetas) -> número
+        self.histograms = {}  # (nombre, etiquetas) -> [conteos por bucket, suma, total]
+    
+    # Con varios destinos, lo registrado mientras se sincroniza uno lleva su etiqueta
+    @staticmethod
+    def key(name, labels):
+        target = getattr(sync_context, 'target', None)
+        if target and len(SYNC_TARGETS) > 1:
+            labels.setdefault('target', target['name'])
+        return (name, tuple(sorted(labels.items())))
+    
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+    
+    def set(self, name, value, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.values[key] = value
+    
+    def observe(self, name, seconds, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(STAGE_BUCKETS), 0.0, 0]
+            position = bisect.bisect_left(STAGE_BUCKETS, seconds)
+            if position < len(STAGE_BUCKETS):
+                histogram[0][position] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+    
+    def prometheus(self):
+        # Formato de texto de Prometheus: barras invertidas, comillas y saltos de línea escapados
+        def escape_label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
         
-        for doc in docs:
-            data = doc.to_dict()
-            fecha = data.get('date', '')
-            
-            # ✅ VERIFICAR POR ID DE FIREBASE (NO POR FECHA)
-            if doc.id in existing_ids:
-                continue
-            
-            if collection_name == 'cocimiento':
-                # COCIMIENTO - desde fila 6
-                row = [''] * 13
-                row[0] = doc.id  # Columna A: ID oculto
-                row[1] = fecha  # Columna B: Fecha
-                row[2] = data.get('Tipo (Ej: Judas) holi', '')
-                row[3] = data.get('N° Cocimiento (Ej: 102)', '')  # Columna D
-                row[4] = data.get('A Tq N° (Ej: 4)', '')  # Columna E
-                row[5] = data.get('pH (Mosto Macerado) (Ej: 5.4)', '')  # Columna F
-                row[6] = ''  # Columna G (vacía)
-                row[7] = data.get('Extracto original [%] p/p (Primer Mosto) (Ej: 18.5)', '')  # Columna H
-                row[8] = ''  # Columna I (vacía)
-                row[9] = data.get('Extracto original [%] p/p (Mosto Frío) (Ej: 16.5)', '')  # Columna J
-                row[10] = data.get('pH(Mosto Frío) (Ej: 5.43)', '')  # Columna K
-                row[11] = data.get('Color [EBC] (Mosto Frío) (Ej: 8.5)', '')  # Columna L
-                row[12] = data.get('Observaciones (Ej: Sin muestra frío)', '')  # Columna M
-                
-                new_rows.append(row)
-                
-            elif collection_name == 'fermentacion':
-                # FERMENTACIÓN - desde fila 6 (columnas B, C, E, F, G, H, I, J)
-                extracto_aparente = data.get('Extrácto aparente [%] p/p (Ej: 2.70)', '')
-                extracto_original = data.get('Extrácto original [%] p/p (Ej: 16.0)', '')
-                
-                # Realizar cálculos
-                peso_esp = calcular_peso_esp(extracto_aparente) if extracto_aparente else ""
-                gaf = calcular_gaf(extracto_original, extracto_aparente) if extracto_original and extracto_aparente else ""
-                alcohol_peso = calcular_alcohol_peso(extracto_original, extracto_aparente) if extracto_original and extracto_aparente else ""
-                alcohol_volumen = calcular_alcohol_volumen(alcohol_peso, peso_esp) if alcohol_peso and peso_esp else ""
-                extracto_real = calcular_extracto_real(extracto_original, alcohol_peso) if extracto_original and alcohol_peso else ""
-                
-                # Guardar en diccionario para uso en tanque de presión
-                numero_tanque = data.get('Tq N°(Ej: 7)', '')
-                if numero_tanque and alcohol_volumen:
-                    # Guardar solo el valor más reciente por tanque
-                    tanques_alcohol[numero_tanque] = {
-                        'alcohol': alcohol_volumen,
-                        'fecha': fecha,
-                        'cocimiento': data.get('N° Cocimiento (Ej: 341-342-343)', '')
-                    }
-                    print(f"✅ Tanque {numero_tanque} actualizado: {alcohol_volumen}%")
-                
-                row = [''] * 15  # A-O (15 columnas para incluir cálculos)
-                row[0] = doc.id  # Columna A: ID oculto
-                row[1] = fecha  # Columna B: Fecha
-                row[2] = data.get('Tipo (Ej: Autentica)', '')  # Columna C: Tipo
-                row[3] = data.get('N° Cocimiento (Ej: 341-342-343)', '')  # Columna D
-                row[4] = data.get('Tq N°(Ej: 7)', '')  # Columna E: Tq N°
-                row[5] = data.get('pH (Ej: 4.36)', '')  # Columna F: pH
-                row[6] = data.get('Color [EBC] (Ej: 9.5)', '')  # Columna G: Color
-                row[7] = data.get('Turbidez [EBC] (Ej: 18.92)', '')  # Columna H: Turbidez
-                row[8] = extracto_aparente  # Columna I: Ext. Aparente
-                row[9] = extracto_original  # Columna J: Ext. Original
-                row[10] = extracto_real  # Columna K: Extracto Real
-                row[11] = alcohol_peso  # Columna L: Alcohol Peso
-                row[12] = alcohol_volumen  # Columna M: Alcohol Volumen
-                row[13] = peso_esp  # Columna N: Peso Esp
-                row[14] = gaf  # Columna O: GAF
-                
-                new_rows.append(row)
-                
-            elif collection_name == 'tanque_presion':
-                end_col = 'U'  # Ahora va hasta la columna U por el alcohol final
-                # TANQUE DE PRESIÓN - desde fila 5
-                alcohol_final = ""
-                
-                # Calcular alcohol final si hay datos de tanques
-                try:
-                    volumen_total = float(data.get('Volumen total [L] (Ej: 6650)', 0))
-                    if volumen_total > 0:
-                        alcohol_total = 0
-                        volumen_cerveza_total = 0
-                        
-                        # Para cada tanque (A, B, C)
-                        for tanque in ['A', 'B', 'C']:
-                            num_tanque = data.get(f'Tanque {tanque} (Ej: 1)', '')
-                            volumen_str = data.get(f'Volumen total del Tanque {tanque} [L] (Ej: 2650)', '')
-                            
-                            if num_tanque and volumen_str and num_tanque in tanques_alcohol:
-                                try:
-                                    volumen = float(volumen_str)
-                                    alcohol_data = tanques_alcohol[num_tanque]
-                                    alcohol_vol = float(alcohol_data['alcohol'])
-                
-                                    alcohol_total += volumen * alcohol_vol
-                                    volumen_cerveza_total += volumen
-                
-                                    print(f"✅ Usando tanque {num_tanque}: {alcohol_vol}% (de {alcohol_data['fecha']})")
-                                except ValueError:
-                                    continue
-                        
-                        # Calcular alcohol final considerando el agua añadida
-                        if volumen_cerveza_total > 0:
-                            alcohol_final = (alcohol_total / volumen_total) * 100
-                except (ValueError, TypeError):
-                    alcohol_final = ""
-                
-                row = [''] * 21  # A-U (21 columnas, añadiendo columna U para alcohol final)
-                row[0] = doc.id  # Columna A: ID oculto
-                row[1] = fecha  # Columna B: Fecha
-                row[2] = data.get('Tipo (Ej: Trimalta )', '')  # Columna C: Tipo
-                row[3] = data.get('N° Cocimiento (Ej:125-126)', '')  # Columna D: N° Cocimiento
-                row[4] = data.get('Tp N° (Ej: 2)', '')  # Columna E: Tp N°
-                row[5] = data.get('Tq N° (Ej: 9-7-6)', '')  # Columna F: Tq N°
-                # Columna G vacía
-                row[7] = data.get('Sedimentos (0/S/SS/SSS) (EJ: S)', '')  # Columna H: Sedimentos
-                row[8] = data.get('Color [EBC] (Ej: 7.5)', '')  # Columna I: Color
-                row[9] = data.get('Extrácto aparente [%] p/p (Ej: 2.06)', '')  # Columna J: Ext. Aparente
-                row[10] = data.get('Volumen total [L] (Ej: 6650)', '')  # Columna K: Volumen total
-                row[11] = data.get('Volumen H2O [L] (Ej: 1850)', '')  # Columna L: Volumen H2O
-                row[12] = data.get('Tanque A (Ej: 1)', '')  # Columna M: Tanque A
-                row[13] = data.get('Volumen total del Tanque A [L] (Ej: 2650)', '')  # Columna N: Volumen Tanque A
-                row[14] = data.get('Tanque B (Ej: 14)', '')  # Columna O: Tanque B
-                row[15] = data.get('Volumen total del Tanque B [L] (Ej: 1950)', '')  # Columna P: Volumen Tanque B
-                row[16] = data.get('Tanque C (Ej: 9)', '')  # Columna Q: Tanque C
-                row[17] = data.get('Volumen total del Tanque C [L] (Ej: 200)', '')  # Columna R: Volumen Tanque C
-                row[18] = data.get('Observaciones', '')  # Columna S: Observaciones
-                # Columna T vacía
-                row[20] = alcohol_final  # Columna U: Alcohol final de la mezcla
-                
-                new_rows.append(row)
-                
-            elif collection_name == 'envasado':
-                # ENVASADO - desde fila 6
-                row = [''] * 15  # A-O (15 columnas)
-                row[0] = doc.id  # Columna A: ID oculto
-                row[1] = fecha  # Columna B: Fecha
-                row[2] = data.get('Tipo (Ej: Occidental)', '')  # Columna C: Tipo
-                row[3] = data.get('Calibre [ml] (Ej: 620)', '')  # Columna D: Calibre
-                row[4] = data.get('Tq N° (Ej: 10-12)', '')  # Columna E: Tq N°
-                row[5] = data.get('Tp N° (Ej: 1)', '')  # Columna F: Tp N°
-                row[6] = data.get('N° Cocimiento (Ej: 91-92-95-96)', '')  # Columna G: N° Cocimiento
-                row[7] = data.get('Turbidez [EBC] (Ej: 0.3)', '')  # Columna H: Turbidez
-                row[8] = data.get('Degustación (OK ; no OK)', '')  # Columna I: Degustación
-                row[9] = data.get('Sedimentos (0/S/SS/SSS) (Ej: 0)', '')  # Columna J: Sedimentos
-                row[10] = data.get('T set [°C] (Pasteurizadora) (Ej: 69)', '')  # Columna K: T set
-                row[11] = data.get('T max [°C] (Pasteurizadora) (Ej: 69.1)', '')  # Columna L: T max
-                row[12] = data.get('UP', '')  # Columna M: UP
-                row[13] = data.get('NaOH [%] (Lavadora) (Ej: 0.48)', '')  # Columna N: NaOH
-                row[14] = data.get('Observaciones (Ej: Adición 1/2 bolsa soda)', '')  # Columna O: Observaciones
-                
-                new_rows.append(row)
-                
-            elif collection_name == 'producto_terminado':
-                # PRODUCTO TERMINADO - desde fila 5
-                row = [''] * 15  # A-O (15 columnas)
-                row[0] = doc.id  # Columna A: ID oculto
-                row[1] = fecha  # Columna B: Fecha
-                row[2] = data.get('Código (Envasado/Vencimiento) (Ej: L = 150-00438 / V = 30-5-26)', '')  # Columna C: Código
-                row[3] = data.get('Tipo (Ej: Trimalta Quinua)', '')  # Columna D: Tipo
-                row[4] = data.get('Calibre [ml] (Ej: 300)', '')  # Columna E: Calibre
-                row[5] = data.get('Tq N° (Ej: 1-10)', '')  # Columna F: Tq N°
-                row[6] = data.get('Tp N° (Ej: 2)', '')  # Columna G: Tp N°
-                row[7] = data.get('N° Cocimiento (Ej: 63-64)', '')  # Columna H: N° Cocimiento
-                row[8] = data.get('pH (Ej: 4.67)', '')  # Columna I: pH
-                row[9] = data.get('Color [EBC] (Ej: 150)', '')  # Columna J: Color
-                row[10] = data.get('Extrácto aparente [%] p/p (Ej: 11.2)', '')  # Columna K: Ext. Aparente
-                row[11] = data.get('Espuma [seg] (123)', '')  # Columna L: Espuma
-                row[12] = data.get('Sedimentos 0°C (0/S/SS/SSS) (Ej: S)', '')  # Columna M: Sedimentos 0°C
-                row[13] = data.get('Sedimentos 20°C (0/S/SS/SSS) (Ej: SS)', '')  # Columna N: Sedimentos 20°C
-                row[14] = data.get('Observaciones', '')  # Columna O: Observaciones
-                
-                new_rows.append(row)
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{escape_label(v)}"' for k, v in pairs) + '}'
         
-        # Escribir nuevos datos
-        if new_rows:
-            # Determinar la fila de inicio según la colección
-            if collection_name == 'cocimiento' or collection_name == 'fermentacion' or collection_name == 'envasado':
-                start_row = 6
-            else:  # tanque_presion y producto_terminado
-                start_row = 5
-                
-            # Buscar la última fila con datos
-            existing_data = worksheet.get_all_values()
-            last_row = start_row
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+        
+        lines = []
+        for name in sorted({key[0] for key in values} | {key[0] for key in histograms}):
+            kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f'{name}{label_text(labels)} {value}')
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(STAGE_BUCKETS, buckets):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{label_text(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_bucket{label_text(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{label_text(labels)} {total}')
+                lines.append(f'{name}_count{label_text(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+    
+    # Suma de un contador sobre las series que coinciden con las etiquetas dadas
+    def total(self, name, **labels):
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (metric, series), value in self.values.items()
+                       if metric == name and wanted <= set(series))
+    
+    def stats(self):
+        with self.lock:
+            result = {}
+            for (name, labels), value in self.values.items():
+                result.setdefault(name, []).append({**dict(labels), 'value': value})
+            for (name, labels), (buckets, total, count) in self.histograms.items():
+                result.setdefault(name, []).append({
+                    **dict(labels), 'count': count, 'sum': round(total, 6),
+                    'avg': round(total / count, 6) if count else None
+                })
+            return result
+
+metrics = Metrics()
+
+# Llamadas a la API de Sheets por colección en la última sincronización
+api_calls = {}
+api_calls_lock = threading.Lock()
+
+def count_api_calls(collection_name, calls=1):
+    key = target_scoped(collection_name)
+    with api_calls_lock:
+        api_calls[key] = api_calls.get(key, 0) + calls
+    metrics.inc('sheets_calls_total', calls, collection=collection_name)
+
+# Limitador de tasa compartido por todos los hilos: modela la cuota por minuto de Sheets.
+# La ráfaga se descuenta del ritmo de recarga, así que ninguna ventana de 60 s
+# (ni siquiera tras un rato sin llamadas) supera la cuota.
+SHEETS_BURST = int(os.environ.get('SHEETS_BURST', 5))
+
+class TokenBucket:
+    """Permite `rate_per_minute` llamadas en cualquier minuto: ráfagas de hasta `burst` y el resto a ritmo constante"""
+    
+    def __init__(self, rate_per_minute, burst=SHEETS_BURST):
+        self.capacity = max(1, min(burst, rate_per_minute // 2))
+        self.rate = max(rate_per_minute - self.capacity, 1) / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', 5))
+SHEETS_READS_PER_MINUTE = int(os.environ.get('SHEETS_READS_PER_MINUTE', 60))
+SHEETS_WRITES_PER_MINUTE = int(os.environ.get('SHEETS_WRITES_PER_MINUTE', 60))
+
+# La cuota de Sheets es por cuenta de servicio: un par de limitadores por
+# archivo de credenciales, compartido por los destinos que lo usan
+sheets_limiters = {}  # archivo de credenciales -> {'read': TokenBucket, 'write': TokenBucket}
+sheets_limiters_lock = threading.Lock()
+
+def limiters_for(key_file):
+    with sheets_limiters_lock:
+        if key_file not in sheets_limiters:
+            sheets_limiters[key_file] = {
+                'read': TokenBucket(SHEETS_READS_PER_MINUTE),
+                'write': TokenBucket(SHEETS_WRITES_PER_MINUTE)
+            }
+        return sheets_limiters[key_file]
+
+# Esperar turno en la cuota de lectura o escritura antes de llamar a Sheets
+def throttle(kind):
+    limiters_for(current_target()['sheets_key'])[kind].acquire()
+
+SHEETS_RETRIES = int(os.environ.get('SHEETS_RETRIES', 3))
+
+def api_error_status(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+# Llamada a Sheets con cuota, conteo y reintentos con espera exponencial ante 429
+def sheets_call(collection_name, kind, fn, *args, **kwargs):
+    import gspread
+    for attempt in range(SHEETS_RETRIES + 1):
+        throttle(kind)
+        count_api_calls(collection_name)
+        try:
+            return fn(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = api_error_status(e)
+            metrics.inc('sheets_errors_total', collection=collection_name, status=str(status))
+            if status != 429 or attempt == SHEETS_RETRIES:
+                raise
+            metrics.inc('sheets_retries_total', collection=collection_name)
+            time.sleep(min(60, 2 ** attempt) + random.random())
+
+# Escribir filas contiguas desde first_row en bloques de chunk_size filas
+def write_rows(worksheet, first_row, end_col, rows, chunk_size=SHEETS_WRITE_CHUNK, collection_name=None):
+    """Escribe las filas en rangos contiguos y devuelve el número de llamadas a la API"""
+    calls = 0
+    for offset in range(0, len(rows), chunk_size):
+        chunk = rows[offset:offset + chunk_size]
+        start = first_row + offset
+        end = start + len(chunk) - 1
+        sheets_call(collection_name or worksheet.title.lower(), 'write',
+                    worksheet.update, f'A{start}:{end_col}{end}', chunk)
+        calls += 1
+    return calls
+
+# Cola de salida persistente (tabla outbox del estado local) entre la proyección
+# y la escritura: las filas calculadas se guardan antes de escribirlas, así que
+# tras un error o un reinicio solo se reenvían las pendientes, sin volver a leer
+# Firestore. Cada bloque se escribe en un rango fijo, por lo que reintentarlo es
+# idempotente.
+OUTBOX_RETRIES = int(os.environ.get('OUTBOX_RETRIES', 2))
+# Intentos (sumando ciclos) tras los que un bloque que Sheets rechaza siempre se
+# aparta de la cola para no bloquear las filas siguientes. Las filas apartadas
+# se muestran en /stats y vuelven a intentarse en la próxima reconciliación o
+# cuando cambia su contenido.
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+
+# Encolar filas; si el documento ya estaba en la cola, se actualiza su contenido
+# (y, si cambió, vuelve a tener todos sus intentos)
+def enqueue_rows(worksheet, rows):
+    key = sheet_key(worksheet)
+    entries = []
+    for row in rows:
+        cells = row_cells(row)
+        entries.append((key, row[0], cells, row_hash(cells)))
+    with state_lock:
+        db = get_state_db()
+        with db:
+            db.executemany('INSERT INTO outbox (sheet, doc_id, row, hash) VALUES (?, ?, ?, ?) '
+                           'ON CONFLICT (sheet, doc_id) DO UPDATE SET row = excluded.row, hash = excluded.hash, '
+                           'attempts = CASE WHEN hash = excluded.hash THEN attempts ELSE 0 END',
+                           entries)
+
+# Quitar de la cola las filas que ya están en la hoja (p. ej. el índice se
+# reconstruyó tras un corte)
+def purge_outbox(worksheet):
+    key = sheet_key(worksheet)
+    with state_lock:
+        db = get_state_db()
+        with db:
+            db.execute('DELETE FROM outbox WHERE sheet = ? AND doc_id IN '
+                       '(SELECT doc_id FROM sheet_rows WHERE sheet = ?)', (key, key))
+
+def outbox_pending(worksheet):
+    with state_lock:
+        return get_state_db().execute('SELECT COUNT(*) FROM outbox WHERE sheet = ? AND attempts < ?',
+                                      (sheet_key(worksheet), OUTBOX_MAX_ATTEMPTS)).fetchone()[0]
+
+def outbox_parked(worksheet):
+    with state_lock:
+        return get_state_db().execute('SELECT COUNT(*) FROM outbox WHERE sheet = ? AND attempts >= ?',
+                                      (sheet_key(worksheet), OUTBOX_MAX_ATTEMPTS)).fetchone()[0]
+
+# Devolver a la cola las filas apartadas de una hoja (al reconciliar)
+def retry_parked_rows(worksheet):
+    with state_lock:
+        db = get_state_db()
+        with db:
+            released = db.execute('UPDATE outbox SET attempts = 0 WHERE sheet = ? AND attempts >= ?',
+                                  (sheet_key(worksheet), OUTBOX_MAX_ATTEMPTS)).rowcount
+    if released:
+        print(f"🔁 {released} filas apartadas de {worksheet.title} vuelven a la cola")
+    return released
+
+# Filas en cola por hoja, las apartadas y el último error de estas (para /stats)
+def outbox_status():
+    with state_lock:
+        rows = get_state_db().execute(
+            'SELECT sheet, SUM(attempts < ?), SUM(attempts >= ?), MAX(CASE WHEN attempts >= ? THEN last_error END) '
+            'FROM outbox GROUP BY sheet ORDER BY sheet', (OUTBOX_MAX_ATTEMPTS,) * 3).fetchall()
+    return [{'sheet': sheet, 'pending': pending, 'parked': parked, 'last_error': last_error}
+            for sheet, pending, parked, last_error in rows]
+
+# Comprobar con una sola lectura que la hoja sigue como la dejó el índice antes
+# de añadir filas en next_row: la fila anterior tiene el último ID indexado y
+# next_row está vacía (alguien pudo insertar o borrar filas a mano)
+def append_point_matches(worksheet, next_row, start_row, collection_name):
+    if next_row <= start_row:
+        values = sheets_call(collection_name, 'read', worksheet.get, f'A{next_row}')
+        return not any(row and row[0] for row in values)
+    with state_lock:
+        last = get_state_db().execute('SELECT doc_id FROM sheet_rows WHERE sheet = ? AND row = ?',
+                                      (sheet_key(worksheet), next_row - 1)).fetchone()
+    values = sheets_call(collection_name, 'read', worksheet.get, f'A{next_row - 1}:A{next_row}')
+    cells = [row[0] if row else '' for row in values] + ['', '']
+    return last is not None and cells[0] == last[0] and cells[1] == ''
+
+# Vaciar la cola de una hoja en bloques desde next_row; devuelve (filas escritas,
+# siguiente fila). Antes de cada bloque se verifica el punto de inserción y, si
+# la hoja cambió, se reconstruye el índice y se escribe tras la última fila
+# real. Si un bloque falla tras los reintentos, se propaga el error y sus filas
+# quedan en la cola para el próximo ciclo (o apartadas si agotaron sus intentos).
+def drain_outbox(worksheet, next_row, end_col, start_row, chunk_size=SHEETS_WRITE_CHUNK, collection_name=None):
+    key = sheet_key(worksheet)
+    collection_name = collection_name or worksheet.title.lower()
+    written = 0
+    rebuilt = False
+    purge_outbox(worksheet)
+    db = get_state_db()
+    
+    while True:
+        with state_lock:
+            pending = db.execute('SELECT id, row FROM outbox WHERE sheet = ? AND attempts < ? ORDER BY id LIMIT ?',
+                                 (key, OUTBOX_MAX_ATTEMPTS, chunk_size)).fetchall()
+        if not pending:
+            break
+        if not rebuilt and not append_point_matches(worksheet, next_row, start_row, collection_name):
+            print(f"⚠️ Filas movidas en {worksheet.title}, se reconstruye el índice antes de añadir filas")
+            next_row = load_sheet_index(worksheet, start_row, force=True, collection_name=collection_name)
+            rebuilt = True
+            purge_outbox(worksheet)
+            continue
+        rebuilt = False
+        outbox_ids = [outbox_id for outbox_id, _ in pending]
+        rows = [json.loads(row) for _, row in pending]
+        
+        for attempt in range(OUTBOX_RETRIES + 1):
+            try:
+                write_rows(worksheet, next_row, end_col, rows, chunk_size, collection_name)
+                break
+            except Exception as e:
+                metrics.inc('outbox_write_failures_total', collection=collection_name)
+                with state_lock:
+                    with db:
+                        db.executemany('UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                                       [(str(e)[:500], outbox_id) for outbox_id in outbox_ids])
+                if attempt == OUTBOX_RETRIES:
+                    placeholders = ', '.join('?' * len(outbox_ids))
+                    with state_lock:
+                        attempts = db.execute(f'SELECT MIN(attempts) FROM outbox WHERE id IN ({placeholders})',
+                                              outbox_ids).fetchone()[0]
+                    if attempts >= OUTBOX_MAX_ATTEMPTS:
+                        metrics.inc('outbox_parked_total', len(rows), collection=collection_name)
+                        print(f"🚫 {len(rows)} filas de {worksheet.title} apartadas tras {attempts} intentos: {str(e)}")
+                    raise
+                time.sleep(min(30, 2 ** attempt) + random.random())
+        
+        record_sheet_rows(worksheet, next_row, rows, outbox_ids)
+        next_row += len(rows)
+        written += len(rows)
+    return written, next_row
+
+# Columnas consecutivas agrupadas en rangos [(primera, última)]
+def column_runs(columns):
+    runs = []
+    for column in columns:
+        if runs and runs[-1][1] == column - 1:
+            runs[-1][1] = column
+        else:
+            runs.append([column, column])
+    return runs
+
+# Filas intermedias que se leen de más para unir dos tramos en un solo rango, y
+# máximo de rangos por batch_get (van en la URL de la petición)
+ROW_SPAN_GAP = 50
+MAX_RANGES_PER_READ = 50
+
+# Comprobar que la columna A de las filas de `chunk` ([(doc_id, fila, celdas)])
+# sigue teniendo esos IDs: la hoja se puede editar a mano (filas borradas,
+# insertadas u ordenadas) y el índice local no se entera. Las filas se leen en
+# tramos contiguos (A{primera}:A{última}), normalmente con una sola llamada.
+def rows_match(worksheet, chunk, collection_name):
+    expected = {row: doc_id for doc_id, row, _ in chunk}
+    if len(expected) != len(chunk):
+        return False  # Dos documentos en la misma fila
+    spans = []
+    for row in sorted(expected):
+        if spans and row - spans[-1][1] <= ROW_SPAN_GAP:
+            spans[-1][1] = row
+        else:
+            spans.append([row, row])
+    
+    found = {}
+    for offset in range(0, len(spans), MAX_RANGES_PER_READ):
+        part = spans[offset:offset + MAX_RANGES_PER_READ]
+        values = sheets_call(collection_name, 'read', worksheet.batch_get, [f'A{first}:A{last}' for first, last in part])
+        for (first, _), cells in zip(part, values):
+            for i, row in enumerate(cells):
+                found[first + i] = row[0] if row else ''
+    return all(found.get(row, '') == doc_id for row, doc_id in expected.items())
+
+# Documentos editados en Firestore: `changed` es [(doc_id, fila, celdas JSON)].
+# Se comparan con las celdas guardadas en el índice y solo se envían las que
+# cambiaron, en una llamada batch_update por bloque. Antes de cada bloque se
+# verifican los IDs de las filas destino; si alguno no coincide se reconstruye
+# el índice y se usan las filas actuales (los documentos que ya no están en la
+# hoja vuelven a la cola de salida). Devuelve (celdas enviadas, True si se
+# reconstruyó el índice).
+def update_changed_rows(worksheet, changed, start_row, collection_name=None, chunk_size=SHEETS_WRITE_CHUNK):
+    key = sheet_key(worksheet)
+    collection_name = collection_name or worksheet.title.lower()
+    sent = 0
+    reindexed = False
+    for offset in range(0, len(changed), chunk_size):
+        chunk = changed[offset:offset + chunk_size]
+        if not rows_match(worksheet, chunk, collection_name):
+            print(f"⚠️ Filas movidas en {worksheet.title}, se reconstruye el índice antes de editar")
+            load_sheet_index(worksheet, start_row, force=True, collection_name=collection_name)
+            reindexed = True
+            rows = {doc_id: row for doc_id, (row, _) in indexed_ids(worksheet, [doc_id for doc_id, _, _ in chunk]).items()
+                    if row is not None}
+            missing = [json.loads(cells) for doc_id, _, cells in chunk if doc_id not in rows]
+            if missing:
+                enqueue_rows(worksheet, missing)
+            chunk = [(doc_id, rows[doc_id], cells) for doc_id, _, cells in chunk if doc_id in rows]
+        placeholders = ', '.join('?' * len(chunk))
+        with state_lock:
+            db = get_state_db()
+            stored = dict(db.execute(f'SELECT doc_id, cells FROM sheet_rows WHERE sheet = ? AND doc_id IN ({placeholders})',
+                                     (key, *(doc_id for doc_id, _, _ in chunk))))
+        
+        data = []
+        for doc_id, row_number, cells in chunk:
+            new = json.loads(cells)
+            old = json.loads(stored[doc_id]) if stored.get(doc_id) else []
+            new += [''] * (len(old) - len(new))  # Celdas que sobran: vaciarlas
+            columns = [i for i, value in enumerate(new) if i >= len(old) or old[i] != value]
+            for first, last in column_runs(columns):
+                data.append({'range': f'{col_letter(first)}{row_number}:{col_letter(last)}{row_number}',
+                             'values': [new[first:last + 1]]})
+                sent += last - first + 1
+        if data:
+            sheets_call(collection_name, 'write', worksheet.batch_update, data)
+        
+        with state_lock:
+            with db:
+                db.executemany('UPDATE sheet_rows SET hash = ?, cells = ? WHERE sheet = ? AND doc_id = ?',
+                               [(row_hash(cells), cells, key, doc_id) for doc_id, _, cells in chunk])
+    return sent, reindexed
+
+# Filas indexadas sin hash (escritas por versiones anteriores o encontradas al
+# reconstruir el índice): se toma su contenido actual como referencia
+def adopt_row_hashes(worksheet, rows):
+    key = sheet_key(worksheet)
+    with state_lock:
+        db = get_state_db()
+        with db:
+            db.executemany('UPDATE sheet_rows SET hash = ?, cells = ? WHERE sheet = ? AND doc_id = ?',
+                           [(row_hash(cells), cells, key, doc_id) for doc_id, cells in rows])
+
+# Derivados de fermentación (mismas condiciones que antes en el bucle por documento)
+def derivar_fermentacion(data):
+    extracto_aparente = data.get('Extrácto aparente [%] p/p (Ej: 2.70)', '')
+    extracto_original = data.get('Extrácto original [%] p/p (Ej: 16.0)', '')
+    
+    peso_esp = calcular_peso_esp(extracto_aparente) if extracto_aparente else ""
+    gaf = calcular_gaf(extracto_original, extracto_aparente) if extracto_original and extracto_aparente else ""
+    alcohol_peso = calcular_alcohol_peso(extracto_original, extracto_aparente) if extracto_original and extracto_aparente else ""
+    alcohol_volumen = calcular_alcohol_volumen(alcohol_peso, peso_esp) if alcohol_peso and peso_esp else ""
+    extracto_real = calcular_extracto_real(extracto_original, alcohol_peso) if extracto_original and alcohol_peso else ""
+    
+    return {
+        'peso_esp': peso_esp,
+        'gaf': gaf,
+        'alcohol_peso': alcohol_peso,
+        'alcohol_volumen': alcohol_volumen,
+        'extracto_real': extracto_real
+    }
+
+# Registrar el alcohol de cada lectura de fermentación en el índice por tanque.
+# Se llama para todos los documentos leídos, también los que ya están en la hoja.
+# Si el documento ya no da una lectura (sin tanque o sin alcohol), se olvida la anterior.
+def indexar_alcohol_tanque(doc_id, data):
+    numero_tanque = data.get('Tq N°(Ej: 7)', '')
+    alcohol_volumen = derivar_fermentacion(data)['alcohol_volumen'] if numero_tanque else ''
+    if not alcohol_volumen:
+        olvidar_alcohol_tanque(doc_id)
+    # Cada destino (planta) tiene sus propios tanques
+    elif record_tank_alcohol(target_scoped(doc_id), target_scoped(str(numero_tanque)),
+                             data.get('date', ''), alcohol_volumen,
+                             data.get('N° Cocimiento (Ej: 341-342-343)', '')):
+        print(f"✅ Tanque {numero_tanque} actualizado: {alcohol_volumen}%")
+
+# Documento de fermentación borrado (o sin lectura) en el destino en curso
+def olvidar_alcohol_tanque(doc_id):
+    if forget_tank_alcohol(target_scoped(doc_id)):
+        print(f"🗑️ Lectura de alcohol de {doc_id} eliminada")
+
+# Tras leer fermentación completa: olvidar las lecturas del destino en curso
+# cuyos documentos ya no existen
+def podar_alcohol_tanque(doc_ids):
+    vigentes = {target_scoped(doc_id) for doc_id in doc_ids}
+    prefijo = target_scoped('')
+    with state_lock:
+        get_tank_index()
+        borrados = [doc_id for doc_id in tank_by_doc if doc_id not in vigentes
+                    and (doc_id.startswith(prefijo) if prefijo else '/' not in doc_id)]
+        for doc_id in borrados:
+            forget_tank_alcohol(doc_id)
+    if borrados:
+        print(f"🗑️ {len(borrados)} lecturas de alcohol de documentos borrados eliminadas")
+
+# Alcohol final de la mezcla en tanque de presión
+def derivar_tanque_presion(data):
+    alcohol_final = ""
+    
+    # Calcular alcohol final si hay datos de tanques
+    try:
+        volumen_total = float(data.get('Volumen total [L] (Ej: 6650)', 0))
+        if volumen_total > 0:
+            alcohol_total = 0
+            volumen_cerveza_total = 0
             
-            # Buscar la primera fila VACÍA después de los datos existentes
-            for i in range(start_row-1, len(existing_data)):
-               if not existing_data[i]:  # Si la fila está VACÍA
-                   last_row = i + 1
-                   break
-            else:
-                # Si no encontró filas vacías, usar la siguiente después de la última
-                last_row = len(existing_data) + 1
+            # Para cada tanque (A, B, C)
+            for tanque in ['A', 'B', 'C']:
+                num_tanque = data.get(f'Tanque {tanque} (Ej: 1)', '')
+                volumen_str = data.get(f'Volumen total del Tanque {tanque} [L] (Ej: 2650)', '')
+                
+                # Lectura del tanque vigente a la fecha del tanque de presión
+                alcohol_data = alcohol_tanque(target_scoped(str(num_tanque)), data.get('date', '')) if num_tanque else None
+                if volumen_str and alcohol_data:
+                    try:
+                        volumen = float(volumen_str)
+                        alcohol_vol = float(alcohol_data['alcohol'])
+    
+                        alcohol_total += volumen * alcohol_vol
+                        volumen_cerveza_total += volumen
+                    except ValueError:
+                        continue
             
-            # Determinar el rango de columnas según la colección
-            if collection_name == 'cocimiento':
-                end_col = 'M'
-            elif collection_name == 'fermentacion':
-                end_col = 'O'  # Ahora va hasta la columna O por los cálculos
-            elif collection_name == 'tanque_presion':
-                end_col = 'U'  # Ahora va hasta la columna U por el alcohol final
-            elif collection_name == 'envasado':
-                end_col = 'O'
-            elif collection_name == 'producto_terminado':
-                end_col = 'O'
+            # Calcular alcohol final considerando el agua añadida
+            if volumen_cerveza_total > 0:
+                alcohol_final = (alcohol_total / volumen_total) * 100
+    except (ValueError, TypeError):
+        alcohol_final = ""
+    
+    return {'alcohol_final': alcohol_final}
+
+# Marcadores de columna: ID del documento y valores derivados
+DOC_ID = object()
+DERIVED = 'derived'
+
+# Esquema declarativo de las hojas: filas de encabezado, y por columna
+# (letra, campo de Firestore) o (letra, nombre del valor derivado, DERIVED).
+# 'index_doc' se llama con cada documento leído (nuevo o no), 'index_forget' con
+# el ID de cada documento borrado que avisa un listener e 'index_prune' con los
+# IDs de una lectura completa de la colección; 'depends_on' hace esperar la
+# proyección hasta que terminen esas colecciones, que deben ir antes en el orden
+# del diccionario.
+SHEET_SCHEMAS = {
+    'fermentacion': {
+        'sheet': 'Fermentacion',
+        'header_rows': 5,
+        'derive': derivar_fermentacion,
+        'index_doc': indexar_alcohol_tanque,
+        'index_forget': olvidar_alcohol_tanque,
+        'index_prune': podar_alcohol_tanque,
+        'columns': [
+            ('A', DOC_ID),  # ID oculto
+            ('B', 'date'),  # Fecha
+            ('C', 'Tipo (Ej: Autentica)'),
+            ('D', 'N° Cocimiento (Ej: 341-342-343)'),
+            ('E', 'Tq N°(Ej: 7)'),
+            ('F', 'pH (Ej: 4.36)'),
+            ('G', 'Color [EBC] (Ej: 9.5)'),
+            ('H', 'Turbidez [EBC] (Ej: 18.92)'),
+            ('I', 'Extrácto aparente [%] p/p (Ej: 2.70)'),
+            ('J', 'Extrácto original [%] p/p (Ej: 16.0)'),
+            ('K', 'extracto_real', DERIVED),
+            ('L', 'alcohol_peso', DERIVED),
+            ('M', 'alcohol_volumen', DERIVED),
+            ('N', 'peso_esp', DERIVED),
+            ('O', 'gaf', DERIVED),
+        ],
+    },
+    'cocimiento': {
+        'sheet': 'Cocimiento',
+        'header_rows': 5,
+        'columns': [
+            ('A', DOC_ID),
+            ('B', 'date'),
+            ('C', 'Tipo (Ej: Judas) holi'),
+            ('D', 'N° Cocimiento (Ej: 102)'),
+            ('E', 'A Tq N° (Ej: 4)'),
+            ('F', 'pH (Mosto Macerado) (Ej: 5.4)'),
+            # G vacía
+            ('H', 'Extracto original [%] p/p (Primer Mosto) (Ej: 18.5)'),
+            # I vacía
+            ('J', 'Extracto original [%] p/p (Mosto Frío) (Ej: 16.5)'),
+            ('K', 'pH(Mosto Frío) (Ej: 5.43)'),
+            ('L', 'Color [EBC] (Mosto Frío) (Ej: 8.5)'),
+            ('M', 'Observaciones (Ej: Sin muestra frío)'),
+        ],
+    },
+    'tanque_presion': {
+        'sheet': 'Tanque_presion',
+        'header_rows': 4,
+        'depends_on': ['fermentacion'],  # Necesita el índice de alcohol por tanque al día
+        'derive': derivar_tanque_presion,
+        'columns': [
+            ('A', DOC_ID),
+            ('B', 'date'),
+            ('C', 'Tipo (Ej: Trimalta )'),
+            ('D', 'N° Cocimiento (Ej:125-126)'),
+            ('E', 'Tp N° (Ej: 2)'),
+            ('F', 'Tq N° (Ej: 9-7-6)'),
+            # G vacía
+            ('H', 'Sedimentos (0/S/SS/SSS) (EJ: S)'),
+            ('I', 'Color [EBC] (Ej: 7.5)'),
+            ('J', 'Extrácto aparente [%] p/p (Ej: 2.06)'),
+            ('K', 'Volumen total [L] (Ej: 6650)'),
+            ('L', 'Volumen H2O [L] (Ej: 1850)'),
+            ('M', 'Tanque A (Ej: 1)'),
+            ('N', 'Volumen total del Tanque A [L] (Ej: 2650)'),
+            ('O', 'Tanque B (Ej: 14)'),
+            ('P', 'Volumen total del Tanque B [L] (Ej: 1950)'),
+            ('Q', 'Tanque C (Ej: 9)'),
+            ('R', 'Volumen total del Tanque C [L] (Ej: 200)'),
+            ('S', 'Observaciones'),
+            # T vacía
+            ('U', 'alcohol_final', DERIVED),  # Alcohol final de la mezcla
+        ],
+    },
+    'envasado': {
+        'sheet': 'Envasado',
+        'header_rows': 5,
+        'columns': [
+            ('A', DOC_ID),
+            ('B', 'date'),
+            ('C', 'Tipo (Ej: Occidental)'),
+            ('D', 'Calibre [ml] (Ej: 620)'),
+            ('E', 'Tq N° (Ej: 10-12)'),
+            ('F', 'Tp N° (Ej: 1)'),
+            ('G', 'N° Cocimiento (Ej: 91-92-95-96)'),
+            ('H', 'Turbidez [EBC] (Ej: 0.3)'),
+            ('I', 'Degustación (OK ; no OK)'),
+            ('J', 'Sedimentos (0/S/SS/SSS) (Ej: 0)'),
+            ('K', 'T set [°C] (Pasteurizadora) (Ej: 69)'),
+            ('L', 'T max [°C] (Pasteurizadora) (Ej: 69.1)'),
+            ('M', 'UP'),
+            ('N', 'NaOH [%] (Lavadora) (Ej: 0.48)'),
+            ('O', 'Observaciones (Ej: Adición 1/2 bolsa soda)'),
+        ],
+    },
+    'producto_terminado': {
+        'sheet': 'Producto_terminado',
+        'header_rows': 4,
+        'columns': [
+            ('A', DOC_ID),
+            ('B', 'date'),
+            ('C', 'Código (Envasado/Vencimiento) (Ej: L = 150-00438 / V = 30-5-26)'),
+            ('D', 'Tipo (Ej: Trimalta Quinua)'),
+            ('E', 'Calibre [ml] (Ej: 300)'),
+            ('F', 'Tq N° (Ej: 1-10)'),
+            ('G', 'Tp N° (Ej: 2)'),
+            ('H', 'N° Cocimiento (Ej: 63-64)'),
+            ('I', 'pH (Ej: 4.67)'),
+            ('J', 'Color [EBC] (Ej: 150)'),
+            ('K', 'Extrácto aparente [%] p/p (Ej: 11.2)'),
+            ('L', 'Espuma [seg] (123)'),
+            ('M', 'Sedimentos 0°C (0/S/SS/SSS) (Ej: S)'),
+            ('N', 'Sedimentos 20°C (0/S/SS/SSS) (Ej: SS)'),
+            ('O', 'Observaciones'),
+        ],
+    },
+}
+
+def col_index(letter):
+    index = 0
+    for char in letter:
+        index = index * 26 + ord(char) - ord('A') + 1
+    return index - 1
+
+def col_letter(index):
+    letter = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letter = chr(ord('A') + rem) + letter
+    return letter
+
+# Compilar un esquema a un proyector documento -> fila. Se genera el código de
+# una función que construye la fila con una sola lista literal (como hace
+# collections.namedtuple), sin bucles ni comparaciones por documento.
+def compile_projector(schema):
+    width = max(col_index(column[0]) for column in schema['columns']) + 1
+    cells = ["''"] * width
+    for letter, key, *kind in schema['columns']:
+        if key is DOC_ID:
+            cells[col_index(letter)] = 'doc_id'
+        elif kind and kind[0] == DERIVED:
+            cells[col_index(letter)] = f'derived[{key!r}]'
+        else:
+            cells[col_index(letter)] = f'get({key!r}, "")'
+    
+    lines = ['def project(doc_id, data):', '    get = data.get']
+    if schema.get('derive'):
+        lines.append('    derived = derive(data)')
+    lines.append(f'    row = [{", ".join(cells)}]')
+    lines.append('    return row')
+    
+    namespace = {'derive': schema.get('derive')}
+    exec('\n'.join(lines), namespace)
+    return namespace['project']
+
+# Proyectores y geometría de cada hoja, compilados una vez al arrancar
+PROJECTORS = {name: compile_projector(schema) for name, schema in SHEET_SCHEMAS.items()}
+
+def start_row_for(collection_name):
+    return SHEET_SCHEMAS[collection_name]['header_rows'] + 1
+
+def end_col_for(collection_name):
+    return col_letter(max(col_index(column[0]) for column in SHEET_SCHEMAS[collection_name]['columns']))
+
+# Destinos de sincronización: pares (proyecto de Firestore, hoja de cálculo) que
+# comparten el pool de hilos, el registro de clientes y la cuota por credencial.
+# Sin configuración hay un único destino con los valores de siempre. Con
+# SYNC_TARGETS (JSON) o SYNC_TARGETS_FILE (ruta a un JSON) se definen varios:
+#   {"targets": [{"name": "default"},
+#                {"name": "planta2", "spreadsheet": "Planta 2 Registros",
+#                 "firebase_key": "planta2-firebase.json", "firebase_key_env": "PLANTA2_FIREBASE_KEY",
+#                 "collections": ["fermentacion", "tanque_presion"],
+#                 "sheets": {"fermentacion": "Fermentacion 2025"}}]}
+# Los campos omitidos toman los valores del destino por defecto; el destino
+# llamado "default" conserva el checkpoint y los índices de la versión anterior.
+DEFAULT_TARGET = 'default'
+
+def load_targets():
+    defaults = {
+        'name': DEFAULT_TARGET,
+        'spreadsheet': SPREADSHEET_NAME,
+        'firebase_key': 'firebase-key.json',
+        'sheets_key': 'google-sheets-key.json',
+        'collections': list(SHEET_SCHEMAS),
+        'sheets': {}  # colección -> título de la hoja, si no es el del esquema
+    }
+    config = os.environ.get('SYNC_TARGETS')
+    if not config and os.environ.get('SYNC_TARGETS_FILE'):
+        with open(os.environ['SYNC_TARGETS_FILE']) as f:
+            config = f.read()
+    if not config:
+        return {DEFAULT_TARGET: defaults}
+    
+    entries = json.loads(config)
+    if isinstance(entries, dict):
+        entries = entries['targets']
+    targets = {}
+    for entry in entries:
+        target = {**defaults, **entry}
+        unknown = set(target['collections']) - set(SHEET_SCHEMAS)
+        if unknown:
+            raise ValueError(f"Destino {target['name']}: colecciones desconocidas {sorted(unknown)}")
+        if target['name'] in targets:
+            raise ValueError(f"Destino repetido: {target['name']}")
+        # En el orden del esquema, para que las dependencias se encolen primero
+        target['collections'] = [name for name in SHEET_SCHEMAS if name in target['collections']]
+        targets[target['name']] = target
+    return targets
+
+SYNC_TARGETS = load_targets()
+
+def sheet_title(target, collection_name):
+    return target['sheets'].get(collection_name, SHEET_SCHEMAS[collection_name]['sheet'])
+
+# Documentos de una colección como flujo: desde el cursor (ordenados por
+# CURSOR_FIELD) o, en la carga completa, por páginas ordenadas por ID que se
+# pueden reanudar después de `after`
+def read_documents(collection_ref, collection_name, cursor=None, after=None):
+    if cursor is not None:
+        metrics.inc('firestore_calls_total', collection=collection_name)
+        yield from collection_ref.order_by(CURSOR_FIELD).start_at({CURSOR_FIELD: cursor}).stream()
+        return
+    while True:
+        query = collection_ref.order_by(DOCUMENT_ID_FIELD)
+        if after is not None:
+            query = query.start_after({DOCUMENT_ID_FIELD: after})
+        metrics.inc('firestore_calls_total', collection=collection_name)
+        count = 0
+        for doc in query.limit(STREAM_PAGE_SIZE).stream():
+            count += 1
+            after = doc.id
+            yield doc
+        if count < STREAM_PAGE_SIZE:
+            return
+
+# Agrupar un iterable en listas de hasta `size` elementos
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+# Sinks: destinos de las filas proyectadas. sync_collection proyecta cada
+# documento una sola vez y pasa cada bloque de filas a todos los sinks de la
+# colección, que comparten esta interfaz:
+#   add(filas)  recibe filas ya proyectadas (el ID del documento en la columna A)
+#   ready()     True cuando tiene un bloque completo para escribir
+#   flush()     escribe lo acumulado; un error queda en `error`, no se propaga
+#   close()     al terminar la colección (métricas y resumen)
+# `seconds` acumula el tiempo de escritura, que se registra con la etapa `stage`.
+
+# Google Sheets: solo filas nuevas (por la cola de salida) y celdas editadas
+class SheetsSink:
+    stage = 'write'
+    
+    def __init__(self, worksheet, collection_name, next_row=None):
+        self.worksheet = worksheet
+        self.collection_name = collection_name
+        self.label = target_scoped(collection_name)
+        self.start_row = start_row_for(collection_name)
+        self.end_col = end_col_for(collection_name)
+        self.next_row = next_row
+        self.pending = []
+        self.changed = []  # (doc_id, fila, celdas) de documentos ya escritos que cambiaron
+        self.new_count = 0
+        self.updated_count = 0
+        self.updated_cells = 0
+        self.seconds = 0.0
+        self.error = None
+    
+    def add(self, rows):
+        existing_ids = indexed_ids(self.worksheet, [row[0] for row in rows])
+        if trace_recorder:
+            record_trace('index', collection=self.collection_name,
+                         rows=[[doc_id, row, digest] for doc_id, (row, digest) in existing_ids.items()])
+        baseline = []  # (doc_id, celdas) de filas indexadas todavía sin hash
+        for row in rows:
+            known = existing_ids.get(row[0])
             
-            # Escribir datos desde la última fila vacía
-            for i, row in enumerate(new_rows):
-                range_start = f'A{last_row + i}'
-                range_end = f'{end_col}{last_row + i}'
-                worksheet.update(f'{range_start}:{range_end}', [row])
+            # ✅ VERIFICAR POR ID DE FIREBASE (NO POR FECHA)
+            if known is None:
+                self.pending.append(row)
+                continue
             
-            return len(new_rows)
+            # Ya escrito o encolado: comparar el hash para detectar ediciones
+            cells = row_cells(row)
+            if known[1] == row_hash(cells):
+                continue
+            if known[0] is None:
+                self.pending.append(row)  # Aún en la cola: se actualiza su contenido
+            elif known[1] is None:
+                baseline.append((row[0], cells))
+            else:
+                self.changed.append((row[0], known[0], cells))
+        if baseline:
+            # No se escribe nada en la hoja: se adoptan en el acto, sin acumularlas
+            adopt_row_hashes(self.worksheet, baseline)
+    
+    def ready(self):
+        return len(self.pending) + len(self.changed) >= SHEETS_WRITE_CHUNK
+    
+    # Encolar las filas nuevas, enviar las celdas de los documentos editados y
+    # vaciar la cola de salida de la hoja (filas de este ciclo y las que quedaron
+    # de ciclos anteriores). Si la escritura falla se sigue leyendo: las filas
+    # nuevas quedan en la cola y las ediciones se vuelven a detectar en la
+    # próxima reconciliación.
+    def flush(self):
+        started = time.perf_counter()
+        try:
+            if self.pending:
+                enqueue_rows(self.worksheet, self.pending)
+            if self.error:
+                return
+            if self.changed:
+                cells, reindexed = update_changed_rows(self.worksheet, self.changed, self.start_row,
+                                                       self.collection_name)
+                self.updated_cells += cells
+                self.updated_count += len(self.changed)
+                if reindexed:
+                    self.next_row = None  # La primera fila libre cambió con la hoja
+            if self.next_row is None:
+                # Primera fila libre según el índice local (sin descargar la hoja)
+                self.next_row = load_sheet_index(self.worksheet, self.start_row, collection_name=self.collection_name)
+            count, self.next_row = drain_outbox(self.worksheet, self.next_row, self.end_col, self.start_row,
+                                                collection_name=self.collection_name)
+            self.new_count += count
+        except Exception as e:
+            self.error = e
+            print(f"⚠️ Escritura fallida en {self.label}, las filas quedan en la cola: {str(e)}")
+            invalidate_worksheet(self.worksheet.spreadsheet, self.worksheet.title)
+        finally:
+            self.pending.clear()
+            self.changed.clear()
+            self.seconds += time.perf_counter() - started
+    
+    def close(self):
+        metrics.set('outbox_pending', outbox_pending(self.worksheet), collection=self.collection_name)
+        metrics.set('outbox_parked', outbox_parked(self.worksheet), collection=self.collection_name)
+        if self.updated_count:
+            metrics.inc('docs_changed_total', self.updated_count, collection=self.collection_name)
+            metrics.inc('cells_updated_total', self.updated_cells, collection=self.collection_name)
+            print(f"✏️ {self.updated_count} registros editados en {self.label} ({self.updated_cells} celdas)")
+        if self.new_count or self.updated_count:
+            metrics.inc('docs_written_total', self.new_count, collection=self.collection_name)
+
+# Segmentos locales para consultas analíticas sin pasar por la API de Sheets.
+# Con SYNC_SEGMENTS_DIR, cada colección (y destino) tiene una carpeta
+# <dir>/<destino/>colección con archivos CSV de solo anexado: uno por escritura,
+# con encabezado (nombres de campo y de valores derivados) y una fila por
+# documento nuevo o editado. La última versión de cada ID es la vigente.
+# Si el proceso se corta antes de escribir un segmento, las filas que faltan
+# se añaden en la siguiente reconciliación (su hash no quedó registrado).
+SEGMENTS_DIR = os.environ.get('SYNC_SEGMENTS_DIR', '')  # Vacío: sin segmentos locales
+SEGMENT_ROWS = int(os.environ.get('SYNC_SEGMENT_ROWS', 20000))  # Filas por segmento (máximo)
+SEGMENT_MAX_FILES = int(os.environ.get('SYNC_SEGMENT_MAX_FILES', 64))  # Más archivos: se compactan
+
+# (posición en la fila, nombre) de las columnas con datos; las letras vacías se omiten
+def segment_columns(collection_name):
+    return [(col_index(letter), 'id' if key is DOC_ID else key)
+            for letter, key, *kind in SHEET_SCHEMAS[collection_name]['columns']]
+
+def segment_dir(collection_name, target=None, directory=None):
+    return os.path.join(directory or SEGMENTS_DIR, *target_scoped(collection_name, target).split('/'))
+
+def segment_files(path):
+    try:
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.csv'))
+    except FileNotFoundError:
+        return []
+
+# Escribir un segmento completo o nada (se renombra al terminar)
+def write_segment(path, header, records):
+    os.makedirs(path, exist_ok=True)
+    name = os.path.join(path, f'{time.time_ns():020d}.csv')
+    with open(name + '.tmp', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(records)
+    os.replace(name + '.tmp', name)
+    return name
+
+# Registros de un segmento leídos desde un mapa de memoria (sin cargar el archivo)
+def segment_records(name):
+    with open(name, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from csv.reader(line.decode('utf-8') for line in iter(data.readline, b''))
+
+# Última versión de cada documento en los segmentos `files`, como
+# ({doc_id: valores}, columnas); (None, None) si alguno desapareció mientras se leía
+def latest_records(files, columns=None):
+    latest = {}
+    selected = None
+    for name in files:
+        try:
+            records = segment_records(name)
+            header = next(records, None)
+        except FileNotFoundError:
+            return None, None
+        if header is None:
+            continue
+        selected = columns or selected or header
+        positions = [header.index(column) if column in header else None for column in selected]
+        id_position = header.index('id')
+        for record in records:
+            latest[record[id_position]] = [record[i] if i is not None and i < len(record) else ''
+                                           for i in positions]
+    return latest, selected
+
+# Última versión de cada documento de una colección, por columnas:
+# {columna: [valores]} en orden de llegada. Los valores son texto; para
+# cálculos, columna_numerica(...) los convierte en un arreglo de numpy.
+def read_segments(collection_name, columns=None, target=None, directory=None):
+    path = segment_dir(collection_name, target, directory)
+    while True:
+        latest, selected = latest_records(segment_files(path), columns)
+        if latest is not None:
+            break
+        # Se compactó mientras se leía: el segmento nuevo ya está escrito, se vuelve a listar
+    if selected is None:
+        return {column: [] for column in columns or []}
+    return {column: [record[i] for record in latest.values()] for i, column in enumerate(selected)}
+
+# Reescribir los segmentos de una carpeta en uno solo con la última versión de cada ID
+def compact_segments(collection_name, target=None, directory=None):
+    path = segment_dir(collection_name, target, directory)
+    files = segment_files(path)
+    if len(files) < 2:
+        return 0
+    header = [name for _, name in segment_columns(collection_name)]
+    latest, _ = latest_records(files, header)  # Exactamente los archivos que se van a borrar
+    if latest is None:
+        return 0
+    write_segment(path, header, latest.values())
+    for name in files:
+        os.remove(name)
+    return len(files)
+
+class SegmentSink:
+    stage = 'segments'
+    
+    def __init__(self, collection_name, directory=None):
+        self.collection_name = collection_name
+        self.label = target_scoped(collection_name)
+        self.directory = directory
+        self.path = segment_dir(collection_name, directory=directory)
+        self.columns = segment_columns(collection_name)
+        self.pending = []  # (doc_id, hash, registro)
+        self.count = 0
+        self.seconds = 0.0
+        self.error = None
+    
+    def add(self, rows, batch_size=500):
+        cells = [row_cells(row) for row in rows]
+        stored = {}
+        with state_lock:
+            db = get_state_db()
+            for offset in range(0, len(rows), batch_size):
+                batch = [row[0] for row in rows[offset:offset + batch_size]]
+                placeholders = ', '.join('?' * len(batch))
+                stored.update(db.execute(
+                    f'SELECT doc_id, hash FROM segment_rows WHERE path = ? AND doc_id IN ({placeholders})',
+                    (self.path, *batch)))
+        for row, row_json in zip(rows, cells):
+            digest = row_hash(row_json)
+            if stored.get(row[0]) != digest:
+                self.pending.append((row[0], digest, [row[i] for i, _ in self.columns]))
+    
+    def ready(self):
+        return len(self.pending) >= SEGMENT_ROWS
+    
+    def flush(self):
+        if not self.pending:
+            return
+        started = time.perf_counter()
+        try:
+            write_segment(self.path, [name for _, name in self.columns], (record for _, _, record in self.pending))
+            with state_lock:
+                db = get_state_db()
+                with db:
+                    db.executemany('INSERT OR REPLACE INTO segment_rows VALUES (?, ?, ?)',
+                                   [(self.path, doc_id, digest) for doc_id, digest, _ in self.pending])
+            self.count += len(self.pending)
+        except Exception as e:
+            self.error = e
+            print(f"⚠️ Escritura fallida en los segmentos de {self.label}: {str(e)}")
+        finally:
+            self.pending.clear()
+            self.seconds += time.perf_counter() - started
+    
+    def close(self):
+        if self.count:
+            metrics.inc('segment_rows_total', self.count, collection=self.collection_name)
+            print(f"🗃️ {self.count} filas en los segmentos locales de {self.label}")
+        if len(segment_files(self.path)) > SEGMENT_MAX_FILES:
+            compact_segments(self.collection_name, directory=self.directory)
+
+# Sinks de una colección: Google Sheets (siempre el primero) y, si están
+# activados, los segmentos locales
+def collection_sinks(collection_name, worksheet, next_row=None):
+    sinks = [SheetsSink(worksheet, collection_name, next_row)]
+    if SEGMENTS_DIR:
+        sinks.append(SegmentSink(collection_name))
+    return sinks
+
+# Sincronizar una colección específica. Los documentos fluyen en bloques de
+# SHEETS_WRITE_CHUNK (leer -> proyectar -> sinks -> escribir): la
+# memoria depende del bloque y no del tamaño de la colección, y el progreso se
+# guarda por bloque.
+def sync_collection(collection_name, worksheet, reconcile=False, next_row=None, wait_for=None, docs=None):
+    db = get_firestore_client()
+    if not db:
         return 0
+    
+    try:
+        collection_ref = db.collection(collection_name)
+        progress_key = target_scoped(collection_name)  # Clave en el checkpoint
+        
+        # Leer solo documentos desde el último cursor (inclusive; los empates se filtran por ID)
+        cursor = None
+        if SYNC_MODE == 'incremental' and not reconcile:
+            cursor = decode_cursor(checkpoint['cursors'].get(progress_key))
+            if cursor is not None and cursor_kind(cursor) is None:
+                warn_cursor(progress_key)
+                drop_cursor(progress_key)
+                cursor = None
+        
+        new_cursor = cursor
+        cursor_kinds = {cursor_kind(cursor)} if cursor is not None else set()
+        backfill = None  # Posición de la carga completa (sin cursor; la reconciliación no la guarda)
+        streamed = docs is None
+        if not streamed:
+            pass  # Documentos ya recibidos (p. ej. desde un listener en tiempo real)
+        elif cursor is not None:
+            docs = read_documents(collection_ref, collection_name, cursor)
+        elif reconcile:
+            # La reconciliación recorre siempre todo: ni retoma ni guarda posición
+            backfill = {}
+            docs = read_documents(collection_ref, collection_name)
+        else:
+            backfill = checkpoint['backfill'].get(progress_key) or {}
+            new_cursor = decode_cursor(backfill.get('cursor'))
+            if new_cursor is not None:
+                cursor_kinds.add(cursor_kind(new_cursor))
+            if backfill.get('cursor_ok') is False:
+                cursor_kinds.add(None)
+            if backfill.get('after'):
+                print(f"↩️ Reanudando la carga de {progress_key} después de {backfill['after']}")
+            docs = read_documents(collection_ref, collection_name, after=backfill.get('after'))
+        
+        perf_counter = time.perf_counter
+        started = perf_counter()
+        waited = 0.0
+        batches = batched(docs, SHEETS_WRITE_CHUNK)
+        
+        # La lectura de Firestore no depende de otras colecciones; la proyección sí.
+        # Se adelanta solo el primer bloque mientras se espera a las dependencias.
+        if wait_for:
+            first = list(islice(batches, 1))
+            wait_started = perf_counter()
+            wait_for()
+            waited = perf_counter() - wait_started
+            metrics.observe('sync_stage_seconds', waited, collection=collection_name, stage='wait')
+            batches = chain(first, batches)
+        
+        project = PROJECTORS[collection_name]
+        index_doc = SHEET_SCHEMAS[collection_name].get('index_doc')
+        index_prune = SHEET_SCHEMAS[collection_name].get('index_prune')
+        # Solo una lectura desde el principio ve todos los documentos existentes
+        seen_ids = set() if index_prune and streamed and cursor is None and not (backfill or {}).get('after') else None
+        sinks = collection_sinks(collection_name, worksheet, next_row)
+        sheets = sinks[0]
+        scanned = 0
+        transform = 0.0
+        
+        for batch in batches:
+            transform_started = perf_counter()
+            scanned += len(batch)
+            rows = []
+            seen = [] if trace_recorder else None
+            for doc in batch:
+                data = doc.to_dict()
+                if seen is not None:
+                    seen.append([doc.id, data])
+                value = data.get(CURSOR_FIELD)
+                cursor_kinds.add(cursor_kind(value))
+                new_cursor = max_cursor(new_cursor, value)
+                if index_doc:
+                    index_doc(doc.id, data)
+                if seen_ids is not None:
+                    seen_ids.add(doc.id)
+                rows.append(project(doc.id, data))
+            if seen is not None:
+                record_trace('docs', collection=collection_name, docs=seen)
+            # Las mismas filas para todos los sinks
+            for sink in sinks:
+                sink.add(rows)
+            transform += perf_counter() - transform_started
+            
+            # Bloque completo: escribirlo y, si era el de Sheets (que pasa por la
+            # cola de salida), guardar hasta dónde se leyó
+            block_done = sheets.ready()
+            for sink in sinks:
+                if sink.ready():
+                    sink.flush()
+            if block_done:
+                cursor_ok = cursor_consistent(cursor_kinds)
+                if reconcile:
+                    pass  # El cursor se guarda al terminar el recorrido completo
+                elif backfill is not None:
+                    commit_progress(progress_key, backfill={'after': batch[-1].id, 'cursor_ok': cursor_ok,
+                                                            'cursor': encode_cursor(new_cursor) if cursor_ok else None},
+                                    persist=True)
+                elif streamed and cursor_ok:
+                    commit_progress(progress_key, cursor=new_cursor, persist=True)
+        
+        written = 0.0
+        for sink in sinks:
+            sink.flush()
+            sink.close()
+            written += sink.seconds
+        if seen_ids is not None:
+            index_prune(seen_ids)
+        
+        # Lo que no fue transformación, escritura ni espera es tiempo de lectura de Firestore
+        metrics.observe('sync_stage_seconds', perf_counter() - started - waited - transform - written,
+                        collection=collection_name, stage='firestore')
+        metrics.observe('sync_stage_seconds', transform, collection=collection_name, stage='transform')
+        metrics.inc('docs_scanned_total', scanned, collection=collection_name)
+        if sheets.new_count or sheets.updated_count:
+            metrics.observe('sync_stage_seconds', sheets.seconds, collection=collection_name, stage=sheets.stage)
+        for sink in sinks[1:]:
+            metrics.observe('sync_stage_seconds', sink.seconds, collection=collection_name, stage=sink.stage)
+        
+        # Avanzar el cursor una vez encoladas las filas (y cerrar la carga completa).
+        # Si algún valor no sirve como cursor, se descarta y el próximo ciclo lee todo.
+        if cursor_consistent(cursor_kinds):
+            commit_progress(progress_key, cursor=new_cursor, backfill=None if backfill is not None else False)
+        else:
+            warn_cursor(progress_key)
+            drop_cursor(progress_key)
+            commit_progress(progress_key, backfill=None if backfill is not None else False)
+        if any(sink.error for sink in sinks):
+            metrics.inc('sync_errors_total', collection=collection_name)
+        else:
+            metrics.set('last_success_timestamp_seconds', time.time(), collection=collection_name)
+        return sheets.new_count
             
     except Exception as e:
         print(f"❌ Error en {collection_name}: {str(e)}")
+        metrics.inc('sync_errors_total', collection=collection_name)
+        invalidate_worksheet(worksheet.spreadsheet, worksheet.title)
+        mark_index_stale(worksheet)
         import traceback
         traceback.print_exc()
         return 0
 
-# Sincronizar todos los datos
-def sync_data():
-    print(f"\n🔄 Sincronización: {datetime.now().strftime('%H:%M:%S')}")
+# Un candado por hoja y destino: el sondeo y el listener no escriben a la vez en la misma hoja
+sheet_locks = {(target_name, name): threading.Lock() for target_name in SYNC_TARGETS for name in SHEET_SCHEMAS}
+
+# Sincronizar una hoja (se ejecuta en el pool de hilos de sync_data o desde el listener)
+def sync_sheet(collection_name, spreadsheet, reconcile=False, finished=None, docs=None, target=None):
+    target = target or current_target()
+    schema = SHEET_SCHEMAS[collection_name]
+    title = sheet_title(target, collection_name)
+    started = time.perf_counter()
+    with using_target(target):
+        try:
+            with sheet_locks[(target['name'], collection_name)]:
+                return sync_sheet_locked(collection_name, schema, title, spreadsheet, reconcile, finished, docs)
+        except Exception as e:
+            print(f"❌ Error con hoja {target_scoped(collection_name)}: {str(e)}")
+            metrics.inc('sync_errors_total', collection=collection_name)
+            invalidate_worksheet(spreadsheet, title)
+            return 0
+        finally:
+            metrics.observe('sync_stage_seconds', time.perf_counter() - started,
+                            collection=collection_name, stage='total')
+            # Aunque falle, no bloquear a las colecciones que dependen de esta
+            if finished:
+                finished[collection_name].set()
+
+def sync_sheet_locked(collection_name, schema, title, spreadsheet, reconcile, finished, docs):
+    # Obtener la hoja (desde la caché de hojas)
+    worksheet = get_worksheet(spreadsheet, title)
+    if worksheet is None:
+        print(f"⚠️ Hoja {target_scoped(collection_name)} no encontrada, saltando...")
+        return 0
     
-    # Limpiar el diccionario de alcohol al inicio de cada sincronización
-    global tanques_alcohol
-    tanques_alcohol = {}
+    start_row = start_row_for(collection_name)
+    if reconcile:
+        retry_parked_rows(worksheet)
     
-    sheets_client = setup_sheets()
-    if not sheets_client:
-        print("❌ No se puede sincronizar - Conexión fallida")
-        return
+    # Siguiente fila libre desde el índice local (los IDs se consultan por bloques)
+    index_started = time.perf_counter()
+    next_row = load_sheet_index(worksheet, start_row, force=reconcile, collection_name=collection_name)
+    metrics.observe('sync_stage_seconds', time.perf_counter() - index_started,
+                    collection=collection_name, stage='index')
+    record_trace('sheet', collection=collection_name, title=title, next_row=next_row)
+    
+    # Esperar a las colecciones de las que depende (p. ej. fermentación -> tanque_presion)
+    dependencies = [name for name in schema.get('depends_on', []) if finished and name in finished]
+    def wait_for():
+        for dependency in dependencies:
+            finished[dependency].wait()
     
+    # Sincronizar esta colección
+    new_count = sync_collection(collection_name, worksheet, reconcile, next_row,
+                                wait_for if dependencies else None, docs)
+    
+    if new_count > 0:
+        key = target_scoped(collection_name)
+        print(f"✅ {new_count} nuevos registros en {key} ({api_calls.get(key, 0)} llamadas a Sheets)")
+    return new_count
+
+# Pool de hilos compartido por todos los destinos y ciclos. Cada hilo libre toma
+# la siguiente tarea del destino con menos tareas en curso (con turno rotativo
+# entre empates), así un destino grande no deja sin hilos a los pequeños. Una
+# tarea solo se inicia cuando las colecciones de su destino de las que depende
+# ya empezaron, de modo que esperarlas no puede bloquear el pool.
+class FairPool:
+    def __init__(self, workers=SYNC_WORKERS):
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.queues = {}  # grupo -> [(clave, función, dependencias, future)]
+        self.running = {}  # grupo -> tareas en curso
+        self.turn = 0
+        self.threads = []
+    
+    def submit(self, group, key, fn, depends_on=()):
+        future = Future()
+        with self.cond:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, daemon=True, name=f'sync-worker-{len(self.threads)}')
+                self.threads.append(thread)
+                thread.start()
+            self.queues.setdefault(group, []).append((key, fn, tuple(depends_on), future))
+            self.cond.notify()
+        return future
+    
+    def next_task(self):
+        groups = [group for group, queue in self.queues.items() if queue]
+        order = sorted(range(len(groups)),
+                       key=lambda i: (self.running.get(groups[i], 0), (i - self.turn) % len(groups)))
+        for i in order:
+            queue = self.queues[groups[i]]
+            queued = {task[0] for task in queue}
+            for position, task in enumerate(queue):
+                if not queued.intersection(task[2]):
+                    del queue[position]
+                    self.turn = i + 1
+                    return groups[i], task
+        return None
+    
+    def work(self):
+        while True:
+            with self.cond:
+                picked = self.next_task()
+                while picked is None:
+                    self.cond.wait()
+                    picked = self.next_task()
+                group, (_, fn, _, future) = picked
+                self.running[group] = self.running.get(group, 0) + 1
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn())
+                except BaseException as e:
+                    future.set_exception(e)
+            with self.cond:
+                self.running[group] -= 1
+                self.cond.notify_all()
+
+sync_pool = FairPool()
+
+# Grabación opcional de ciclos para reproducirlos sin red (benchmarks/replay_trace.py).
+# Con SYNC_TRACE_DIR, cada sync_data escribe un JSONL comprimido con lo que vio:
+#   cycle  configuración, checkpoint y lecturas de alcohol por tanque al empezar
+#   sheet  hoja abierta por colección y su siguiente fila libre
+#   docs   documentos leídos de Firestore, por bloque
+#   index  filas y hashes del índice local consultados para ese bloque
+# Las fechas de Firestore se guardan como en el checkpoint ({'datetime': ...}).
+SYNC_TRACE_DIR = os.environ.get('SYNC_TRACE_DIR', '')  # Vacío: sin grabación
+SYNC_TRACE_KEEP = int(os.environ.get('SYNC_TRACE_KEEP', 20))  # Grabaciones que se conservan
+trace_recorder = None
+
+def trace_value(value):
+    return encode_cursor(value) if isinstance(value, datetime) else str(value)
+
+class TraceRecorder:
+    def __init__(self, directory, reconcile):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl.gz")
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.directory = directory
+        with checkpoint_lock:
+            saved = json.loads(json.dumps(checkpoint, default=str))
+        with state_lock:
+            tanks = get_state_db().execute(
+                'SELECT doc_id, tank, fecha_orden, fecha, alcohol, cocimiento FROM tank_alcohol').fetchall()
+        targets = [{key: target[key] for key in ('name', 'spreadsheet', 'collections', 'sheets')}
+                   for target in SYNC_TARGETS.values()]
+        self.write('cycle', reconcile=reconcile, started=time.time(), sync_mode=SYNC_MODE,
+                   cursor_field=CURSOR_FIELD, targets=targets, checkpoint=saved, tank_alcohol=tanks)
+    
+    def write(self, kind, **fields):
+        line = json.dumps({'type': kind, 'target': current_target()['name'], **fields},
+                          default=trace_value, ensure_ascii=False)
+        with self.lock:
+            if self.file:
+                self.file.write(line + '\n')
+    
+    def close(self):
+        try:
+            with self.lock:
+                self.file.close()
+                self.file = None
+            # Conservar solo las últimas SYNC_TRACE_KEEP grabaciones
+            traces = sorted(name for name in os.listdir(self.directory) if name.startswith('trace-'))
+            for name in traces[:-SYNC_TRACE_KEEP]:
+                os.remove(os.path.join(self.directory, name))
+            print(f"🎞️ Ciclo grabado en {self.path}")
+        except Exception as e:
+            print(f"⚠️ No se pudo cerrar la grabación {self.path}: {str(e)}")
+
+# Una grabación que no se puede abrir no detiene la sincronización
+def start_trace(reconcile):
     try:
-        # Abrir la hoja de cálculo
-        spreadsheet = sheets_client.open("CCB Registros Proceso")
+        return TraceRecorder(SYNC_TRACE_DIR, reconcile)
+    except Exception as e:
+        print(f"⚠️ No se pudo iniciar la grabación del ciclo: {str(e)}")
+        return None
+
+def record_trace(kind, **fields):
+    recorder = trace_recorder
+    if recorder:
+        recorder.write(kind, **fields)
+
+# Sincronizar todos los datos de todos los destinos
+def sync_data(reconcile=False):
+    modo = 'reconciliación completa' if reconcile else SYNC_MODE
+    print(f"\n🔄 Sincronización ({modo}): {datetime.now().strftime('%H:%M:%S')}")
+    
+    api_calls.clear()
+    started = time.perf_counter()
+    
+    global trace_recorder
+    try:
+        if SYNC_TRACE_DIR:
+            trace_recorder = start_trace(reconcile)
+        futures = []
+        for target in SYNC_TARGETS.values():
+            # Abrir la hoja de cálculo (cliente y documento reutilizados entre ciclos)
+            spreadsheet = open_target_spreadsheet(target)
+            if not spreadsheet:
+                print(f"❌ No se puede sincronizar {target['spreadsheet']} - Conexión fallida")
+                continue
+            
+            # Colecciones del destino en el pool compartido; se encolan en el orden
+            # del esquema y las dependientes esperan a que empiecen sus dependencias
+            finished = {name: threading.Event() for name in target['collections']}
+            for name in target['collections']:
+                depends_on = [dependency for dependency in SHEET_SCHEMAS[name].get('depends_on', []) if dependency in finished]
+                futures.append(sync_pool.submit(
+                    target['name'], name,
+                    functools.partial(sync_sheet, name, spreadsheet, reconcile, finished, target=target),
+                    depends_on))
         
-        # Nombres de las hojas - PROCESAR FERMENTACIÓN PRIMERO
-        collections = [
-            'fermentacion',  # Primero fermentación para llenar el diccionario
-            'cocimiento',
-            'tanque_presion',
-            'envasado',
-            'producto_terminado'
-        ]
+        if not futures:
+            return 0
         
         total_new = 0
-        
-        for collection_name in collections:
-            try:
-                # Obtener la hoja
-                try:
-                    worksheet = spreadsheet.worksheet(collection_name.capitalize())
-                except:
-                    print(f"⚠️ Hoja {collection_name} no encontrada, saltando...")
-                    continue
-                
-                # Obtener IDs existentes (columna A)
-                existing_data = worksheet.get_all_values()
-                existing_ids = set()
-                
-                # Determinar la fila de inicio según la colección
-                if collection_name == 'cocimiento' or collection_name == 'fermentacion' or collection_name == 'envasado':
-                    start_idx = 5  # Saltar hasta la fila 5 (las primeras 5 filas son encabezados)
-                else:  # tanque_presion y producto_terminado
-                    start_idx = 4  # Saltar hasta la fila 4 (las primeras 4 filas son encabezados)
-                
-                if len(existing_data) > start_idx:
-                    for row in existing_data[start_idx:]:
-                        if row and row[0]:  # Columna A tiene el ID
-                            existing_ids.add(row[0])
-                
-                # Sincronizar esta colección
-                new_count = sync_collection(collection_name, worksheet, existing_ids)
-                total_new += new_count
-                
-                if new_count > 0:
-                    print(f"✅ {new_count} nuevos registros en {collection_name}")
-                    
-            except Exception as e:
-                print(f"❌ Error con hoja {collection_name}: {str(e)}")
-                continue
+        for future in as_completed(futures):
+            total_new += future.result()
         
         print(f"📊 Total de nuevos registros: {total_new}")
+        print(f"📡 Llamadas a la API de Sheets: {sum(api_calls.values())}")
+        save_checkpoint()
+        metrics.observe('sync_cycle_seconds', time.perf_counter() - started)
+        metrics.set('last_success_timestamp_seconds', time.time(), collection='all')
+        return total_new
             
     except Exception as e:
         print(f"❌ Error general: {str(e)}")
+        invalidate_sheets_cache()
+        return 0
+    finally:
+        recorder, trace_recorder = trace_recorder, None
+        if recorder:
+            recorder.close()
 
-# Configuración inicial
-print("🚀 Iniciando aplicación de sincronización...")
-setup_environment()
+# Modo en tiempo real: listeners on_snapshot de Firestore con escrituras agrupadas.
+# El sondeo cada 5 minutos sigue activo como respaldo y reconciliación.
+SYNC_TRIGGER = os.environ.get('SYNC_TRIGGER', 'poll')  # 'poll' o 'listen'
+LISTENER_DEBOUNCE_SECONDS = float(os.environ.get('LISTENER_DEBOUNCE_SECONDS', 2))
+LISTENER_MAX_DELAY_SECONDS = float(os.environ.get('LISTENER_MAX_DELAY_SECONDS', 5))
 
-# Programar ejecuciones - Keep-alive más frecuente
-schedule.every(5).minutes.do(sync_data)
-schedule.every(5).minutes.do(keep_alive)  # ⬅️ Cada 5 minutos en lugar de 10
+# Buffer de documentos añadidos o editados: se vacía tras `debounce` segundos sin cambios
+# nuevos, o como mucho `max_delay` segundos después del primero pendiente
+class SnapshotBuffer:
+    def __init__(self, flush, debounce=LISTENER_DEBOUNCE_SECONDS, max_delay=LISTENER_MAX_DELAY_SECONDS):
+        self.flush = flush
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.pending = {}  # (destino, colección) -> {doc.id: documento}
+        self.first_at = None
+        self.last_at = None
+        self.cond = threading.Condition()
+    
+    def add(self, key, doc):
+        with self.cond:
+            now = time.monotonic()
+            if not self.pending:
+                self.first_at = now
+            self.last_at = now
+            self.pending.setdefault(key, {})[doc.id] = doc
+            self.cond.notify()
+    
+    # Espera hasta que toque vaciar y devuelve el lote pendiente
+    def take(self):
+        with self.cond:
+            while True:
+                if not self.pending:
+                    self.cond.wait()
+                    continue
+                now = time.monotonic()
+                due = min(self.last_at + self.debounce, self.first_at + self.max_delay)
+                if now >= due:
+                    batch, self.pending = self.pending, {}
+                    return batch
+                self.cond.wait(due - now)
+    
+    def run(self):
+        while True:
+            batch = self.take()
+            try:
+                self.flush(batch)
+            except Exception as e:
+                # Lo no escrito lo recupera el siguiente sondeo
+                print(f"❌ Error vaciando el buffer del listener: {str(e)}")
 
-# Primera ejecución
-print("⏰ Primera sincronización...")
-sync_data()
-print(f"📊 Diccionario actual: {list(tanques_alcohol.keys())}")            
-print("🔔 Primer keep-alive...")
-keep_alive()
-print("✅ Aplicación en ejecución. Sincronizando cada 5 minutos + Keep-alive cada 5 minutos...")
+# Escribir un lote del listener en orden del esquema (fermentación antes que
+# tanque_presion). Si algo no se pudo escribir, se adelanta el próximo sondeo
+# para recuperarlo (filas en la cola de salida o documentos sin leer).
+def flush_snapshot_batch(batch):
+    total_new = 0
+    errors_before = metrics.total('sync_errors_total')
+    unavailable = False
+    failed = True  # Hasta terminar sin excepciones
+    try:
+        for target in SYNC_TARGETS.values():
+            if not any((target['name'], name) in batch for name in target['collections']):
+                continue
+            spreadsheet = open_target_spreadsheet(target)
+            if not spreadsheet:
+                print(f"❌ Listener: no se puede escribir en {target['spreadsheet']} - Conexión fallida")
+                unavailable = True
+                continue
+            for collection_name in target['collections']:
+                docs = batch.get((target['name'], collection_name))
+                if docs:
+                    total_new += sync_sheet(collection_name, spreadsheet, docs=list(docs.values()), target=target)
+        failed = unavailable or metrics.total('sync_errors_total') > errors_before
+    finally:
+        if failed and sync_scheduler.trigger():
+            print("🔁 Listener: lote incompleto, se adelanta el próximo ciclo de sincronización")
+    if total_new:
+        print(f"⚡ Listener: {total_new} nuevos registros")
+    save_checkpoint()
+    return total_new
+
+# Suscripción real a Firestore; devuelve el watch (con .unsubscribe()).
+# Solo escucha desde el cursor guardado para no recibir todo el histórico.
+def firestore_subscribe(collection_name, callback):
+    db = get_firestore_client()
+    if not db:
+        return None
+    query = db.collection(collection_name)
+    cursor = decode_cursor(checkpoint['cursors'].get(target_scoped(collection_name)))
+    if SYNC_MODE == 'incremental' and cursor_kind(cursor) is not None:
+        query = query.order_by(CURSOR_FIELD).start_at({CURSOR_FIELD: cursor})
+    return query.on_snapshot(callback)
+
+listener_watches = {}
+
+# Iniciar listeners en todas las colecciones de todos los destinos.
+# `subscribe(colección, callback)` se llama con el destino en curso y se puede
+# sustituir por una fuente falsa que llame a callback(docs, changes, read_time)
+# con cambios de tipo ADDED, MODIFIED o REMOVED.
+def start_listeners(subscribe=firestore_subscribe, buffer=None):
+    buffer = buffer or SnapshotBuffer(flush_snapshot_batch)
+    threading.Thread(target=buffer.run, daemon=True).start()
+    
+    for target in SYNC_TARGETS.values():
+        for collection_name in target['collections']:
+            key = (target['name'], collection_name)
+            index_forget = SHEET_SCHEMAS[collection_name].get('index_forget')
+            def on_snapshot(docs, changes, read_time, key=key, target=target, index_forget=index_forget):
+                for change in changes:
+                    if change.type.name in ('ADDED', 'MODIFIED'):
+                        buffer.add(key, change.document)
+                    elif change.type.name == 'REMOVED' and index_forget:
+                        with using_target(target):
+                            index_forget(change.document.id)
+            
+            label = target_scoped(collection_name, target)
+            try:
+                with using_target(target):
+                    watch = subscribe(collection_name, on_snapshot)
+                if watch:
+                    listener_watches[key] = watch
+                    print(f"👂 Listener activo en {label}")
+            except Exception as e:
+                print(f"⚠️ No se pudo iniciar el listener de {label}: {str(e)}")
+    return buffer
+
+def stop_listeners():
+    for key, watch in list(listener_watches.items()):
+        watch.unsubscribe()
+        del listener_watches[key]
+
+# Planificador propio de la sincronización: un solo hilo, sin ciclos solapados.
+# Acorta el intervalo mientras llegan documentos nuevos, lo alarga en reposo y,
+# ante errores de cuota (429), espera de forma exponencial con jitter.
+SYNC_INTERVAL_SECONDS = float(os.environ.get('SYNC_INTERVAL_SECONDS', 300))
+SYNC_MIN_INTERVAL_SECONDS = float(os.environ.get('SYNC_MIN_INTERVAL_SECONDS', 30))
+SYNC_MAX_INTERVAL_SECONDS = float(os.environ.get('SYNC_MAX_INTERVAL_SECONDS', 900))
+SYNC_MAX_BACKOFF_SECONDS = float(os.environ.get('SYNC_MAX_BACKOFF_SECONDS', 1800))
+
+class SyncScheduler:
+    def __init__(self, sync=None, interval=SYNC_INTERVAL_SECONDS, min_interval=SYNC_MIN_INTERVAL_SECONDS,
+                 max_interval=SYNC_MAX_INTERVAL_SECONDS, max_backoff=SYNC_MAX_BACKOFF_SECONDS,
+                 reconcile_every=RECONCILE_MINUTES * 60):
+        self.sync = sync or sync_data
+        self.base_interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_backoff = max_backoff
+        self.reconcile_every = reconcile_every
+        self.interval = interval
+        self.quota_failures = 0
+        self.next_run = time.time()
+        self.last_started = None
+        self.last_duration = None
+        self.last_new_docs = None
+        self.last_reconcile = time.time()
+        self.running = False
+        self.cycles = 0
+        self.lock = threading.Lock()  # Garantiza que nunca haya dos ciclos a la vez
+        self.wake = threading.Event()
+        self.thread = None
+    
+    # Ejecutar un ciclo ahora (bloquea si ya hay uno en curso) y planificar el siguiente
+    def run_cycle(self, reconcile=None):
+        with self.lock:
+            if reconcile is None:
+                reconcile = time.time() - self.last_reconcile >= self.reconcile_every
+            quota_before = metrics.total('sheets_errors_total', status='429')
+            self.running = True
+            self.last_started = time.time()
+            try:
+                new_docs = self.sync(reconcile=reconcile) or 0
+            except Exception as e:
+                print(f"❌ Error en el ciclo de sincronización: {str(e)}")
+                new_docs = 0
+            finally:
+                self.running = False
+                self.last_duration = time.time() - self.last_started
+                self.cycles += 1
+            if reconcile:
+                self.last_reconcile = self.last_started
+            self.last_new_docs = new_docs
+            quota_errors = metrics.total('sheets_errors_total', status='429') - quota_before
+            self.schedule_next(new_docs, quota_errors)
+            return new_docs
+    
+    def schedule_next(self, new_docs, quota_errors):
+        if quota_errors:
+            # Espera exponencial con jitter ("full jitter" sobre la mitad superior)
+            self.quota_failures += 1
+            backoff = min(self.max_backoff, self.base_interval * 2 ** (self.quota_failures - 1))
+            delay = random.uniform(backoff / 2, backoff)
+            print(f"⏳ Cuota de Sheets agotada: próximo ciclo en {delay:.0f}s")
+        else:
+            self.quota_failures = 0
+            if new_docs:
+                # Hay movimiento: volver antes para vaciar el atraso
+                self.interval = max(self.min_interval, self.interval / 2)
+            else:
+                # En reposo: espaciar los ciclos
+                self.interval = min(self.max_interval, self.interval * 1.5)
+            delay = self.interval
+        self.next_run = time.time() + delay
+    
+    # Adelantar el próximo ciclo (lo usa el listener cuando no pudo escribir un
+    # lote). No adelanta mientras se espera por cuota de Sheets.
+    def trigger(self):
+        if self.quota_failures:
+            return False
+        self.next_run = time.time()
+        self.wake.set()
+        return True
+    
+    def loop(self):
+        while True:
+            wait = self.next_run - time.time()
+            if wait > 0:
+                self.wake.wait(wait)
+                self.wake.clear()
+                continue
+            self.run_cycle()
+    
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop, daemon=True, name='sync-scheduler')
+            self.thread.start()
+        return self
+    
+    def status(self):
+        def iso(timestamp):
+            return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+        return {
+            "running": self.running,
+            "cycles": self.cycles,
+            "next_run": iso(self.next_run),
+            "seconds_to_next_run": max(0, round(self.next_run - time.time(), 1)),
+            "interval_seconds": round(self.interval, 1),
+            "last_started": iso(self.last_started),
+            "last_duration_seconds": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "last_new_docs": self.last_new_docs,
+            "backlog": bool(self.last_new_docs),
+            "quota_backoff": self.quota_failures > 0,
+            "quota_failures": self.quota_failures,
+            "last_reconcile": iso(self.last_reconcile)
+        }
+
+sync_scheduler = SyncScheduler()
+
+# Arranque rápido: se abre el puerto primero y la primera sincronización corre
+# en segundo plano, para que /health responda dentro del plazo de la plataforma.
+# Con 'blocking' se sincroniza antes de abrir el puerto (comportamiento anterior).
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'fast')  # 'fast' o 'blocking'
+STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', 5))
+startup = {'state': 'starting', 'port_seconds': None, 'first_sync_seconds': None}
+
+def record_startup(phase):
+    elapsed = time.time() - PROCESS_STARTED
+    startup[f'{phase}_seconds'] = round(elapsed, 3)
+    metrics.set('startup_seconds', elapsed, phase=phase)
+    return elapsed
+
+# Configuración inicial (solo al ejecutar el servicio, no al importar el módulo)
+def start():
+    print("🚀 Iniciando aplicación de sincronización...")
+    setup_environment()
+    load_checkpoint()
+    
+    # Keep-alive con schedule; la sincronización tiene su propio planificador
+    schedule.every(5).minutes.do(keep_alive)  # ⬅️ Cada 5 minutos en lugar de 10
+    
+    if STARTUP_MODE == 'blocking':
+        first_sync()
+    else:
+        threading.Thread(target=first_sync, daemon=True, name='first-sync').start()
+
+# Primera sincronización, planificador, listeners y primer keep-alive
+def first_sync():
+    # Primera ejecución (y planificación del siguiente ciclo)
+    print("⏰ Primera sincronización...")
+    sync_scheduler.run_cycle(reconcile=False)
+    sync_scheduler.start()
+    startup['state'] = 'ready'
+    print(f"⏱️ Primera sincronización lista a los {record_startup('first_sync'):.1f}s del arranque")
+    
+    # Modo en tiempo real (el sondeo anterior queda como respaldo)
+    if SYNC_TRIGGER == 'listen':
+        start_listeners()
+    print(f"📊 Tanques con alcohol: {sorted(get_tank_index().keys())}")
+    print("🔔 Primer keep-alive...")
+    keep_alive()
+    print("✅ Aplicación en ejecución. Sincronización adaptativa (base 5 minutos) + Keep-alive cada 5 minutos...")
 
 # Crear app de Flask
 app = Flask(__name__)
 
 @app.route('/')
 def home():
-    return "✅ Sincronización Firebase-Sheets activa. Funcionando cada 5 minutos."
+    wait = max(0, sync_scheduler.next_run - time.time())
+    return (f"✅ Sincronización Firebase-Sheets activa. Próximo ciclo en {wait:.0f}s "
+            f"(intervalo adaptativo de {sync_scheduler.min_interval:.0f}s a {sync_scheduler.max_interval:.0f}s).")
 
 # ✅ Nuevo endpoint específico para keep-alive
 @app.route('/keep-alive')
 def keep_alive_endpoint():
     return "✅ Keep-alive activo - " + datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+# Responde desde que el puerto está abierto, aunque la primera sincronización siga en curso
 @app.route('/health')
 def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {"status": "healthy", "startup": startup['state'],
+            "uptime_seconds": round(time.time() - PROCESS_STARTED, 3),
+            "timestamp": datetime.now().isoformat()}
 
-# Mantener puerto abierto para Render
-if __name__ == '__main__':
-    def run_scheduler():
-        while True:
-            schedule.run_pending()
-            time.sleep(60)
+# Métricas por colección y etapa en formato Prometheus
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+# Las mismas métricas en JSON, más las llamadas a Sheets del último ciclo
+@app.route('/stats')
+def stats_endpoint():
+    return {"metrics": metrics.stats(), "last_cycle_sheets_calls": dict(api_calls),
+            "scheduler": sync_scheduler.status(), "startup": startup, "outbox": outbox_status(),
+            "timestamp": datetime.now().isoformat()}
+
+# Estado del planificador: próximo ciclo, duración del último, atraso y espera por cuota
+@app.route('/scheduler')
+def scheduler_endpoint():
+    return sync_scheduler.status()
+
+# Lectura local de los segmentos para tableros: ?columns=id,date,gaf&target=planta2
+@app.route('/segments/<collection_name>')
+def segments_endpoint(collection_name):
+    if not SEGMENTS_DIR or collection_name not in SHEET_SCHEMAS:
+        return {"error": "segmentos no disponibles"}, 404
+    target = SYNC_TARGETS.get(request.args.get('target', DEFAULT_TARGET))
+    if target is None:
+        return {"error": "destino desconocido"}, 404
+    columns = [column for column in request.args.get('columns', '').split(',') if column] or None
+    data = read_segments(collection_name, columns, target)
+    return {"rows": len(next(iter(data.values()), [])), "columns": data}
+
+# Solo el keep-alive queda en schedule; ya no comparte hilo con la sincronización
+def run_scheduler():
+    while True:
+        schedule.run_pending()
+        time.sleep(1)
+
+# Arrancar el servicio y mantener el puerto abierto para Render
+def serve():
+    from werkzeug.serving import make_server
+    
+    start()
     
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
     
+    # Igual que app.run, pero separando la apertura del puerto para medirla
     port = int(os.environ.get('PORT', 10000))
-    app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+    server = make_server('0.0.0.0', port, app, threaded=True)
+    elapsed = record_startup('port')
+    print(f"🌐 Puerto {port} abierto a los {elapsed:.2f}s del arranque")
+    if elapsed > STARTUP_BUDGET_SECONDS:
+        print(f"⚠️ Arranque más lento que el presupuesto de {STARTUP_BUDGET_SECONDS:.0f}s")
+    try:
+        server.serve_forever()
+    finally:
+        # Al detener el servicio, cerrar los listeners de Firestore antes que el puerto
+        stop_listeners()
+        server.server_close()
+
+if __name__ == '__main__':
+    serve()
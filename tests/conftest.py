@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+# Antes de importar main: sin límite de cuota y estado local fuera del repositorio
+os.environ.update({
+    'SHEETS_READS_PER_MINUTE': '1000000000',
+    'SHEETS_WRITES_PER_MINUTE': '1000000000',
+    'SYNC_STATE_DB': os.path.join(tempfile.gettempdir(), 'firebase-to-sheets-tests.db'),
+    'SYNC_CHECKPOINT_FILE': os.path.join(tempfile.gettempdir(), 'firebase-to-sheets-tests.json'),
+})
+for name in ('SYNC_TARGETS', 'SYNC_TARGETS_FILE', 'SYNC_SEGMENTS_DIR', 'SYNC_TRACE_DIR'):
+    os.environ.pop(name, None)
+
+import pytest
+
+import main
+
+
+# Estado local, checkpoint, cachés y clientes nuevos en cada prueba
+@pytest.fixture(autouse=True)
+def fresh_state(tmp_path, monkeypatch):
+    if main.state_db is not None:
+        main.state_db.close()
+    monkeypatch.setattr(main, 'state_db', None)
+    monkeypatch.setattr(main, 'STATE_DB_FILE', str(tmp_path / 'sync-state.db'))
+    monkeypatch.setattr(main, 'CHECKPOINT_FILE', str(tmp_path / 'sync-checkpoint.json'))
+    monkeypatch.setattr(main, 'checkpoint', {'cursors': {}, 'backfill': {}})
+    monkeypatch.setattr(main, 'tank_index', None)
+    main.tank_by_doc.clear()
+    main.verified_sheets.clear()
+    main.api_calls.clear()
+    main.listener_watches.clear()
+    with main.clients_lock:
+        main.clients.clear()
+        main.invalidate_sheets_cache()
+    yield
+    if main.state_db is not None:
+        main.state_db.close()
+        main.state_db = None
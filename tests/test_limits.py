@@ -0,0 +1,59 @@
+import threading
+import types
+
+import main
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 1e-6)  # Como el reloj real, siempre avanza
+
+
+def test_token_bucket_never_exceeds_the_quota_in_a_minute(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(main, 'time', types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    bucket = main.TokenBucket(60, burst=5)
+
+    clock.now = 3600  # Mucho tiempo sin llamadas
+    calls = []
+    for _ in range(300):
+        bucket.acquire()
+        calls.append(clock.now)
+
+    for i, started in enumerate(calls):
+        in_window = sum(1 for t in calls[i:] if t < started + 60)
+        assert in_window <= 60
+    assert calls[:5] == [3600] * 5  # Ráfaga inicial
+
+
+def run_in_pool(pool, tasks):
+    order = []
+    gate = threading.Event()
+    blocker = pool.submit('bloqueo', 'bloqueo', gate.wait)
+    futures = [pool.submit(group, key, lambda key=key: order.append(key), depends_on)
+               for group, key, depends_on in tasks]
+    gate.set()
+    blocker.result(timeout=5)
+    for future in futures:
+        future.result(timeout=5)
+    return order
+
+
+def test_fair_pool_does_not_starve_small_targets():
+    pool = main.FairPool(workers=1)
+    order = run_in_pool(pool, [('grande', f'g{i}', ()) for i in range(4)] + [('chico', 'c0', ())])
+    assert sorted(order) == ['c0', 'g0', 'g1', 'g2', 'g3']
+    assert order.index('c0') <= 1
+
+
+def test_fair_pool_starts_a_task_after_its_dependencies():
+    pool = main.FairPool(workers=1)
+    order = run_in_pool(pool, [('planta', 'tanque_presion', ('fermentacion',)),
+                               ('planta', 'fermentacion', ())])
+    assert order == ['fermentacion', 'tanque_presion']
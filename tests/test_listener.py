@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+import fakes
+import main
+
+EXTRACTO_APARENTE = 'Extrácto aparente [%] p/p (Ej: 2.70)'
+EXTRACTO_ORIGINAL = 'Extrácto original [%] p/p (Ej: 16.0)'
+
+
+def fermentacion(date, tank, ph='4.30'):
+    return {'date': date, 'Tq N°(Ej: 7)': tank, 'pH (Ej: 4.36)': ph,
+            EXTRACTO_APARENTE: '4', EXTRACTO_ORIGINAL: '16'}
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'el listener no vació el buffer a tiempo'
+        time.sleep(0.01)
+
+
+def test_listener_appends_added_diffs_modified_in_schema_order(monkeypatch):
+    db = fakes.FakeFirestore()
+    db.add_document('fermentacion', 'f1', fermentacion('2024-03-01', '2'))
+    spreadsheet = fakes.synthetic_spreadsheet()
+    main.install_clients(db, fakes.FakeSheetsClient(spreadsheet))
+    main.sync_data()
+
+    flushed = []
+    sync_sheet = main.sync_sheet
+
+    def recording_sync_sheet(collection_name, *args, **kwargs):
+        if kwargs.get('docs'):
+            flushed.append((collection_name, sorted(doc.id for doc in kwargs['docs'])))
+        return sync_sheet(collection_name, *args, **kwargs)
+
+    monkeypatch.setattr(main, 'sync_sheet', recording_sync_sheet)
+    buffer = main.SnapshotBuffer(main.flush_snapshot_batch, debounce=0.05, max_delay=1)
+    main.start_listeners(main.firestore_subscribe, buffer)
+    try:
+        wait_until(lambda: flushed)  # Primera instantánea: nada nuevo que escribir
+        flushed.clear()
+        spreadsheet.stats.reset()
+        cells_before = main.metrics.total('cells_updated_total')
+
+        # tanque_presion llega antes, pero depende del alcohol de fermentación
+        db.add_document('tanque_presion', 't1', {'date': '2024-03-02', 'Volumen total [L] (Ej: 6650)': '100',
+                                                 'Tanque A (Ej: 1)': '1',
+                                                 'Volumen total del Tanque A [L] (Ej: 2650)': '100'})
+        db.add_document('fermentacion', 'f2', fermentacion('2024-03-01', '1'))
+        db.update_document('fermentacion', 'f1', fermentacion('2024-03-01', '2', ph='4.55'))
+        wait_until(lambda: len(flushed) == 2)
+    finally:
+        main.stop_listeners()
+
+    assert flushed == [('fermentacion', ['f1', 'f2']), ('tanque_presion', ['t1'])]
+    assert db.listeners == []
+
+    fermentacion_rows = spreadsheet.worksheet('Fermentacion').rows[main.start_row_for('fermentacion') - 1:]
+    assert [row[0] for row in fermentacion_rows] == ['f1', 'f2']
+    assert fermentacion_rows[0][main.col_index('F')] == '4.55'
+
+    # ADDED se añade al final; MODIFIED reescribe solo la celda de pH
+    assert spreadsheet.stats.calls['sheets.batch_update'] == 1
+    assert main.metrics.total('cells_updated_total') - cells_before == 1
+
+    tanque_rows = spreadsheet.worksheet('Tanque_presion').rows[main.start_row_for('tanque_presion') - 1:]
+    alcohol_f2 = fermentacion_rows[1][main.col_index('M')]
+    assert [row[0] for row in tanque_rows] == ['t1']
+    # Mezcla de un solo tanque: (volumen * alcohol / volumen total) * 100, como derivar_tanque_presion
+    assert tanque_rows[0][main.col_index('U')] == pytest.approx(alcohol_f2 * 100)
+
+
+def test_failed_listener_flush_brings_the_next_cycle_forward(monkeypatch):
+    scheduler = main.SyncScheduler(sync=lambda reconcile=False: 0)
+    monkeypatch.setattr(main, 'sync_scheduler', scheduler)
+    monkeypatch.setattr(main, 'get_spreadsheet', lambda target=None: None)
+    batch = {(main.DEFAULT_TARGET, 'fermentacion'): {'f1': fakes.FakeDocument('f1', {'date': '2024-03-01'})}}
+
+    scheduler.next_run = time.time() + 600
+    main.flush_snapshot_batch(batch)
+    assert scheduler.next_run <= time.time()
+
+    # Esperando por cuota de Sheets no se adelanta
+    scheduler.quota_failures = 1
+    scheduler.next_run = time.time() + 600
+    main.flush_snapshot_batch(batch)
+    assert scheduler.next_run > time.time()
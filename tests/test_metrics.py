@@ -0,0 +1,59 @@
+import math
+import random
+
+import numpy as np
+
+import main
+
+METRICAS = ['peso_esp', 'gaf', 'alcohol_peso', 'alcohol_volumen', 'extracto_real']
+EO = 'Extrácto original [%] p/p (Ej: 16.0)'
+EA = 'Extrácto aparente [%] p/p (Ej: 2.70)'
+
+# Casos límite: vacíos, texto, cero, signo, NaN/inf, números ya convertidos
+ESPECIALES = ['', None, 'abc', '0', '0.0', '-0', 0, 0.0, 'nan', 'inf', '-3.5', ' 2.7 ', '2,7', 16, 2.7]
+
+
+def iguales(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return a == b or (math.isnan(a) and math.isnan(b))
+    return type(a) is type(b) and a == b
+
+
+def assert_same_as_scalar(originales, aparentes):
+    lote = main.calcular_metricas_fermentacion_lote(originales, aparentes)
+    for metrica in METRICAS:
+        celdas = main.celdas_metricas(lote[metrica])
+        for eo, ea, obtenido in zip(originales, aparentes, celdas):
+            esperado = main.derivar_fermentacion({EO: eo, EA: ea})[metrica]
+            assert iguales(esperado, obtenido), (metrica, eo, ea, esperado, obtenido)
+
+
+def test_batch_matches_scalar_on_edge_value_grid():
+    pares = [(eo, ea) for eo in ESPECIALES for ea in ESPECIALES]
+    assert_same_as_scalar([eo for eo, _ in pares], [ea for _, ea in pares])
+
+
+def test_batch_matches_scalar_with_blanks():
+    rng = random.Random(7)
+    originales = [f'{rng.uniform(8, 20):.2f}' for _ in range(2000)]
+    aparentes = ['' if rng.random() < 0.05 else f'{rng.uniform(0.5, 6):.2f}' for _ in range(2000)]
+    assert_same_as_scalar(originales, aparentes)
+
+
+def test_batch_matches_scalar_on_numeric_arrays():
+    rng = random.Random(3)
+    originales = np.array([rng.uniform(8, 20) for _ in range(500)])
+    aparentes = np.array([rng.uniform(0.5, 6) for _ in range(500)])
+    lote = main.calcular_metricas_fermentacion_lote(originales, aparentes)
+    for metrica in METRICAS:
+        celdas = main.celdas_metricas(lote[metrica])
+        for eo, ea, obtenido in zip(originales, aparentes, celdas):
+            esperado = main.derivar_fermentacion({EO: float(eo), EA: float(ea)})[metrica]
+            assert iguales(esperado, obtenido), (metrica, eo, ea, esperado, obtenido)
+
+
+def test_blank_values_are_converted_in_bulk():
+    numeros, presentes = main.columna_numerica(['4.5', '', None, '2'])
+    assert presentes.tolist() == [True, False, False, True]
+    assert numeros[0] == 4.5 and numeros[3] == 2.0
+    assert np.isnan(numeros[1]) and np.isnan(numeros[2])
@@ -0,0 +1,65 @@
+import fakes
+import main
+
+
+def install(db):
+    spreadsheet = fakes.synthetic_spreadsheet()
+    main.install_clients(db, fakes.FakeSheetsClient(spreadsheet))
+    return spreadsheet.worksheet('Cocimiento')
+
+
+def reject_writes(monkeypatch, worksheet, rejected):
+    update = worksheet.update
+
+    def failing_update(range_name, values=None, **kwargs):
+        if rejected(values):
+            raise RuntimeError('Sheets rechazó el bloque')
+        return update(range_name, values, **kwargs)
+
+    monkeypatch.setattr(worksheet, 'update', failing_update)
+
+
+def test_failed_write_is_resent_from_the_outbox_without_reading_firestore(monkeypatch):
+    monkeypatch.setattr(main, 'OUTBOX_RETRIES', 0)
+    db = fakes.FakeFirestore()
+    for i in range(5):
+        db.add_document('cocimiento', f'c{i}', {'date': f'2024-03-0{i + 1}'})
+    worksheet = install(db)
+    failures = []
+    reject_writes(monkeypatch, worksheet, lambda values: not failures and not failures.append(values))
+
+    assert main.sync_data() == 0
+    assert main.outbox_pending(worksheet) == 5
+
+    db.stats.reset()
+    assert main.sync_data() == 5
+    # Solo se relee el último documento (el cursor es inclusivo)
+    assert db.stats.calls['firestore.cocimiento.read'] <= 1
+    start_row = main.start_row_for('cocimiento')
+    assert [row[0] for row in worksheet.rows[start_row - 1:]] == [f'c{i}' for i in range(5)]
+    assert main.outbox_pending(worksheet) == 0
+
+
+def test_row_rejected_every_time_is_parked_and_does_not_block_later_rows(monkeypatch):
+    monkeypatch.setattr(main, 'OUTBOX_RETRIES', 0)
+    monkeypatch.setattr(main, 'OUTBOX_MAX_ATTEMPTS', 2)
+    db = fakes.FakeFirestore()
+    db.add_document('cocimiento', 'malo', {'date': '2024-03-01'})
+    worksheet = install(db)
+    reject_writes(monkeypatch, worksheet, lambda values: any(row[0] == 'malo' for row in values))
+
+    main.sync_data()
+    main.sync_data()
+    assert main.outbox_parked(worksheet) == 1
+    [status] = [entry for entry in main.outbox_status() if entry['parked']]
+    assert 'rechazó' in status['last_error']
+
+    db.add_document('cocimiento', 'bueno', {'date': '2024-03-02'})
+    assert main.sync_data() == 1
+    start_row = main.start_row_for('cocimiento')
+    assert [row[0] for row in worksheet.rows[start_row - 1:]] == ['bueno']
+
+    # La reconciliación vuelve a intentarlo
+    main.sync_data(reconcile=True)
+    assert main.outbox_parked(worksheet) == 0
+    assert main.outbox_pending(worksheet) == 1
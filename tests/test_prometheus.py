@@ -0,0 +1,13 @@
+import main
+
+
+def test_label_values_are_escaped():
+    metrics = main.Metrics()
+    metrics.inc('docs_written_total', 3, collection='cocimiento', target='planta "2"\\norte\nsur')
+    metrics.observe('sync_stage_seconds', 0.2, collection='cocimiento', target='a"b')
+
+    text = metrics.prometheus()
+    assert 'docs_written_total{collection="cocimiento",target="planta \\"2\\"\\\\norte\\nsur"} 3' in text
+    assert 'sync_stage_seconds_count{collection="cocimiento",target="a\\"b"} 1' in text
+    # Cada serie en una sola línea
+    assert all(line.startswith(('#', 'docs_', 'sync_')) for line in text.splitlines())
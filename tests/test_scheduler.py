@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import main
+
+
+def scheduler(sync, **kwargs):
+    options = dict(interval=100, min_interval=10, max_interval=400, max_backoff=1000, reconcile_every=10 ** 9)
+    options.update(kwargs)
+    return main.SyncScheduler(sync=sync, **options)
+
+
+def quota_exhausted(reconcile=False):
+    main.metrics.inc('sheets_errors_total', collection='cocimiento', status='429')
+    return 0
+
+
+def test_interval_halves_while_there_are_new_documents():
+    runner = scheduler(lambda reconcile=False: 5)
+    intervals = []
+    for _ in range(5):
+        runner.run_cycle()
+        intervals.append(runner.interval)
+    assert intervals == [50, 25, 12.5, 10, 10]
+    assert runner.next_run == pytest.approx(time.time() + 10, abs=1)
+
+
+def test_interval_grows_when_idle():
+    runner = scheduler(lambda reconcile=False: 0)
+    intervals = []
+    for _ in range(5):
+        runner.run_cycle()
+        intervals.append(runner.interval)
+    assert intervals == [150, 225, 337.5, 400, 400]
+
+
+def test_quota_errors_back_off_exponentially_and_block_triggers():
+    runner = scheduler(quota_exhausted)
+    for failures, backoff in enumerate([100, 200, 400, 800, 1000, 1000], start=1):
+        started = time.time()
+        runner.run_cycle()
+        assert runner.quota_failures == failures
+        assert backoff / 2 - 1 <= runner.next_run - started <= backoff + 1
+        assert runner.interval == 100  # El intervalo normal no cambia
+    assert runner.trigger() is False
+
+    runner.sync = lambda reconcile=False: 0
+    runner.run_cycle()
+    assert runner.quota_failures == 0
+    assert runner.trigger() is True
+
+
+def test_reconcile_runs_when_due():
+    calls = []
+    runner = scheduler(lambda reconcile=False: calls.append(reconcile) or 0, reconcile_every=0)
+    runner.run_cycle()
+    runner.run_cycle(reconcile=False)
+    assert calls == [True, False]
+
+
+def test_home_reports_the_adaptive_interval(monkeypatch):
+    monkeypatch.setattr(main, 'sync_scheduler', scheduler(lambda reconcile=False: 0))
+    text = main.app.test_client().get('/').get_data(as_text=True)
+    assert 'cada 5 minutos' not in text
+    assert 'de 10s a 400s' in text
@@ -0,0 +1,49 @@
+import main
+
+
+def project(docs):
+    projector = main.PROJECTORS['cocimiento']
+    return [projector(doc_id, data) for doc_id, data in docs]
+
+
+def write(directory, docs):
+    sink = main.SegmentSink('cocimiento', directory=str(directory))
+    sink.add(project(docs))
+    sink.flush()
+    return sink
+
+
+def test_segments_round_trip_through_compaction(tmp_path):
+    write(tmp_path, [(f'c{i}', {'date': f'2024-03-0{i + 1}'}) for i in range(3)])
+    write(tmp_path, [('c1', {'date': '2024-04-01'}), ('c3', {'date': '2024-03-04'})])
+    expected = {'id': ['c0', 'c1', 'c2', 'c3'], 'date': ['2024-03-01', '2024-04-01', '2024-03-03', '2024-03-04']}
+
+    assert main.read_segments('cocimiento', ['id', 'date'], directory=str(tmp_path)) == expected
+    assert main.compact_segments('cocimiento', directory=str(tmp_path)) == 2
+    assert len(main.segment_files(main.segment_dir('cocimiento', directory=str(tmp_path)))) == 1
+    assert main.read_segments('cocimiento', ['id', 'date'], directory=str(tmp_path)) == expected
+
+    # Sin cambios no se escribe un segmento nuevo
+    sink = write(tmp_path, [('c0', {'date': '2024-03-01'})])
+    assert sink.count == 0
+
+
+def test_reader_that_listed_files_before_a_compaction_sees_every_row(tmp_path, monkeypatch):
+    write(tmp_path, [('c0', {'date': '2024-03-01'})])
+    write(tmp_path, [('c1', {'date': '2024-03-02'})])
+    path = main.segment_dir('cocimiento', directory=str(tmp_path))
+    stale = main.segment_files(path)
+    main.compact_segments('cocimiento', directory=str(tmp_path))
+
+    listings = [stale]
+    segment_files = main.segment_files
+    monkeypatch.setattr(main, 'segment_files', lambda path: listings.pop() if listings else segment_files(path))
+    assert main.read_segments('cocimiento', ['id'], directory=str(tmp_path)) == {'id': ['c0', 'c1']}
+
+
+def test_add_looks_up_hashes_in_batches(tmp_path):
+    docs = [(f'c{i:04d}', {'date': '2024-03-01'}) for i in range(1200)]
+    write(tmp_path, docs)
+    sink = main.SegmentSink('cocimiento', directory=str(tmp_path))
+    sink.add(project(docs))
+    assert sink.pending == []
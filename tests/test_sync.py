@@ -0,0 +1,235 @@
+import math
+import random
+
+import fakes
+import main
+
+
+def install(db):
+    spreadsheet = fakes.synthetic_spreadsheet()
+    main.install_clients(db, fakes.FakeSheetsClient(spreadsheet))
+    return spreadsheet
+
+
+def test_new_rows_are_written_in_contiguous_chunks():
+    count = 2 * main.SHEETS_WRITE_CHUNK + 37
+    db = fakes.FakeFirestore()
+    db.collections['cocimiento'] = [fakes.FakeDocument(doc_id, data) for doc_id, data in
+                                    fakes.synthetic_documents('cocimiento', count, random.Random(1))]
+    spreadsheet = install(db)
+
+    assert main.sync_data() == count
+
+    worksheet = spreadsheet.worksheet('Cocimiento')
+    start_row = main.start_row_for('cocimiento')
+    assert [row[0] for row in worksheet.rows[start_row - 1:]] == [doc.id for doc in db.collections['cocimiento']]
+    assert spreadsheet.stats.calls['sheets.update'] == math.ceil(count / main.SHEETS_WRITE_CHUNK)
+
+
+def test_steady_cycle_writes_nothing():
+    db = fakes.synthetic_database(500)
+    spreadsheet = install(db)
+    main.sync_data()
+    spreadsheet.stats.reset()
+
+    assert main.sync_data() == 0
+    assert spreadsheet.stats.total_calls('sheets.update') == 0
+    assert spreadsheet.stats.total_calls('sheets.batch_update') == 0
+
+
+def test_day_first_dates_fall_back_to_full_scan():
+    db = fakes.FakeFirestore()
+    db.add_document('cocimiento', 'a', {'date': '31/10/2026'})
+    install(db)
+    assert main.sync_data() == 1
+    assert 'cocimiento' not in main.checkpoint['cursors']
+
+    # '01/11/2026' < '31/10/2026' como texto: con cursor quedaría fuera
+    db.add_document('cocimiento', 'b', {'date': '01/11/2026'})
+    assert main.sync_data() == 1
+
+
+def test_stale_day_first_cursor_is_discarded():
+    db = fakes.FakeFirestore()
+    db.add_document('cocimiento', 'a', {'date': '01/11/2026'})
+    install(db)
+    main.checkpoint['cursors']['cocimiento'] = '31/10/2026'
+    assert main.sync_data() == 1
+
+
+def test_iso_dates_keep_reading_incrementally():
+    db = fakes.FakeFirestore()
+    for day in range(1, 21):
+        db.add_document('cocimiento', f'doc-{day:02d}', {'date': f'2026-10-{day:02d}'})
+    install(db)
+    main.sync_data()
+    assert main.checkpoint['cursors']['cocimiento'] == '2026-10-20'
+
+    db.add_document('cocimiento', 'doc-21', {'date': '2026-10-21'})
+    db.stats.reset()
+    assert main.sync_data() == 1
+    assert db.stats.calls['firestore.cocimiento.read'] == 2  # Desde el cursor (inclusive)
+
+
+def test_sheets_calls_are_labelled_by_collection_with_custom_titles(monkeypatch):
+    monkeypatch.setitem(main.SYNC_TARGETS[main.DEFAULT_TARGET], 'sheets', {'fermentacion': 'Fermentacion 2025'})
+    db = fakes.synthetic_database(50)
+    spreadsheet = install(db)
+    spreadsheet.worksheet('Fermentacion').title = 'Fermentacion 2025'
+    main.sync_data(reconcile=True)
+
+    labels = {dict(labels).get('collection') for name, labels in main.metrics.values if name == 'sheets_calls_total'}
+    assert 'fermentacion' in labels
+    assert 'fermentacion 2025' not in labels
+
+
+# Lectura de Firestore que se corta después de `limit` documentos
+def interrupt_reads(monkeypatch, limit):
+    read_documents = main.read_documents
+
+    def interrupted(*args, **kwargs):
+        for position, doc in enumerate(read_documents(*args, **kwargs)):
+            if position == limit:
+                raise ConnectionError('corte')
+            yield doc
+
+    monkeypatch.setattr(main, 'read_documents', interrupted)
+    return read_documents
+
+
+def test_interrupted_first_load_resumes_after_last_written_id(monkeypatch):
+    monkeypatch.setattr(main, 'SHEETS_WRITE_CHUNK', 10)
+    db = fakes.FakeFirestore()
+    for i in range(35):
+        db.add_document('cocimiento', f'doc-{i:02d}', {'date': '2026-10-01'})
+    install(db)
+
+    read_documents = interrupt_reads(monkeypatch, 25)
+    main.sync_data()
+    assert main.checkpoint['backfill']['cocimiento']['after'] == 'doc-19'
+
+    monkeypatch.setattr(main, 'read_documents', read_documents)
+    db.stats.reset()
+    assert main.sync_data() == 15
+    assert db.stats.calls['firestore.cocimiento.read'] == 15
+    assert main.checkpoint['backfill'] == {}
+
+
+def test_interrupted_reconcile_leaves_no_resume_point(monkeypatch):
+    monkeypatch.setattr(main, 'SHEETS_WRITE_CHUNK', 10)
+    db = fakes.FakeFirestore()
+    for i in range(35):
+        db.add_document('cocimiento', f'doc-{i:02d}', {'date': f'2026-10-{i % 28 + 1:02d}'})
+    install(db)
+    main.sync_data()
+    cursor = main.checkpoint['cursors']['cocimiento']
+    for doc in db.collections['cocimiento']:  # Ediciones: cada bloque tiene algo que escribir
+        doc._data['pH (Mosto Macerado) (Ej: 5.4)'] = '5.2'
+
+    read_documents = interrupt_reads(monkeypatch, 25)
+    main.sync_data(reconcile=True)
+    assert main.checkpoint['backfill'] == {}
+    assert main.checkpoint['cursors']['cocimiento'] == cursor
+
+    # La siguiente reconciliación vuelve a recorrer la colección desde el principio
+    monkeypatch.setattr(main, 'read_documents', read_documents)
+    db.stats.reset()
+    main.sync_data(reconcile=True)
+    assert db.stats.calls['firestore.cocimiento.read'] == 35
+
+
+def test_edit_after_a_row_was_deleted_by_hand_lands_on_the_current_row():
+    db = fakes.FakeFirestore()
+    for i in range(3):
+        db.add_document('cocimiento', f'c{i}', {'date': f'2024-03-0{i + 1}'})
+    spreadsheet = install(db)
+    main.sync_data()
+
+    # Alguien borra a mano la fila de c0: c1 y c2 suben una fila
+    worksheet = spreadsheet.worksheet('Cocimiento')
+    start_row = main.start_row_for('cocimiento')
+    del worksheet.rows[start_row - 1]
+
+    doc = db.update_document('cocimiento', 'c2', {'date': '2024-04-01'})
+    main.flush_snapshot_batch({(main.DEFAULT_TARGET, 'cocimiento'): {'c2': doc}})
+
+    rows = worksheet.rows[start_row - 1:]
+    assert [row[0] for row in rows] == ['c1', 'c2']
+    assert rows[0][1] == '2024-03-02'
+    assert rows[1][1] == '2024-04-01'
+
+
+def test_rows_without_hash_adopt_it_without_buffering():
+    db = fakes.FakeFirestore()
+    for i in range(3):
+        db.add_document('cocimiento', f'c{i}', {'date': f'2024-03-0{i + 1}'})
+    spreadsheet = install(db)
+    main.sync_data()
+
+    # Índice de una versión anterior: filas sin hash ni celdas
+    state = main.get_state_db()
+    with state:
+        state.execute('UPDATE sheet_rows SET hash = NULL, cells = NULL')
+
+    worksheet = spreadsheet.worksheet('Cocimiento')
+    sink = main.SheetsSink(worksheet, 'cocimiento')
+    project = main.PROJECTORS['cocimiento']
+    sink.add([project(doc.id, doc.to_dict()) for doc in db.collections['cocimiento']])
+
+    assert sink.pending == [] and sink.changed == []
+    assert state.execute('SELECT COUNT(*) FROM sheet_rows WHERE hash IS NULL').fetchone()[0] == 0
+
+
+def test_new_rows_after_a_row_inserted_by_hand_do_not_overwrite_it():
+    db = fakes.FakeFirestore()
+    for i in range(3):
+        db.add_document('cocimiento', f'c{i}', {'date': f'2024-03-0{i + 1}'})
+    spreadsheet = install(db)
+    main.sync_data()
+
+    # Alguien inserta a mano una fila después de c0
+    worksheet = spreadsheet.worksheet('Cocimiento')
+    start_row = main.start_row_for('cocimiento')
+    worksheet.rows.insert(start_row, ['MANUAL'])
+
+    db.add_document('cocimiento', 'c3', {'date': '2024-03-04'})
+    assert main.sync_data() == 1
+
+    assert [row[0] for row in worksheet.rows[start_row - 1:]] == ['c0', 'MANUAL', 'c1', 'c2', 'c3']
+
+
+def test_edited_rows_are_verified_with_contiguous_ranges(monkeypatch):
+    db = fakes.FakeFirestore()
+    for i in range(30):
+        db.add_document('cocimiento', f'c{i:02d}', {'date': f'2024-03-{i + 1:02d}'})
+    spreadsheet = install(db)
+    main.sync_data()
+
+    worksheet = spreadsheet.worksheet('Cocimiento')
+    reads = []
+    batch_get = worksheet.batch_get
+    monkeypatch.setattr(worksheet, 'batch_get', lambda ranges, **kwargs: reads.append(ranges) or batch_get(ranges))
+
+    batch = {}
+    for i in range(30):
+        batch[f'c{i:02d}'] = db.update_document('cocimiento', f'c{i:02d}', {'date': f'2024-04-{i + 1:02d}'})
+    main.flush_snapshot_batch({(main.DEFAULT_TARGET, 'cocimiento'): batch})
+
+    start_row = main.start_row_for('cocimiento')
+    assert reads == [[f'A{start_row}:A{start_row + 29}']]
+    assert [row[1] for row in worksheet.rows[start_row - 1:]] == [f'2024-04-{i + 1:02d}' for i in range(30)]
+
+
+def test_scattered_rows_are_verified_with_a_capped_number_of_ranges():
+    spreadsheet = install(fakes.FakeFirestore())
+    worksheet = spreadsheet.worksheet('Cocimiento')
+    chunk = [(f'c{i}', 10 + i * 100, '[]') for i in range(120)]
+    for doc_id, row, _ in chunk:
+        worksheet._set_cell(row, 0, doc_id)
+    spreadsheet.stats.reset()
+
+    assert main.rows_match(worksheet, chunk, 'cocimiento')
+    assert spreadsheet.stats.calls['sheets.batch_get'] == math.ceil(120 / main.MAX_RANGES_PER_READ)
+
+    worksheet._set_cell(10 + 57 * 100, 0, 'otro')
+    assert not main.rows_match(worksheet, chunk, 'cocimiento')
@@ -0,0 +1,88 @@
+from datetime import datetime, timezone
+
+import fakes
+import main
+
+TANQUE = 'Tq N°(Ej: 7)'
+EXTRACTO_APARENTE = 'Extrácto aparente [%] p/p (Ej: 2.70)'
+EXTRACTO_ORIGINAL = 'Extrácto original [%] p/p (Ej: 16.0)'
+
+
+def fermentacion(date, tank, aparente='4'):
+    return {'date': date, TANQUE: tank, EXTRACTO_APARENTE: aparente, EXTRACTO_ORIGINAL: '16'}
+
+
+def test_fecha_orden_sorts_iso_day_first_and_timestamps_together():
+    fechas = ['2024-03-02', '01/03/2024 08:00', datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc),
+              '2024-03-01T10:00:00', '03/03/2024', datetime(2024, 2, 28)]
+    ordenadas = sorted(fechas, key=main.fecha_orden)
+    assert ordenadas == [datetime(2024, 2, 28), '01/03/2024 08:00', '2024-03-01T10:00:00',
+                         datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc), '2024-03-02', '03/03/2024']
+
+
+def test_alcohol_tanque_returns_the_reading_as_of_a_date():
+    main.record_tank_alcohol('a', '7', '01/03/2024', 5.0)
+    main.record_tank_alcohol('b', '7', datetime(2024, 3, 5), 6.0)
+    main.record_tank_alcohol('c', '7', '2024-03-10', 7.0)
+
+    assert main.alcohol_tanque('7', '2024-02-28') is None
+    assert main.alcohol_tanque('7', '2024-03-01')['alcohol'] == 5.0
+    assert main.alcohol_tanque('7', '04/03/2024')['alcohol'] == 5.0
+    assert main.alcohol_tanque('7', datetime(2024, 3, 5, 23, 59))['alcohol'] == 6.0
+    assert main.alcohol_tanque('7', '2024-03-31')['alcohol'] == 7.0
+    assert main.alcohol_tanque('7')['alcohol'] == 7.0
+    assert main.alcohol_tanque('8') is None
+
+
+def test_reading_without_tank_is_forgotten():
+    main.indexar_alcohol_tanque('f1', fermentacion('2024-03-01', '7'))
+    assert main.alcohol_tanque('7') is not None
+
+    main.indexar_alcohol_tanque('f1', fermentacion('2024-03-01', ''))
+    assert main.alcohol_tanque('7') is None
+    assert 'f1' not in main.tank_by_doc
+    assert main.get_state_db().execute('SELECT COUNT(*) FROM tank_alcohol').fetchone()[0] == 0
+
+
+def test_deleted_readings_are_dropped_on_a_full_read():
+    db = fakes.FakeFirestore()
+    db.add_document('fermentacion', 'f1', fermentacion('2024-03-01', '7'))
+    db.add_document('fermentacion', 'f2', fermentacion('2024-03-02', '7', aparente='3'))
+    main.install_clients(db, fakes.FakeSheetsClient(fakes.synthetic_spreadsheet()))
+    main.sync_data()
+    assert main.alcohol_tanque('7')['fecha'] == '2024-03-02'
+
+    db.collections['fermentacion'] = [doc for doc in db.collections['fermentacion'] if doc.id != 'f2']
+    main.sync_data(reconcile=True)
+    assert main.alcohol_tanque('7')['fecha'] == '2024-03-01'
+    assert set(main.tank_by_doc) == {'f1'}
+
+
+def test_listener_forgets_removed_readings():
+    db = fakes.FakeFirestore()
+    db.add_document('fermentacion', 'f1', fermentacion('2024-03-01', '7'))
+    main.install_clients(db, fakes.FakeSheetsClient(fakes.synthetic_spreadsheet()))
+    main.sync_data()
+
+    buffer = main.SnapshotBuffer(lambda batch: None, debounce=60)
+    main.start_listeners(main.firestore_subscribe, buffer)
+    try:
+        db.delete_document('fermentacion', 'f1')
+    finally:
+        main.stop_listeners()
+    assert main.alcohol_tanque('7') is None
+
+
+def test_reconcile_does_not_log_every_existing_blend(capsys):
+    db = fakes.FakeFirestore()
+    db.add_document('fermentacion', 'f1', fermentacion('2024-03-01', '7'))
+    for i in range(3):
+        db.add_document('tanque_presion', f't{i}', {'date': '2024-03-02', 'Volumen total [L] (Ej: 6650)': '100',
+                                                    'Tanque A (Ej: 1)': '7',
+                                                    'Volumen total del Tanque A [L] (Ej: 2650)': '100'})
+    main.install_clients(db, fakes.FakeSheetsClient(fakes.synthetic_spreadsheet()))
+    main.sync_data()
+    capsys.readouterr()
+
+    main.sync_data(reconcile=True)
+    assert 'Usando tanque' not in capsys.readouterr().out
@@ -0,0 +1,36 @@
+import fakes
+import main
+
+
+def with_broken_target(monkeypatch):
+    default = main.SYNC_TARGETS[main.DEFAULT_TARGET]
+    broken = {**default, 'name': 'rota', 'spreadsheet': 'Missing', 'sheets_key': 'rota-sheets.json',
+              'firebase_key': 'rota-firebase.json'}
+    monkeypatch.setattr(main, 'SYNC_TARGETS', {'rota': broken, main.DEFAULT_TARGET: default})
+    main.install_clients(fakes.FakeFirestore(), fakes.FakeSheetsClient(), target=broken)
+
+    db = fakes.FakeFirestore()
+    db.add_document('cocimiento', 'c0', {'date': '2024-03-01'})
+    spreadsheet = fakes.synthetic_spreadsheet()
+    main.install_clients(db, fakes.FakeSheetsClient(spreadsheet), target=default)
+    return db, spreadsheet.worksheet('Cocimiento')
+
+
+def test_unopenable_spreadsheet_does_not_stop_other_targets(monkeypatch):
+    _, worksheet = with_broken_target(monkeypatch)
+    errors_before = main.metrics.total('sync_errors_total', target='rota')
+
+    assert main.sync_data() == 1
+    start_row = main.start_row_for('cocimiento')
+    assert [row[0] for row in worksheet.rows[start_row - 1:]] == ['c0']
+    assert main.metrics.total('sync_errors_total', target='rota') == errors_before + 1
+
+
+def test_listener_batch_skips_an_unopenable_spreadsheet(monkeypatch):
+    db, worksheet = with_broken_target(monkeypatch)
+    monkeypatch.setattr(main, 'sync_scheduler', main.SyncScheduler(sync=lambda reconcile=False: 0))
+    docs = {doc.id: doc for doc in db.collections['cocimiento']}
+
+    assert main.flush_snapshot_batch({('rota', 'cocimiento'): docs, (main.DEFAULT_TARGET, 'cocimiento'): docs}) == 1
+    start_row = main.start_row_for('cocimiento')
+    assert [row[0] for row in worksheet.rows[start_row - 1:]] == ['c0']